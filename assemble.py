@@ -1,20 +1,24 @@
 #!/usr/bin/env python
 
+import os
 import sys
 import argparse
 import logging
-import pickle
 
-from assembler.Assembler import Assembler
-from assembler.Exceptions import ParseError
-from assembler.Exceptions import AssemblyError
+from assembler import Batch
+from assembler.AssembleCache import AssembleCache, DEFAULT_CACHE_SIZE, getDefaultDirectory
 
 def main(argc, argv):
 	parser = argparse.ArgumentParser(description='VM32 Assembler')
 	parser.add_argument('-d', '--debug', action='store_true', dest='debug', help='Display debug information (DEBUG)')
 
-	parser.add_argument('inputFile', nargs=1, type=argparse.FileType('r'), help='The input file to assemble')
-	parser.add_argument('-o', '--output', action='store', nargs=1, dest='outFileName', help='Output filename', metavar="outFileName", required=False)
+	parser.add_argument('inputFiles', metavar='inputFile', nargs='+', help='The input files to assemble')
+	parser.add_argument('-o', '--output', action='store', nargs=1, dest='outFileName', help='Output filename of a single input file (default: out.obj)', metavar="outFileName", required=False)
+	parser.add_argument('-O', '--output-dir', action='store', dest='outputDirectory', help='Directory of the object files, named after their input files (default: next to the input files)', metavar='outputDirectory', required=False)
+	parser.add_argument('-p', '--processes', action='store', dest='processes', type=int, help='Number of processes assembling multiple input files (default: one per CPU core)')
+	parser.add_argument('--cache-dir', action='store', dest='cacheDirectory', help='Directory of the cache of assembled object files (default: objects in $VM32_CACHE_DIR or ~/.cache/vm32, currently %s)' % getDefaultDirectory(), metavar='cacheDirectory')
+	parser.add_argument('--cache-size', action='store', dest='cacheSize', type=int, default=DEFAULT_CACHE_SIZE, help='Maximum size of the cached object files in bytes (default: %(default)d)')
+	parser.add_argument('--no-cache', action='store_false', dest='useCache', help='Always assemble the input files instead of using cached object files')
 
 	arguments = parser.parse_args(argv[1:])
 	
@@ -25,41 +29,42 @@ def main(argc, argv):
 		logging.basicConfig(level=logging.INFO)
 	logger = logging.getLogger('Assembler Frontend')
 
-	#create and truncate output file
-	try:
-		inputFile = arguments.inputFile[0]
-
-		if arguments.outFileName != None:
-			outputFile = open(arguments.outFileName[0], 'w+')
-		else:
-			outputFile = open('out.obj', 'w+')
-		logger.debug("Writing to file %s", outputFile.name)
+	#a single input file without an output directory keeps the old default output filename
+	if arguments.outFileName != None:
+		if len(arguments.inputFiles) != 1:
+			parser.error("-o can only be used with a single input file, use -O for multiple files")
+		paths = [(arguments.inputFiles[0], arguments.outFileName[0])]
+	elif len(arguments.inputFiles) == 1 and arguments.outputDirectory == None:
+		paths = [(arguments.inputFiles[0], 'out.obj')]
+	else:
+		paths = [(inputFile, Batch.getObjectPath(inputFile, arguments.outputDirectory)) for inputFile in arguments.inputFiles]
 
-		#create assembler
-		asm = Assembler()
+	outputPaths = [os.path.abspath(outputPath) for (inputPath, outputPath) in paths]
+	if len(set(outputPaths)) != len(outputPaths):
+		parser.error("multiple input files would be written to the same object file")
 
-		#assemble the file
-		assembled = asm.assemble(inputFile.read())
+	if arguments.outputDirectory != None and not os.path.isdir(arguments.outputDirectory):
+		os.makedirs(arguments.outputDirectory)
 
-		#serialize the assembled file and save it
-		pickle.dump(assembled, outputFile)
+	cache = None
+	if arguments.useCache:
+		try:
+			cache = AssembleCache(arguments.cacheDirectory, arguments.cacheSize)
+		except OSError, e:
+			logger.warning("Not using the assembler cache: %s", e)
 
-		#cleanup
-		outputFile.close()
+	failed = False
+	for result in Batch.assembleFiles(paths, arguments.processes, cache):
+		if result.error != None:
+			logger.error("%s: %s", result.inputPath, result.error)
+			failed = True
+		elif result.cached:
+			logger.debug("Copied cached object file of %s to %s", result.inputPath, result.outputPath)
+		else:
+			logger.debug("Assembled %s to %s", result.inputPath, result.outputPath)
 
-	except IOError, e:
-		logger.error(e)
+	if failed:
 		sys.exit(-1)
-	except ParseError, e:
-		logger.error(e)
-		sys.exit(-1)
-	except AssemblyError, e:
-		logger.error(e)
-		sys.exit(-1)
-	#except Exception, e:
-	#	logger.error(e)
-	#	sys.exit(-1)
-
 
 if __name__ == '__main__':
 	main(len(sys.argv), sys.argv)
@@ -0,0 +1,110 @@
+import os
+import glob
+import shutil
+import hashlib
+
+import TableCache
+from ObjectFile import OBJECT_FILE_VERSION
+
+#default bound of the total size of the cached object files in bytes
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+_assemblerDigest = None
+
+def getAssemblerDigest():
+	""" Returns a hash of the assembler sources, the opcodes and the object file version,
+		so object files cached by another version of the assembler are never used
+	"""
+	global _assemblerDigest
+	if _assemblerDigest is None:
+		package = os.path.dirname(os.path.abspath(__file__))
+		sources = sorted(glob.glob(os.path.join(package, '*.py')))
+		sources.append(os.path.join(os.path.dirname(package), 'common', 'Opcodes.py'))
+
+		digest = hashlib.sha1(str(OBJECT_FILE_VERSION))
+		for source in sources:
+			with open(source, 'rb') as sourceFile:
+				digest.update(sourceFile.read())
+		_assemblerDigest = digest.hexdigest()
+
+	return _assemblerDigest
+
+def getDefaultDirectory():
+	""" Returns the default cache directory, objects in $VM32_CACHE_DIR or in ~/.cache/vm32 """
+	return os.path.join(TableCache.getCacheDirectory(), 'objects')
+
+class AssembleCache(object):
+	""" Content addressed cache of assembled object files on local disk.
+
+		Entries are keyed by the hash of the source text (which contains all its .define
+		directives) and the assembler version. A hit touches the entry, after storing an
+		entry the least recently used ones are removed until the entries fit in maxSize
+		bytes. Entries are written under a temporary name and renamed, so concurrent
+		assemblers share a cache safely.
+	"""
+
+	def __init__(self, directory=None, maxSize=DEFAULT_CACHE_SIZE):
+		if directory is None:
+			directory = getDefaultDirectory()
+
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+
+		self.directory = directory
+		self.maxSize = maxSize
+
+	def getKey(self, source):
+		return hashlib.sha1(getAssemblerDigest() + "\x00" + source).hexdigest()
+
+	def _getPath(self, key):
+		return os.path.join(self.directory, key + '.obj')
+
+	def fetch(self, key, outputPath):
+		""" Copies the object file cached under key to outputPath, returns False if there is none """
+		path = self._getPath(key)
+		try:
+			shutil.copyfile(path, outputPath)
+			os.utime(path, None)
+		except (IOError, OSError):
+			return False
+
+		return True
+
+	def store(self, key, objectPath):
+		""" Caches a copy of the object file at objectPath under key and evicts the least
+			recently used entries
+		"""
+		path = self._getPath(key)
+		temporaryPath = "%s.%d" % (path, os.getpid())
+
+		shutil.copyfile(objectPath, temporaryPath)
+		os.rename(temporaryPath, path)
+
+		self.evict(path)
+
+	def evict(self, keep=None):
+		""" Removes the least recently used entries except the one at path keep """
+		entries = []
+		for name in os.listdir(self.directory):
+			if name.endswith('.obj'):
+				path = os.path.join(self.directory, name)
+				try:
+					status = os.stat(path)
+				except OSError:
+					continue
+				entries.append((status.st_mtime, status.st_size, path))
+
+		entries.sort()
+		size = sum(entrySize for (mtime, entrySize, path) in entries)
+
+		for (mtime, entrySize, path) in entries:
+			if size <= self.maxSize:
+				break
+			if path == keep:
+				continue
+
+			try:
+				os.remove(path)
+			except OSError:
+				pass
+			size -= entrySize
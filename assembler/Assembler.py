@@ -1,5 +1,5 @@
 import logging
-import struct
+from array import array
 from collections import defaultdict
 
 from Exceptions import AssemblyError, InstructionError
@@ -113,7 +113,7 @@ class Assembler(object):
 		defines = {}
 		privilegeLevel = 0
 
-		seg_data = defaultdict(list)
+		seg_data = defaultdict(lambda: array('I'))
 
 		export_table = []
 		import_table = []
@@ -144,7 +144,7 @@ class Assembler(object):
 								addr=SegAddr(addr.segment, offset+arg["offsetInInstruction"])))
 
 					#add instruction to current segment
-					seg_data[addr.segment].extend(list(instruction.op))
+					seg_data[addr.segment].extend(instruction.op)
 				except InstructionError,e:
 					self._assembly_error(e, line.lineno)
 
@@ -174,30 +174,28 @@ class Assembler(object):
 
 				#allocate n words of space and initialize them with zeros
 				elif line.name == '.alloc':
-					num = line.args[0].val
-					for i in range(num):
-						seg_data[addr.segment].extend([struct.pack("<I", 0)])
+					seg_data[addr.segment].extend(array('I', [0]) * line.args[0].val)
 
 				#allocate n words of space and initialize them with the values in the arguments
 				elif line.name == '.word':
-					data = []
+					data = array('I')
 
 					for i, word_arg in enumerate(line.args):
 						if isinstance(word_arg, Number):
 							try:
-								data.extend([struct.pack("<I", word_arg.val)])
+								data.append(word_arg.val)
 							except:
 								self._assembly_error(".word -- argument %s is not a valid 32 bit word" % (i + 1,), line.lineno)
 						elif isinstance(word_arg, Id):
 							if word_arg.id in defines:
-								data.extend([struct.pack("<I", defines[word_arg.id])])
+								data.append(defines[word_arg.id])
 							elif word_arg.id in symtab:
-								data.extend([struct.pack("<I", symtab[word_arg.id].offset)])
+								data.append(symtab[word_arg.id].offset)
 								reloc_table.append(RelocEntry(
 									reloc_segment=symtab[word_arg.id].segment,
 									addr=SegAddr(addr.segment, len(seg_data[addr.segment]) + i)))
 							else:
-								data.extend([struct.pack("<I", 0)])
+								data.append(0)
 								import_table.append(ImportEntry(
 									import_symbol=word_arg.id,
 									addr=SegAddr(addr.segment, len(seg_data[addr.segment]) + i)))
@@ -208,10 +206,8 @@ class Assembler(object):
 
 				#allocate space for a string and zero terminate it
 				elif line.name == '.string':
-					data = []
-					for c in line.args[0].val:
-						data.extend([chr(ord(c)) + "\x00\x00\x00"])
-					data.extend(["\x00\x00\x00\x00"])
+					data = array('I', [ord(c) for c in line.args[0].val])
+					data.append(0)
 					seg_data[addr.segment].extend(data)
 
 				else:
@@ -224,7 +220,7 @@ class Assembler(object):
 
 		#create an objectfile containing all segments with their data, import-, export- and relocation tables
 		return ObjectFile.fromAssembler(
-			seg_data=seg_data,
+			seg_data=dict(seg_data),
 			export_table=export_table,
 			import_table=import_table,
 			reloc_table=reloc_table,
@@ -0,0 +1,82 @@
+import os
+import multiprocessing
+import traceback
+from collections import namedtuple
+
+from .Exceptions import ParseError, AssemblyError
+
+#outcome of assembling inputPath into outputPath, error is the message or traceback of a
+#failure (None on success), cached tells if the object file was taken from the AssembleCache
+AssembleResult = namedtuple("AssembleResult", ["inputPath", "outputPath", "error", "cached"])
+
+#the assembler of a process, built on first use and shared by all its files
+_assembler = None
+
+#the AssembleCache of a worker process
+_cache = None
+
+def getObjectPath(inputPath, outputDirectory=None):
+	""" Returns the path of the object file of inputPath: the same name with the extension
+		.obj, in outputDirectory or next to the input
+	"""
+	(directory, name) = os.path.split(inputPath)
+	if outputDirectory is not None:
+		directory = outputDirectory
+	return os.path.join(directory, os.path.splitext(name)[0] + '.obj')
+
+def _getAssembler():
+	global _assembler
+	if _assembler is None:
+		#imported on first use, a build taking all object files from the cache never loads the parser
+		from .Assembler import Assembler
+		_assembler = Assembler()
+	return _assembler
+
+def assembleFile(inputPath, outputPath, cache=None):
+	""" Assembles inputPath into the object file outputPath, the object file is only
+		written if assembling succeeded. Sources cached in cache aren't assembled again.
+	"""
+	try:
+		with open(inputPath, 'r') as inputFile:
+			source = inputFile.read()
+
+		if cache is not None:
+			key = cache.getKey(source)
+			if cache.fetch(key, outputPath):
+				return AssembleResult(inputPath, outputPath, None, True)
+
+		assembled = _getAssembler().assemble(source)
+
+		with open(outputPath, 'wb') as outputFile:
+			assembled.write(outputFile)
+
+		if cache is not None:
+			cache.store(key, outputPath)
+
+		return AssembleResult(inputPath, outputPath, None, False)
+	except (IOError, ParseError, AssemblyError), e:
+		return AssembleResult(inputPath, outputPath, str(e), False)
+	except Exception:
+		return AssembleResult(inputPath, outputPath, traceback.format_exc(), False)
+
+def _initializeWorker(cache):
+	global _cache
+	_cache = cache
+
+def _assembleFile(paths):
+	return assembleFile(paths[0], paths[1], _cache)
+
+def assembleFiles(paths, processes=None, cache=None):
+	""" Assembles a list of (inputPath, outputPath) in a pool of processes (one per CPU
+		core by default) and returns their AssembleResults in the order of paths. With a
+		single process or a single file the files are assembled in the calling process.
+	"""
+	if processes == 1 or len(paths) <= 1:
+		return [assembleFile(inputPath, outputPath, cache) for (inputPath, outputPath) in paths]
+
+	pool = multiprocessing.Pool(min(processes or multiprocessing.cpu_count(), len(paths)), _initializeWorker, (cache,))
+	try:
+		return pool.map(_assembleFile, paths)
+	finally:
+		pool.close()
+		pool.join()
@@ -1,3 +1,4 @@
 class ParseError(Exception): pass
 class AssemblyError(Exception): pass
 class InstructionError(Exception): pass
+class ObjectFileError(Exception): pass
@@ -1,4 +1,4 @@
-import struct
+from array import array
 
 from common.Opcodes import *
 from Parser import Number, Id, String, MemRef, DoubleMemRef, Instruction, Directive, LabelDef, Register, SpecialRegister
@@ -355,12 +355,10 @@ def assembleInstruction(name, args, addr, symtab, defines, privilegeLevel):
 
 	assert len(operandTypes) == 2, "len(operandTypes) is not 2"
 	
-	assembled = [
-		struct.pack("<BBBB", instr["op"], privilegeLevel, operandTypes[0], operandTypes[1])
-	]
+	assembled = array('I', [instr["op"] | privilegeLevel << 8 | operandTypes[0] << 16 | operandTypes[1] << 24])
 
 	#append argument values
-	assembled.extend(map(lambda x: struct.pack("<I", x), operandValues))
+	assembled.extend(operandValues)
 
 	#put everything into a container object and return it for further processing
 	#return AssembledInstruction(op=assembled, import_req=importedSymbols, reloc_req=relocations)
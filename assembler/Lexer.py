@@ -1,12 +1,15 @@
 import ply.lex as lex
 import re
+import os
+
+import TableCache
 
 #LEX Example: http://www.dabeaz.com/ply/ply.html#ply_nn4
 
 class Lexer(object):
 	def __init__(self, error_callback):
 		self._error_callback = error_callback
-		self.lexer = lex.lex(object=self)
+		self.lexer = _buildLexer(self)
 
 	def input(self, text):
 		self.lexer.input(text)
@@ -85,3 +88,26 @@ class Lexer(object):
 	def t_error(self, t):
 		self._error_callback("Illegal character '%s' at line %s" % (t.value[0], t.lineno))
 		t.lexer.skip(1)
+
+def _buildLexer(lexer):
+	""" Builds the lexer from the table cached in optimize mode, the table is generated
+		and cached on first use
+	"""
+	directory = TableCache.prepareCacheDirectory()
+	if directory is None:
+		return lex.lex(object=lexer)
+
+	name = TableCache.getTableName('lextab', __file__)
+	path = os.path.join(directory, name + '.py')
+
+	table = TableCache.loadModule(name, path)
+	if table is not None:
+		return lex.lex(object=lexer, optimize=1, lextab=table)
+
+	temporaryName = TableCache.getTemporaryName(name)
+	built = lex.lex(object=lexer, optimize=1, lextab=temporaryName, outputdir=directory)
+	try:
+		os.rename(os.path.join(directory, temporaryName + '.py'), path)
+	except OSError:
+		pass
+	return built
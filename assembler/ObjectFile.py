@@ -1,17 +1,152 @@
-from collections import namedtuple
+import sys
+import mmap
+import struct
+import pickle
+from array import array
+from collections import namedtuple, defaultdict
+
+from CommonTypes import SegAddr
+from Exceptions import ObjectFileError
 
 ExportEntry = namedtuple('ExportEntry', 'export_symbol addr')
 ImportEntry = namedtuple('ImportEntry', 'import_symbol addr')
 RelocEntry = namedtuple('RelocEntry', 'reloc_segment addr')
 
+#binary object file layout, all numbers are little endian 32 bit words:
+#	header			magic, version, name string (NO_STRING for none) and the number of
+#					strings, segments, exports, import groups, relocation groups and symbols
+#	strings			length of every string followed by all strings, padded to a word
+#	segments		(name string, number of words) per segment
+#	exports			(symbol string, segment name string, offset) per export
+#	import/reloc
+#	groups			(string, segment name string, number of sites) per group of sites with
+#					the same symbol (or segment a relocation refers to) in the same segment
+#	symbols			(symbol string, segment name string, offset) per symbol
+#	import/reloc
+#	sites			offsets of the sites of all import groups, then of all relocation groups
+#	segment data	words of all segments in the order of the segment table
+OBJECT_FILE_MAGIC = "VM32OBJ\x00"
+OBJECT_FILE_VERSION = 2
+NO_STRING = 0xFFFFFFFF
+
+_HEADER = struct.Struct("<8s8I")
+
+def _words(values):
+	words = array('I', values)
+	if sys.byteorder == 'big':
+		words.byteswap()
+	return words
+
+def _writeWords(objectFile, words):
+	if sys.byteorder == 'big':
+		words = array('I', words)
+		words.byteswap()
+	words.tofile(objectFile)
+
+def _readWords(data, start, count):
+	words = array('I')
+	words.fromstring(data[start:start + count * 4])
+	if sys.byteorder == 'big':
+		words.byteswap()
+	return words
+
+def _readSites(data, position, groups, strings):
+	""" Reads the sites of groups, returns the sites by (string, segment) and the position after them """
+	offsets = _readWords(data, position, sum(groups[2::3]))
+	if len(offsets) != sum(groups[2::3]):
+		raise ObjectFileError("Truncated object file sites")
+
+	sites = {}
+	start = 0
+	for i in xrange(0, len(groups), 3):
+		end = start + groups[i + 2]
+		sites[strings[groups[i]], strings[groups[i + 1]]] = offsets[start:end]
+		start = end
+
+	return (sites, position + len(offsets) * 4)
+
+def _groupSites(table):
+	sites = defaultdict(lambda: array('I'))
+	for (name, addr) in table:
+		sites[name, addr.segment].append(addr.offset)
+	return dict(sites)
+
+def _expandSites(sites, entryType):
+	return [entryType(name, SegAddr(segment, offset)) for ((name, segment), offsets) in sorted(sites.iteritems()) for offset in offsets]
+
 class ObjectFile(object):
+	""" Segments, exports, symbols and import and relocation sites of an assembled file.
+
+		Import and relocation sites are available as tables of entries and grouped by
+		(symbol or segment a relocation refers to, segment of the site) into arrays of
+		offsets for the linker. Object files read from disk only have the groups, the
+		tables are built from them on first use and vice versa.
+	"""
+
 	def __init__(self):
 		self.name = None
 		self.seg_data = {}
 		self.export_table = []
-		self.import_table = []
-		self.reloc_table = []
-		self.symbol_table = []
+		self.symbol_table = {}
+		self._import_table = []
+		self._reloc_table = []
+		self._import_sites = None
+		self._reloc_sites = None
+
+	def __setstate__(self, state):
+		#object files pickled by older versions keep the tables in plain attributes
+		self.__init__()
+		for (key, value) in state.iteritems():
+			setattr(self, key, value)
+
+	def _getImportTable(self):
+		if self._import_table is None:
+			self._import_table = _expandSites(self._import_sites, ImportEntry)
+		return self._import_table
+
+	def _setImportTable(self, table):
+		self._import_table = table
+		self._import_sites = None
+
+	def _getRelocTable(self):
+		if self._reloc_table is None:
+			self._reloc_table = _expandSites(self._reloc_sites, RelocEntry)
+		return self._reloc_table
+
+	def _setRelocTable(self, table):
+		self._reloc_table = table
+		self._reloc_sites = None
+
+	import_table = property(_getImportTable, _setImportTable)
+	reloc_table = property(_getRelocTable, _setRelocTable)
+
+	def getImportSites(self):
+		""" Returns the offsets of the import sites by (symbol, segment of the site) """
+		if self._import_sites is None:
+			self._import_sites = _groupSites(self._import_table)
+		return self._import_sites
+
+	def getRelocationSites(self):
+		""" Returns the offsets of the relocation sites by (segment the relocation refers to, segment of the site) """
+		if self._reloc_sites is None:
+			self._reloc_sites = _groupSites(self._reloc_table)
+		return self._reloc_sites
+
+	def withSegments(self, segments):
+		""" Returns a copy with only the given segments and the exports, symbols and sites
+			in them, the segment data is shared
+		"""
+		segments = set(segments)
+		obj = ObjectFile()
+		obj.name = self.name
+		obj.seg_data = dict((segment, data) for (segment, data) in self.seg_data.iteritems() if segment in segments)
+		obj.export_table = [export for export in self.export_table if export.addr.segment in segments]
+		obj.symbol_table = dict((symbol, addr) for (symbol, addr) in self.symbol_table.iteritems() if addr.segment in segments)
+		obj._import_sites = dict((key, offsets) for (key, offsets) in self.getImportSites().iteritems() if key[1] in segments)
+		obj._reloc_sites = dict((key, offsets) for (key, offsets) in self.getRelocationSites().iteritems() if key[1] in segments)
+		obj._import_table = None
+		obj._reloc_table = None
+		return obj
 
 	@classmethod
 	def fromAssembler(cls, seg_data, export_table, import_table, reloc_table, symbol_table):
@@ -30,6 +165,122 @@ class ObjectFile(object):
 
 		return obj
 
+	@classmethod
+	def createFromFile(cls, objectFile):
+		""" Reads a binary object file, object files pickled by older versions of the
+			assembler are loaded with pickle
+		"""
+		objectFile.seek(0)
+		if objectFile.read(len(OBJECT_FILE_MAGIC)) != OBJECT_FILE_MAGIC:
+			objectFile.seek(0)
+			obj = pickle.load(objectFile)
+
+			#pickled segments are lists of packed words
+			obj.seg_data = dict((segment, _readWords("".join(words), 0, len(words))) for (segment, words) in obj.seg_data.iteritems())
+			return obj
+
+		data = mmap.mmap(objectFile.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			return cls._parse(data)
+		finally:
+			data.close()
+
+	@classmethod
+	def _parse(cls, data):
+		if len(data) < _HEADER.size:
+			raise ObjectFileError("Truncated object file header")
+
+		(magic, version, name, stringCount, segmentCount, exportCount, importCount, relocCount, symbolCount) = _HEADER.unpack_from(data)
+		if version != OBJECT_FILE_VERSION:
+			raise ObjectFileError("Unsupported object file version %d" % version)
+
+		position = _HEADER.size
+		tableSize = stringCount + 2 * segmentCount + 3 * (exportCount + importCount + relocCount + symbolCount)
+		if len(data) < position + tableSize * 4:
+			raise ObjectFileError("Truncated object file tables")
+
+		#intern all strings once, the tables refer to them by index
+		lengths = _readWords(data, position, stringCount)
+		position += stringCount * 4
+		strings = []
+		for length in lengths:
+			strings.append(data[position:position + length])
+			position += length
+		position = (position + 3) & ~3
+
+		def entries(count):
+			words = _readWords(data, position, 3 * count)
+			return [(strings[words[i]], SegAddr(strings[words[i + 1]], words[i + 2])) for i in xrange(0, len(words), 3)]
+
+		obj = cls()
+		obj.name = strings[name] if name != NO_STRING else None
+
+		segments = _readWords(data, position, 2 * segmentCount)
+		position += 8 * segmentCount
+		obj.export_table = [ExportEntry(symbol, addr) for (symbol, addr) in entries(exportCount)]
+		position += 12 * exportCount
+
+		importGroups = _readWords(data, position, 3 * importCount)
+		position += 12 * importCount
+		relocGroups = _readWords(data, position, 3 * relocCount)
+		position += 12 * relocCount
+		obj.symbol_table = dict(entries(symbolCount))
+		position += 12 * symbolCount
+
+		#the tables are only built if they are used
+		(obj._import_sites, position) = _readSites(data, position, importGroups, strings)
+		(obj._reloc_sites, position) = _readSites(data, position, relocGroups, strings)
+		obj._import_table = None
+		obj._reloc_table = None
+
+		for i in xrange(0, len(segments), 2):
+			end = position + segments[i + 1] * 4
+			if len(data) < end:
+				raise ObjectFileError("Truncated data of segment %s" % strings[segments[i]])
+
+			obj.seg_data[strings[segments[i]]] = _readWords(data, position, segments[i + 1])
+			position = end
+
+		return obj
+
+	def write(self, objectFile):
+		""" Writes the object file in the binary format """
+		strings = {}
+		def intern(string):
+			if string not in strings:
+				strings[string] = len(strings)
+			return strings[string]
+
+		def entries(table):
+			return _words(value for (symbol, addr) in table for value in (intern(symbol), intern(addr.segment), addr.offset))
+
+		def groups(sites):
+			return _words(value for ((string, segment), offsets) in sites for value in (intern(string), intern(segment), len(offsets)))
+
+		segmentNames = sorted(self.seg_data)
+		segments = _words(value for segment in segmentNames for value in (intern(segment), len(self.seg_data[segment])))
+		exports = entries(self.export_table)
+		importSites = sorted(self.getImportSites().iteritems())
+		imports = groups(importSites)
+		relocSites = sorted(self.getRelocationSites().iteritems())
+		relocs = groups(relocSites)
+		symbols = entries(sorted(self.symbol_table.iteritems()))
+		name = intern(self.name) if self.name is not None else NO_STRING
+
+		stringTable = sorted(strings, key=strings.get)
+		stringData = "".join(stringTable)
+
+		objectFile.write(_HEADER.pack(OBJECT_FILE_MAGIC, OBJECT_FILE_VERSION, name, len(stringTable),
+			len(segmentNames), len(self.export_table), len(importSites), len(relocSites), len(self.symbol_table)))
+		objectFile.write(_words(len(string) for string in stringTable).tostring())
+		objectFile.write(stringData + "\x00" * (-len(stringData) % 4))
+		for table in (segments, exports, imports, relocs, symbols):
+			table.tofile(objectFile)
+		for (key, offsets) in importSites + relocSites:
+			_writeWords(objectFile, offsets)
+		for segment in segmentNames:
+			_writeWords(objectFile, self.seg_data[segment])
+
 	def __repr__(self):
 		str =  "\nObjectFile:\n"
 		str += "\tseg_data: %s\n" % self.seg_data
@@ -1,10 +1,13 @@
 #taken from http://code.google.com/p/luz-cpu/source/browse/luz_asm_sim/lib/asmlib/asmparser.py
 
+import os
 import ply.yacc as yacc
+import Lexer as LexerModule
 from Lexer import Lexer
 from collections import namedtuple
 
 from Exceptions import ParseError
+import TableCache
 
 Number = namedtuple('Number', 'val')
 Id = namedtuple('Id', 'id')
@@ -18,11 +21,13 @@ Directive = namedtuple('Directive', 'label name args lineno')
 LabelDef = namedtuple('LabelDef', 'label lineno')
 
 class Parser(object):
+	""" Parser of assembler source files, a Parser can parse any number of files """
+
 	def __init__(self):
 		self.lexer = Lexer(error_callback=self._lexer_error)
 		self.tokens = self.lexer.tokens
 
-		self.parser = yacc.yacc(module=self)
+		self.parser = _buildParser(self)
 
 	def parse(self, text):
 		self.lexer.reset()
@@ -190,3 +195,26 @@ class Parser(object):
 	def p_error(self, p):
 		next_t = yacc.token()
 		raise ParseError("invalid code before %s (at line %s)" % (repr(next_t.value), next_t.lineno))
+
+def _buildParser(parser):
+	""" Builds the parser from the LALR tables cached in optimize mode, the tables are
+		generated and cached on first use
+	"""
+	directory = TableCache.prepareCacheDirectory()
+	if directory is None:
+		return yacc.yacc(module=parser, debug=False, write_tables=False)
+
+	#the grammar uses the tokens of the lexer
+	name = TableCache.getTableName('parsetab', __file__, LexerModule.__file__)
+	path = os.path.join(directory, name + '.pickle')
+
+	if os.path.exists(path):
+		return yacc.yacc(module=parser, debug=False, optimize=1, picklefile=path)
+
+	temporaryPath = os.path.join(directory, TableCache.getTemporaryName(name) + '.pickle')
+	built = yacc.yacc(module=parser, debug=False, picklefile=temporaryPath)
+	try:
+		os.rename(temporaryPath, path)
+	except OSError:
+		pass
+	return built
@@ -0,0 +1,53 @@
+import os
+import sys
+import imp
+import hashlib
+
+import ply
+
+#environment variable overriding the directory of the cached tables
+CACHE_DIRECTORY_VARIABLE = 'VM32_CACHE_DIR'
+
+def getCacheDirectory():
+	""" Returns the directory of the cached tables, $VM32_CACHE_DIR or vm32 in the user's cache directory """
+	directory = os.environ.get(CACHE_DIRECTORY_VARIABLE)
+	if not directory:
+		cache = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+		directory = os.path.join(cache, 'vm32')
+	return directory
+
+def getTableName(prefix, *sourceFiles):
+	""" Returns the name of the table generated from the grammar in sourceFiles, the name
+		changes with the sources, the PLY version and the Python version so stale tables
+		are never loaded. Tables loaded in optimize mode aren't checked against the grammar
+		by PLY, so all sources the grammar depends on (e.g. the tokens of the lexer) must
+		be given.
+	"""
+	digest = hashlib.sha1(ply.__version__ + sys.version)
+	for sourceFile in sourceFiles:
+		with open(os.path.splitext(sourceFile)[0] + '.py', 'rb') as source:
+			digest.update(source.read())
+	return "%s_%s" % (prefix, digest.hexdigest()[:16])
+
+def prepareCacheDirectory():
+	""" Creates the cache directory, returns None if it can't be used """
+	directory = getCacheDirectory()
+	try:
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+	except OSError:
+		if not os.path.isdir(directory):
+			return None
+	return directory if os.access(directory, os.W_OK) else None
+
+def getTemporaryName(name):
+	""" Name the table is generated under before it is renamed to name, so concurrent
+		assemblers never read a partially written table
+	"""
+	return "%s_%d" % (name, os.getpid())
+
+def loadModule(name, path):
+	""" Imports a cached table module from path, returns None if it doesn't exist """
+	if not os.path.exists(path):
+		return None
+	return imp.load_source(name, path)
@@ -8,6 +8,8 @@ import struct
 import cmd
 
 from simulator.CPU import CPU
+from simulator.Memory import Memory
+from simulator.RunControl import StopCondition, STOP_HALTED, STOP_BREAKPOINT, STOP_INTERRUPTED
 from utils.Disassembler import Disassembler
 from common import Opcodes
 
@@ -15,7 +17,7 @@ def main(argc, argv):
 	parser = argparse.ArgumentParser(description='VM32 Debuuger')
 	parser.add_argument('-d', '--debug', action='store_true', dest='debug', help='Display debug information (DEBUG)')
 
-	parser.add_argument('memoryImage', metavar='memory image', type=argparse.FileType('r'), help='Image to be loaded into the system memory')
+	parser.add_argument('memoryImage', metavar='memory image', type=argparse.FileType('rb'), help='Image to be loaded into the system memory')
 
 	arguments = parser.parse_args(argv[1:])
 	
@@ -25,7 +27,7 @@ def main(argc, argv):
 	else:
 		logging.basicConfig(level=logging.INFO)
 
-	cpu = CPU(arguments.memoryImage.read())
+	cpu = CPU(memory=Memory.createFromFile(arguments.memoryImage))
 
 	#history stuff, if it fails don't worry and carry on
 	try:
@@ -120,7 +122,7 @@ class DebuggerShell(cmd.Cmd):
 		print getRegisterStringRepresentation(self.cpu.state)
 
 	def do_step(self, line):
-		if not self.cpu.doSimulationStep():
+		if self.cpu.run(1).reason == STOP_HALTED:
 			print "CPU Simulation ended"
 			return
 
@@ -145,20 +147,16 @@ class DebuggerShell(cmd.Cmd):
 			print "Argument parsing failed"
 
 	def do_continue(self, line):
-		while True:
-			try:
-				if self.cpu.state.IP in self.breakpoints:
-					print "Breakpoint hit at 0x%08x" % self.cpu.state.IP
-					(text, consumedWords) = disassembleInstruction(self.cpu, self.cpu.state.IP)
-					print text
-					return
-
-				if not self.cpu.doSimulationStep():
-					print "CPU Simulation ended"
-					return
-			except KeyboardInterrupt:
-				print "Breaking at 0x%08x" % self.cpu.state.IP
-				return
+		result = self.cpu.run(until=StopCondition(breakpoints=self.breakpoints))
+
+		if result.reason == STOP_BREAKPOINT:
+			print "Breakpoint hit at 0x%08x" % result.address
+			(text, consumedWords) = disassembleInstruction(self.cpu, result.address)
+			print text
+		elif result.reason == STOP_HALTED:
+			print "CPU Simulation ended"
+		elif result.reason == STOP_INTERRUPTED:
+			print "Breaking at 0x%08x" % result.address
 
 	def do_segtbl(self, line):
 		for (idx, segment) in enumerate(self.cpu.state.segments):
@@ -1,19 +1,74 @@
 #!/usr/bin/env python
 
+import os
 import sys
 import argparse
 import logging
-import pickle
 
 from linker.Linker import Linker
+from linker.LinkState import LinkState, get_digest
+from linker.LinkerScript import LinkerScript
+from assembler.ObjectFile import ObjectFile
+
+def writeMap(mapFileName, inputFiles, symboltables, scriptSymbols):
+	mapFile = open(mapFileName, 'w+')
+	for idx, sourceFile in enumerate(inputFiles):
+		mapFile.write("#%s\n" % sourceFile.name)
+		for symbol in symboltables[idx].iterkeys():
+			mapFile.write("%s %x\n" % (symbol, symboltables[idx][symbol]))
+		mapFile.write("\n")
+	if len(scriptSymbols) > 0:
+		mapFile.write("#linker script\n")
+		for symbol in sorted(scriptSymbols):
+			mapFile.write("%s %x\n" % (symbol, scriptSymbols[symbol]))
+		mapFile.write("\n")
+	mapFile.close()
+
+def loadState(stateFileName, logger):
+	""" Returns the LinkState saved at stateFileName or None if there is no usable one """
+	if not os.path.exists(stateFileName):
+		return None
+
+	try:
+		with open(stateFileName, 'r') as stateFile:
+			return LinkState.load(stateFile)
+	except (IOError, ValueError, KeyError), e:
+		logger.warning("Ignoring link state %s: %s", stateFileName, e)
+		return None
+
+def relink(linker, state, inputFiles, digests, outFileName, logger):
+	""" Patches the changed objects into the existing image, returns False if a full link is needed """
+	changed = state.get_changed(digests)
+	logger.debug("Changed objects: %s", [inputFiles[idx].name for idx in changed])
+
+	changedObjects = {}
+	for idx in changed:
+		changedObjects[idx] = ObjectFile.createFromFile(inputFiles[idx])
+
+	image = linker.relink(state, changedObjects)
+	if image is None:
+		return False
+
+	with open(outFileName, 'r+b') as imageFile:
+		image.patch(imageFile)
+
+	for idx in changed:
+		state.update_object(idx, digests[idx])
+	state.update_image_mtime()
+
+	return True
 
 def main(argc, argv):
 	parser = argparse.ArgumentParser(description='VM32 Linker')
 	parser.add_argument('-d', '--debug', action='store_true', dest='debug', help='Display debug information (DEBUG)')
 	parser.add_argument('-m', '--map', action='store', nargs=1, dest='mapFileName', help='Map filename', metavar='mapFileName', required=False)
+	parser.add_argument('-T', '--script', action='store', dest='scriptFileName', help='Linker script placing, aligning and reserving segments', metavar='scriptFileName', required=False)
+	parser.add_argument('--gc-sections', action='store_true', dest='gcSections', help='Leave out segments not reachable from the vectors and the entry symbols')
+	parser.add_argument('-e', '--entry', action='append', dest='entrySymbols', default=[], help='Entry symbol whose segment is kept by --gc-sections, may be given multiple times', metavar='symbol')
+	parser.add_argument('-i', '--incremental', action='store', dest='stateFileName', help='Link state file: if the output was linked from the same object files before only changed objects are patched into it', metavar='stateFileName', required=False)
 
 	parser.add_argument('-o', '--output', action='store', nargs=1, dest='outFileName', help='Output filename', metavar="outFileName", required=False)
-	parser.add_argument('inputFiles', metavar='input file', nargs='+', type=argparse.FileType('r'), help='Input files to link into an executable')
+	parser.add_argument('inputFiles', metavar='input file', nargs='+', type=argparse.FileType('rb'), help='Input files to link into an executable')
 
 	arguments = parser.parse_args(argv[1:])
 	
@@ -24,41 +79,72 @@ def main(argc, argv):
 		logging.basicConfig(level=logging.INFO)
 	logger = logging.getLogger('Linker Frontend')
 
+	if arguments.outFileName != None:
+		outFileName = arguments.outFileName[0]
+	else:
+		outFileName = 'out.bin'
+
 	try:
+		script = None
+		scriptDigest = None
+		if arguments.scriptFileName != None:
+			with open(arguments.scriptFileName, 'r') as scriptFile:
+				script = LinkerScript.load(scriptFile)
+			scriptDigest = get_digest(arguments.scriptFileName)
+
+		linker = Linker(script, arguments.gcSections, arguments.entrySymbols)
+		gcEntries = sorted(arguments.entrySymbols) if arguments.gcSections else None
+		inputPaths = [file.name for file in arguments.inputFiles]
+
+		#digests of the object files tell which objects changed since the last link
+		digests = None
+		if arguments.stateFileName != None:
+			state = loadState(arguments.stateFileName, logger)
+			if state != None and not state.matches(inputPaths, outFileName, scriptDigest, gcEntries):
+				state = None
+
+			if state != None:
+				digests = state.get_digests(inputPaths)
+			else:
+				digests = [get_digest(path) for path in inputPaths]
+
+			if state != None and relink(linker, state, arguments.inputFiles, digests, outFileName, logger):
+				logger.debug("Relinked %s incrementally", outFileName)
+
+				with open(arguments.stateFileName, 'w') as stateFile:
+					state.save(stateFile)
+
+				if arguments.mapFileName != None:
+					writeMap(arguments.mapFileName[0], arguments.inputFiles, state.get_symbol_tables(), state.script_symbols)
+				return
+
+			#the state is outdated from here on, don't leave it behind if the full link fails
+			if os.path.exists(arguments.stateFileName):
+				os.remove(arguments.stateFileName)
+
 		#load object files
 		objectFiles = []
 		for file in arguments.inputFiles:
 			logger.debug("Loading object files %s" % file)
-			objectFiles.append(pickle.load(file))
+			objectFiles.append(ObjectFile.createFromFile(file))
 		
-		linker = Linker()
 		image, symboltables = linker.link(objectFiles)
 
-		#build a binary string out of the list
-		binaryString = ""
-		for word in image:
-			binaryString += word
-
 		#create and truncate output file
-		if arguments.outFileName != None:
-			outputFile = open(arguments.outFileName[0], 'w+')
-		else:
-			outputFile = open('out.bin', 'w+')
+		outputFile = open(outFileName, 'wb')
 		logger.debug("Writing to file %s", outputFile.name)
 
 		#write image to file
-		outputFile.write(binaryString)
+		image.write(outputFile)
 		outputFile.close()
 
+		if arguments.stateFileName != None:
+			with open(arguments.stateFileName, 'w') as stateFile:
+				LinkState.from_link(linker, inputPaths, digests, outFileName, scriptDigest).save(stateFile)
+
 		#write the map file
 		if arguments.mapFileName != None:
-			mapFile = open(arguments.mapFileName[0], 'w+')
-			for idx, sourceFile in enumerate(arguments.inputFiles):
-				mapFile.write("#%s\n" % sourceFile.name)
-				for symbol in symboltables[idx].iterkeys():
-					mapFile.write("%s %x\n" % (symbol, symboltables[idx][symbol]))
-				mapFile.write("\n")
-			mapFile.close()
+			writeMap(arguments.mapFileName[0], arguments.inputFiles, symboltables, linker.script_symbols)
 
 	except IOError, e:
 		logger.error(e)
@@ -0,0 +1,135 @@
+import os
+import json
+import hashlib
+
+LINK_STATE_VERSION = 4
+
+def get_signature(path):
+	""" Size and modification time of a file, if they didn't change its digest isn't computed again """
+	status = os.stat(path)
+	return [status.st_size, status.st_mtime]
+
+def get_digest(path):
+	digest = hashlib.sha1()
+	with open(path, 'rb') as digest_file:
+		for chunk in iter(lambda: digest_file.read(1 << 20), ""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+class LinkState(object):
+	""" Everything an incremental relink needs to know about the last link of an image.
+
+		Per object file (in link order) it keeps the path, signature and content digest
+		of the object, the start and size of its segments, the addresses of its exports and
+		symbols and the image addresses of its import sites by symbol, which are
+		repatched when the address of the symbol changes. The size and modification time of the image
+		tell whether it still is the image written by the last link. The digest of the linker
+		script (None without one) and the symbols it reserved are kept as well, as are the
+		entry symbols of the garbage collection (None without). A relink keeps the segments
+		of the last link, even if they became unreachable.
+	"""
+
+	def __init__(self, output_path, image_size, image_mtime, objects, script_digest=None, script_symbols=None, gc_entries=None):
+		self.output_path = output_path
+		self.image_size = image_size
+		self.image_mtime = image_mtime
+		self.objects = objects
+		self.script_digest = script_digest
+		self.script_symbols = script_symbols or {}
+		self.gc_entries = gc_entries
+
+	@classmethod
+	def from_link(cls, linker, paths, digests, output_path, script_digest=None):
+		""" Creates the state of the image output_path just written from the object files at paths """
+		objects = []
+		for idx, obj in enumerate(linker.objectFiles):
+			segment_map = linker.segment_map[idx]
+
+			objects.append({
+				"path": os.path.abspath(paths[idx]),
+				"signature": get_signature(paths[idx]),
+				"digest": digests[idx],
+				"segments": dict((segment, [segment_map[segment], len(obj.seg_data[segment])]) for segment in obj.seg_data),
+				"exports": dict((export.export_symbol, segment_map[export.addr.segment] + export.addr.offset) for export in obj.export_table),
+				"imports": linker._get_import_addresses(obj, segment_map),
+				"symbols": linker.symbol_tables[idx],
+			})
+
+		gc_entries = sorted(linker.entry_symbols) if linker.gc_sections else None
+		state = cls(os.path.abspath(output_path), linker.total_size, None, objects, script_digest, linker.script_symbols, gc_entries)
+		state.update_image_mtime()
+		return state
+
+	@classmethod
+	def load(cls, state_file):
+		state = json.load(state_file)
+		if state.get("version") != LINK_STATE_VERSION:
+			raise ValueError("Unsupported link state version %s" % state.get("version"))
+
+		return cls(state["output"], state["image_size"], state["image_mtime"], state["objects"], state["script_digest"], state["script_symbols"], state["gc_entries"])
+
+	def save(self, state_file):
+		json.dump({
+			"version": LINK_STATE_VERSION,
+			"output": self.output_path,
+			"image_size": self.image_size,
+			"image_mtime": self.image_mtime,
+			"objects": self.objects,
+			"script_digest": self.script_digest,
+			"script_symbols": self.script_symbols,
+			"gc_entries": self.gc_entries,
+		}, state_file)
+
+	def update_image_mtime(self):
+		self.image_mtime = os.stat(self.output_path).st_mtime
+
+	def matches(self, paths, output_path, script_digest=None, gc_entries=None):
+		""" Tells if the image at output_path is the one of this state and was linked from
+			the same object files in the same order with the same linker script and garbage
+			collection (gc_entries are the sorted entry symbols, None without)
+		"""
+		if os.path.abspath(output_path) != self.output_path:
+			return False
+		if script_digest != self.script_digest or gc_entries != self.gc_entries:
+			return False
+		if [os.path.abspath(path) for path in paths] != [obj["path"] for obj in self.objects]:
+			return False
+
+		try:
+			status = os.stat(self.output_path)
+		except OSError:
+			return False
+
+		return status.st_size == self.image_size * 4 and status.st_mtime == self.image_mtime
+
+	def get_digests(self, paths):
+		""" Returns the digests of the object files at paths, only objects whose signature
+			changed are read
+		"""
+		digests = []
+		for idx, path in enumerate(paths):
+			if get_signature(path) == self.objects[idx]["signature"]:
+				digests.append(self.objects[idx]["digest"])
+			else:
+				digests.append(get_digest(path))
+		return digests
+
+	def get_changed(self, digests):
+		""" Returns the indices of the object files whose digest changed """
+		return [idx for idx, obj in enumerate(self.objects) if obj["digest"] != digests[idx]]
+
+	def update_object(self, idx, digest):
+		""" Records the digest and signature of a relinked object """
+		obj = self.objects[idx]
+		obj["digest"] = digest
+		obj["signature"] = get_signature(obj["path"])
+
+	def get_exports(self):
+		""" Returns a dictionary of all exported symbols and their addresses """
+		exports = dict(self.script_symbols)
+		for obj in self.objects:
+			exports.update(obj["exports"])
+		return exports
+
+	def get_symbol_tables(self):
+		return [obj["symbols"] for obj in self.objects]
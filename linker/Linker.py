@@ -1,32 +1,48 @@
 import logging
-import struct
+from array import array
 from collections import defaultdict
 
 from Exceptions import LinkerError
+from MemoryImage import MemoryImage
+from LinkerScript import LinkerScript
 
 class Linker(object):
-	def __init__(self):
-		pass
+	def __init__(self, script=None, gc_sections=False, entry_symbols=()):
+		#places the segments, the default layout if there is no script
+		self.script = script or LinkerScript()
+
+		#drop the segments unreachable from the vectors and the entry symbols
+		self.gc_sections = gc_sections
+		self.entry_symbols = entry_symbols
 
 	def link(self, objectFiles):
-		self.objectFiles = objectFiles
 		self.logger = logging.getLogger('Linker')
 
 		self.logger.debug("Linker initialized")
 
+		#before collecting garbage, the script may place segments which get dropped
+		self.script.check_segments(set(segment for obj in objectFiles for segment in obj.seg_data))
+
+		if self.gc_sections:
+			self.logger.debug("Removing unreachable segments")
+			objectFiles = self._collect_garbage(objectFiles)
+
+		self.objectFiles = objectFiles
+
 		#compute segment map - i.e. where will wich segment be placed at in memory
 		self.logger.debug("Creating segment map")
-		segment_map, total_size = self._compute_segment_map(objectFiles, 0)
-		self.logger.debug("Total occupied memory size is %d bytes" % total_size)
-		self.logger.debug("Segment map: %s" % segment_map)
+		segment_map, script_symbols, total_size = self._compute_segment_map(objectFiles)
+		self.logger.debug("Total occupied memory size is %d bytes", total_size)
+		self.logger.debug("Segment map: %s", segment_map)
+		self.logger.debug("Reserved by the linker script: %s", script_symbols)
 
-		#gather all exports in the objectFiles
+		#gather all exports in the objectFiles into the global symbol index
 		self.logger.debug("Gathering exports")
-		exports = self._collect_exports(self.objectFiles)
-		self.logger.debug("Gathered exports: %s" % exports)
+		symbol_index = self._build_symbol_index(self.objectFiles, segment_map, script_symbols)
+		self.logger.debug("Gathered exports: %s", symbol_index)
 
 		self.logger.debug("Resolving imports")
-		self._resolve_imports(objectFiles, exports, segment_map)
+		self._resolve_imports(objectFiles, symbol_index)
 		self.logger.debug("Resolved imports")
 
 		self.logger.debug("Resolving relocations")
@@ -40,27 +56,130 @@ class Linker(object):
 		self.logger.debug("Building final symbol table")
 		symboltables = self._build_symbol_tables(objectFiles, segment_map)
 		self.logger.debug("Finished dbilding final symbol table")
+
+		#kept to create a LinkState for incremental relinks
+		self.segment_map = segment_map
+		self.script_symbols = script_symbols
+		self.total_size = total_size
+		self.symbol_tables = symboltables
 		
 		return image, symboltables
 
-	def _build_memory_image(self, object_files, segment_map, total_size):
-		SENTINEL = -999
-		image = [SENTINEL] * total_size
+	def relink(self, state, changed_objects):
+		""" Relinks the changed object files (dictionary of index -> ObjectFile) of the
+			link described by a LinkState. Returns a MemoryImage of the words to patch in
+			the existing image: the segments of the changed objects and the import sites
+			of the other objects referring to symbols which moved. Returns None if the
+			objects changed in a way that needs a full link, i.e. segment sizes or the
+			exported symbols changed or an import can't be resolved. The state is updated
+			for the relinked objects.
+		"""
+		self.logger = logging.getLogger('Linker')
+
+		exports = state.get_exports()
+		moved = set()
+
+		for idx, obj in changed_objects.iteritems():
+			segments = state.objects[idx]["segments"]
+			sizes = dict((segment, len(seg_data)) for segment, seg_data in obj.seg_data.iteritems())
+			if sizes != dict((segment, size) for segment, (start, size) in segments.iteritems()):
+				self.logger.debug("Segment sizes of object %d changed, relinking all objects" % idx)
+				return None
+
+			obj_exports = dict((export.export_symbol, segments[export.addr.segment][0] + export.addr.offset) for export in obj.export_table)
+			if len(obj_exports) != len(obj.export_table) or set(obj_exports) != set(state.objects[idx]["exports"]):
+				self.logger.debug("Exports of object %d changed, relinking all objects" % idx)
+				return None
+
+			for symbol, address in obj_exports.iteritems():
+				if exports[symbol] != address:
+					exports[symbol] = address
+					moved.add(symbol)
+
+		image = MemoryImage(state.image_size)
+
+		for idx, obj in changed_objects.iteritems():
+			segment_map = dict((segment, start) for segment, (start, size) in state.objects[idx]["segments"].iteritems())
+
+			try:
+				self._resolve_object_imports(obj, exports)
+				self._resolve_object_relocations(obj, segment_map)
+			except LinkerError, e:
+				self.logger.debug("%s, relinking all objects" % e)
+				return None
+
+			for segment, seg_data in obj.seg_data.iteritems():
+				image.place(segment_map[segment], seg_data, "%s of object [%s]" % (segment, self._object_id(obj)))
+
+		for idx, state_object in enumerate(state.objects):
+			if idx in changed_objects:
+				continue
+
+			for symbol in moved.intersection(state_object["imports"]):
+				for address in state_object["imports"][symbol]:
+					image.place(address, array('I', [exports[symbol]]), "import of %s" % symbol)
+
+		image.check_overlaps()
+
+		for idx, obj in changed_objects.iteritems():
+			state_object = state.objects[idx]
+			segment_map = dict((segment, start) for segment, (start, size) in state_object["segments"].iteritems())
+			state_object["exports"] = dict((export.export_symbol, exports[export.export_symbol]) for export in obj.export_table)
+			state_object["imports"] = self._get_import_addresses(obj, segment_map)
+			state_object["symbols"] = dict((symbol, segment_map[addr.segment] + addr.offset) for symbol, addr in obj.symbol_table.iteritems())
+
+		return image
 
+	def _collect_garbage(self, object_files):
+		""" Returns copies of the object files without the segments which aren't reachable
+			through imports and relocations from the vectors segments (the CPU boots from
+			them) and the segments exporting the entry symbols
+		"""
+		exporters = defaultdict(list)
 		for idx, obj in enumerate(object_files):
+			for sym_name, addr in obj.export_table:
+				exporters[sym_name].append((idx, addr.segment))
+
+		pending = [(idx, "vectors") for idx, obj in enumerate(object_files) if "vectors" in obj.seg_data]
+		for sym_name in self.entry_symbols:
+			if not sym_name in exporters:
+				self._linker_error("Entry symbol '%s' isn't exported by any object" % sym_name)
+			pending.extend(exporters[sym_name])
+
+		#edges from a segment of an object to the segments it refers to
+		references = defaultdict(list)
+		for idx, obj in enumerate(object_files):
+			for sym, segment in obj.getImportSites():
+				references[idx, segment].extend(exporters.get(sym, ()))
+			for reloc_seg, segment in obj.getRelocationSites():
+				references[idx, segment].append((idx, reloc_seg))
+
+		reachable = set()
+		while pending:
+			node = pending.pop()
+			if not node in reachable:
+				reachable.add(node)
+				pending.extend(references[node])
+
+		stripped = []
+		for idx, obj in enumerate(object_files):
+			kept = [segment for segment in obj.seg_data if (idx, segment) in reachable]
 			for segment in obj.seg_data:
-				seg_data = obj.seg_data[segment]
+				if not segment in kept:
+					self.logger.debug("Dropping unreachable segment %s of object [%s]", segment, self._object_id(obj))
+			stripped.append(obj.withSegments(kept))
 
-				start = segment_map[idx][segment]
-				end = start + len(seg_data)
+		return stripped
 
-				for i in range(start, end):
-					assert image[i] == SENTINEL, 'segment %s at %d' % (segment, i)
+	def _build_memory_image(self, object_files, segment_map, total_size):
+		image = MemoryImage(total_size)
 
-				image[start:end] = seg_data
+		for idx, obj in enumerate(object_files):
+			for segment in obj.seg_data:
+				image.place(segment_map[idx][segment], obj.seg_data[segment],
+					"%s of object [%s]" % (segment, self._object_id(obj)))
 
-		for i in range(total_size):
-			assert image[i] != SENTINEL, 'at %d' % i
+		image.check_overlaps()
 
 		return image
 
@@ -81,44 +200,55 @@ class Linker(object):
 
 	def _resolve_relocations(self, object_files, segment_map):
 		for idx, obj in enumerate(object_files):
-			for reloc_seg, addr in obj.reloc_table:
-				if not reloc_seg in segment_map[idx]:
-					self._linker_error("Relocation entry in object [%t] refers to unknown segment %s" % (
-						self._object_id(obj), reloc_seg))
-
-				mapped_address = segment_map[idx][reloc_seg]
-				mapped_address += struct.unpack("<I", obj.seg_data[addr.segment][addr.offset])[0]
-
-				self._patch_segment_data(obj.seg_data[addr.segment], addr.offset, mapped_address, reloc_seg)
-
-	def _resolve_imports(self, object_files, exports, segment_map):
-		for idx, obj in enumerate(object_files):
-			import_table = object_files[idx].import_table
-
-			for sym, import_addr in import_table:
-				if not sym in exports:
-					self._linker_error("Failed import of symbol '%s' at object [%s]" % (
-						sym, self._object_id(obj)))
-				exp_obj_idx, exp_address = exports[sym]
-
-				mapped_address = segment_map[exp_obj_idx][exp_address.segment]
-				mapped_address += exp_address.offset
-
-				#self.logger.debug("Resolving imported symbol '%s' of object [%s] at address %#x to address %#x" % (
-				#	sym, self._object_id(obj), mapped_address, exp_address))
-
-				self._patch_segment_data(obj.seg_data[import_addr.segment], import_addr.offset, mapped_address, sym)
-
-	def _patch_segment_data(self, seg_data, instr_offset, mapped_address, name):
-		#print "%x %x %s" % (instr_offset, mapped_address, name)
-		if instr_offset > len(seg_data)-1:
-			self._linker_error("Patching (%s) of '%s', bad offset into segment" % (
-				type, name))
-		seg_data[instr_offset] = struct.pack("<I", mapped_address)
-
-	def _compute_segment_map(self, object_files, offset=0):
-		#TODO: replace with linker script later
-
+			self._resolve_object_relocations(obj, segment_map[idx])
+
+	def _resolve_object_relocations(self, obj, obj_segment_map):
+		#all sites of a group are relocated by the start of the same segment, the segment
+		#is looked up and checked once per group. The sites are still patched one by one,
+		#a map() over the offsets is slower than this loop
+		for (reloc_seg, segment), offsets in obj.getRelocationSites().iteritems():
+			if not reloc_seg in obj_segment_map:
+				self._linker_error("Relocation entry in object [%s] refers to unknown segment %s" % (
+					self._object_id(obj), reloc_seg))
+
+			seg_data = self._get_patched_segment(obj, segment, offsets, reloc_seg)
+			base = obj_segment_map[reloc_seg]
+			for offset in offsets:
+				seg_data[offset] += base
+
+	def _resolve_imports(self, object_files, symbol_index):
+		for obj in object_files:
+			self._resolve_object_imports(obj, symbol_index)
+
+	def _resolve_object_imports(self, obj, symbol_index):
+		#the symbol of a group is looked up once and stored into all its sites one by one
+		for (sym, segment), offsets in obj.getImportSites().iteritems():
+			if not sym in symbol_index:
+				self._linker_error("Failed import of symbol '%s' at object [%s]" % (
+					sym, self._object_id(obj)))
+
+			seg_data = self._get_patched_segment(obj, segment, offsets, sym)
+			mapped_address = symbol_index[sym]
+			for offset in offsets:
+				seg_data[offset] = mapped_address
+
+	def _get_patched_segment(self, obj, segment, offsets, name):
+		""" Returns the data of a segment after checking all offsets of a group of sites """
+		seg_data = obj.seg_data.get(segment)
+		if seg_data is None or max(offsets) >= len(seg_data):
+			self._linker_error("Patching of '%s' in object [%s], bad offset into segment %s" % (
+				name, self._object_id(obj), segment))
+		return seg_data
+
+	def _get_import_addresses(self, obj, obj_segment_map):
+		""" Returns the image addresses of the import sites of an object by symbol """
+		addresses = defaultdict(list)
+		for (sym, segment), offsets in obj.getImportSites().iteritems():
+			base = obj_segment_map[segment]
+			addresses[sym].extend(base + offset for offset in offsets)
+		return dict(addresses)
+
+	def _compute_segment_map(self, object_files):
 		#get sizes of each section over all object files
 		segment_size = defaultdict(int)
 		for obj in object_files:
@@ -126,20 +256,7 @@ class Linker(object):
 				segment_size[segment] += len(obj.seg_data[segment])
 
 		#get start addresses of each (now combined) segment
-		segment_ptr = {}
-		ptr = offset
-
-		#put vectors at the beginning for now until we have a linker script
-		if "vectors" in segment_size:
-			segment_ptr["vectors"] = ptr
-			ptr += segment_size["vectors"]
-
-		for segment in sorted(segment_size):
-			if segment not in ("vectors"):
-				segment_ptr[segment] = ptr
-				ptr += segment_size[segment]
-
-		total_size = ptr - offset
+		segment_ptr, script_symbols, total_size = self.script.layout(segment_size)
 
 		#create a map of all segments and save where the segment of each object
 		#fill will end at in memory
@@ -151,26 +268,34 @@ class Linker(object):
 				segment_ptr[segment] += len(obj.seg_data[segment])
 			segment_map.append(obj_segment_map)
 
-		return segment_map, total_size
+		return segment_map, script_symbols, total_size
 
 
-	def _collect_exports(self, object_files):
-		exports = {}
+	def _build_symbol_index(self, object_files, segment_map, script_symbols):
+		""" Returns the global symbol index: the image address of every exported symbol
+			and of the gaps reserved by the linker script
+		"""
+		symbol_index = dict(script_symbols)
+		owners = {}
 
 		for idx, obj in enumerate(object_files):
-			for export in obj.export_table:
-				sym_name = export.export_symbol
-				if sym_name in exports:
-					other_idx = exports[sym_name][0]
+			obj_segment_map = segment_map[idx]
+
+			for sym_name, addr in obj.export_table:
+				if sym_name in script_symbols:
+					self._linker_error("Export symbol '%s' at object [%s] is reserved by the linker script" % (
+						sym_name, self._object_id(object_files[idx])))
+				if sym_name in symbol_index:
 					self._linker_error(
 						"Duplicated export symbol '%s' at objects [%s] and [%s]" % (
 							sym_name,
 							self._object_id(object_files[idx]),
-							self._object_id(object_files[other_idx])))
+							self._object_id(object_files[owners[sym_name]])))
 
-				exports[sym_name] = (idx, export.addr)
+				symbol_index[sym_name] = obj_segment_map[addr.segment] + addr.offset
+				owners[sym_name] = idx
 
-		return exports
+		return symbol_index
 
 	def _object_id(self, object_file):
 		if object_file.name:
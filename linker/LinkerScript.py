@@ -0,0 +1,140 @@
+from collections import namedtuple
+
+from Exceptions import LinkerError
+
+#a statement of a linker script: kind is 'segment' (place the combined segment name),
+#'reserve' (leave size words empty for name) or 'align' (only align the location),
+#address and alignment are None if the statement doesn't give them
+ScriptEntry = namedtuple("ScriptEntry", ["kind", "name", "size", "address", "alignment"])
+
+class LinkerScript(object):
+	""" Placement of the combined segments in the image. A script has one statement per
+		line, '#' starts a comment:
+
+			segment NAME [at ADDRESS] [align ALIGNMENT]
+			reserve NAME SIZE [at ADDRESS] [align ALIGNMENT]
+			align ALIGNMENT
+
+		Statements are placed in order at ADDRESS or after the previous statement, the
+		start is aligned up to a multiple of ALIGNMENT words (e.g. the page size of the
+		simulator's memory). Reserved gaps, e.g. for stacks, are left zero and their start
+		address is exported as the symbol NAME. Segments the script doesn't name are placed
+		after the last statement, vectors first and the others sorted by name, so the
+		empty script is the default layout. Placing a segment no object file defines is an
+		error. Numbers are decimal or hexadecimal with 0x.
+	"""
+
+	def __init__(self, entries=None):
+		self.entries = entries or []
+
+	@classmethod
+	def load(cls, script_file):
+		entries = []
+		for line_number, line in enumerate(script_file, 1):
+			words = line.split("#", 1)[0].split()
+			if len(words) == 0:
+				continue
+
+			try:
+				entries.append(cls._parse_statement(words))
+			except (ValueError, IndexError):
+				raise LinkerError("Invalid linker script statement in line %d: %s" % (line_number, line.strip()))
+
+		return cls(entries)
+
+	@classmethod
+	def _parse_statement(cls, words):
+		kind = words[0]
+		if kind == 'align':
+			if len(words) != 2:
+				raise ValueError()
+			return ScriptEntry(kind, None, 0, None, _parse_alignment(words[1]))
+		elif kind == 'segment':
+			name, size, options = words[1], 0, words[2:]
+		elif kind == 'reserve':
+			name, size, options = words[1], _parse_number(words[2]), words[3:]
+		else:
+			raise ValueError()
+
+		if len(options) % 2 != 0:
+			raise ValueError()
+		options = dict(zip(options[::2], options[1::2]))
+		if not set(options).issubset(('at', 'align')):
+			raise ValueError()
+
+		address = _parse_number(options['at']) if 'at' in options else None
+		alignment = _parse_alignment(options['align']) if 'align' in options else None
+		return ScriptEntry(kind, name, size, address, alignment)
+
+	def check_segments(self, segments):
+		""" Raises a LinkerError if the script places a segment which isn't in segments,
+			e.g. because of a typo, instead of placing it empty
+		"""
+		for entry in self.entries:
+			if entry.kind == 'segment' and not entry.name in segments:
+				raise LinkerError("Linker script places segment %s which no object file defines" % entry.name)
+
+	def layout(self, segment_size):
+		""" Places the combined segments of the sizes in segment_size, returns the start of
+			every segment, the start of every reserved gap and the size of the image
+		"""
+		segment_ptr = {}
+		reserved = {}
+		regions = []
+		location = 0
+
+		for entry in self.entries:
+			start = entry.address if entry.address is not None else location
+			if entry.alignment is not None:
+				start = -(-start // entry.alignment) * entry.alignment
+
+			if entry.kind == 'segment':
+				if entry.name in segment_ptr:
+					raise LinkerError("Segment %s is placed twice by the linker script" % entry.name)
+				size = segment_size.get(entry.name, 0)
+				segment_ptr[entry.name] = start
+			elif entry.kind == 'reserve':
+				if entry.name in reserved:
+					raise LinkerError("Gap %s is reserved twice by the linker script" % entry.name)
+				size = entry.size
+				reserved[entry.name] = start
+			else:
+				size = 0
+
+			regions.append((start, size, entry.name))
+			location = start + size
+
+		#segments without a statement, vectors first
+		remaining = sorted(segment for segment in segment_size if segment not in segment_ptr)
+		if "vectors" in remaining:
+			remaining.remove("vectors")
+			remaining.insert(0, "vectors")
+
+		for segment in remaining:
+			segment_ptr[segment] = location
+			regions.append((location, segment_size[segment], segment))
+			location += segment_size[segment]
+
+		regions = sorted(region for region in regions if region[1] > 0)
+		for (start, size, name), (next_start, next_size, next_name) in zip(regions, regions[1:]):
+			if start + size > next_start:
+				raise LinkerError("Linker script places %s at %#x inside %s ending at %#x" % (next_name, next_start, name, start + size))
+
+		total_size = max([start + size for (start, size, name) in regions] or [0])
+		return segment_ptr, reserved, total_size
+
+def _parse_number(text):
+	if text.lower().startswith("0x"):
+		number = int(text[2:], 16)
+	else:
+		number = int(text, 10)
+
+	if number < 0:
+		raise ValueError()
+	return number
+
+def _parse_alignment(text):
+	alignment = _parse_number(text)
+	if alignment == 0:
+		raise ValueError()
+	return alignment
@@ -0,0 +1,102 @@
+import os
+import sys
+import stat
+from array import array
+
+from Exceptions import LinkerError
+
+#zero words written at once when filling gaps between segments
+_ZERO_CHUNK = 0x10000
+
+#gaps of at least this many words are left as holes in regular files instead of written
+_SPARSE_GAP = 0x400
+
+class MemoryImage(object):
+	""" Executable image of size words made of the placed segments of all object files.
+		Segments are only referenced, the image is never copied into a single buffer
+		unless to_array is called. Words not covered by a segment are zero.
+	"""
+
+	def __init__(self, size):
+		self.size = size
+		self.ranges = []
+
+	def __len__(self):
+		return self.size
+
+	def place(self, start, words, name):
+		#empty segments cover no words, keeping them would move write's position backwards
+		if len(words) > 0:
+			self.ranges.append((start, words, name))
+
+	def check_overlaps(self):
+		""" Sorts the placed segments by address and raises a LinkerError if two of them
+			overlap or one exceeds the image
+		"""
+		self.ranges.sort(key=lambda placed: placed[0])
+
+		end = 0
+		previous = None
+		for (start, words, name) in self.ranges:
+			if start < end:
+				raise LinkerError("Segment %s at %#x overlaps segment %s ending at %#x" % (name, start, previous, end))
+			if start + len(words) > self.size:
+				raise LinkerError("Segment %s at %#x exceeds the image size %#x" % (name, start, self.size))
+
+			end = start + len(words)
+			previous = name
+
+	def write(self, output_file):
+		""" Writes the image as little endian words, ranges need to be sorted by check_overlaps.
+			Large gaps are skipped if output_file is a regular file, leaving sparse holes.
+		"""
+		sparse = _is_regular_file(output_file)
+		position = 0
+		for (start, words, name) in self.ranges:
+			self._write_gap(output_file, start - position, sparse)
+
+			if sys.byteorder == 'big':
+				words = array('I', words)
+				words.byteswap()
+			words.tofile(output_file)
+
+			position = start + len(words)
+
+		self._write_gap(output_file, self.size - position, sparse)
+
+	def patch(self, image_file):
+		""" Writes the placed segments into an existing image file opened for update,
+			words not covered by a segment are left as they are
+		"""
+		for (start, words, name) in self.ranges:
+			if sys.byteorder == 'big':
+				words = array('I', words)
+				words.byteswap()
+
+			image_file.seek(start * 4)
+			words.tofile(image_file)
+
+	def _write_gap(self, output_file, count, sparse):
+		if sparse and count >= _SPARSE_GAP:
+			#the last word is still written, so a hole at the end extends the file
+			output_file.seek((count - 1) * 4, os.SEEK_CUR)
+			count = 1
+		self._write_zeros(output_file, count)
+
+	def _write_zeros(self, output_file, count):
+		while count > 0:
+			chunk = min(count, _ZERO_CHUNK)
+			output_file.write("\x00\x00\x00\x00" * chunk)
+			count -= chunk
+
+	def to_array(self):
+		image = array('I', [0]) * self.size
+		for (start, words, name) in self.ranges:
+			image[start:start + len(words)] = words
+		return image
+
+def _is_regular_file(output_file):
+	try:
+		return stat.S_ISREG(os.fstat(output_file.fileno()).st_mode)
+	except (AttributeError, ValueError, IOError, OSError):
+		return False
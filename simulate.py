@@ -3,14 +3,33 @@
 import sys
 import argparse
 import logging
+import json
 
 from simulator.CPU import CPU
+from simulator.Memory import Memory
+from simulator.BlockEngine import BlockEngine
+from simulator.Console import Console, DEFAULT_BUFFER_SIZE, DEFAULT_FLUSH_INTERVAL
+from simulator import Batch
+from simulator.Profiler import Profiler
+from simulator.Trace import LoggingTracer, TracerChain
+from utils.SymbolMap import SymbolMap
 
 def main(argc, argv):
 	parser = argparse.ArgumentParser(description='VM32 Simulator')
 	parser.add_argument('-d', '--debug', action='store_true', dest='debug', help='Display debug information (DEBUG)')
+	parser.add_argument('-e', '--engine', action='store', dest='engine', choices=['interpreter', 'block'], default='interpreter', help='Execution engine: interpret every instruction or translate basic blocks')
+	parser.add_argument('-o', '--output', action='store', dest='output', help='Write the console output to a file or named pipe instead of stdout')
+	parser.add_argument('--console-buffer', action='store', dest='consoleBuffer', type=int, default=DEFAULT_BUFFER_SIZE, help='Number of characters the console buffers (1 writes every character)')
+	parser.add_argument('--console-flush-interval', action='store', dest='consoleFlushInterval', type=float, default=DEFAULT_FLUSH_INTERVAL, help='Seconds after which buffered console output is written')
+	parser.add_argument('-b', '--batch', action='store', dest='batch', type=argparse.FileType('r'), help='Run the jobs of a JSON file in parallel and print their results as JSON lines')
+	parser.add_argument('-p', '--processes', action='store', dest='processes', type=int, help='Number of processes for --batch (default: one per CPU core)')
+	parser.add_argument('--boot-steps', action='store', dest='bootSteps', type=int, default=0, help='Instructions to execute before the jobs of --batch are started')
+	parser.add_argument('--max-steps', action='store', dest='maxSteps', type=int, help='Maximum number of instructions to execute (per job with --batch)')
+	parser.add_argument('--profile', action='store_true', dest='profile', help='Profile the executed instructions and display a report after the simulation ended')
+	parser.add_argument('-m', '--map', action='store', dest='mapFile', type=argparse.FileType('r'), help='Map file written by the linker to symbolize the addresses in the profile')
+	parser.add_argument('-s', '--statistics', action='store_true', dest='statistics', help='Display statistics of the simulator caches after the simulation ended')
 
-	parser.add_argument('memoryImage', metavar='memory image', type=argparse.FileType('r'), help='Image to be loaded into the system memory')
+	parser.add_argument('memoryImage', metavar='memory image', type=argparse.FileType('rb'), help='Image to be loaded into the system memory')
 
 	arguments = parser.parse_args(argv[1:])
 	
@@ -30,13 +49,53 @@ def main(argc, argv):
 	#for i in range(len(memoryImage) / 4):
 	#	wordifiedMemory.append(memoryImage[i*4:(i*4)+4])
 
+	if arguments.batch is not None:
+		jobs = Batch.loadJobs(arguments.batch, arguments.maxSteps)
+		logger.debug("Running %d jobs", len(jobs))
+		for result in Batch.runBatch(arguments.memoryImage.name, jobs, arguments.processes, arguments.engine, arguments.bootSteps):
+			print json.dumps(result._asdict())
+		return
+
+	if arguments.output is not None:
+		console = Console.createFromFile(arguments.output, arguments.consoleBuffer, arguments.consoleFlushInterval)
+	else:
+		console = Console(None, arguments.consoleBuffer, arguments.consoleFlushInterval)
+
+	profiler = None
+	tracer = None
+	if arguments.profile:
+		profiler = Profiler()
+		tracer = profiler
+
+		#keep the step trace of -d
+		if arguments.debug:
+			tracer = TracerChain([LoggingTracer(), profiler])
+
 	logger.debug("Creating CPU")
-	cpu = CPU(arguments.memoryImage.read())
+	cpu = CPU(memory=Memory.createFromFile(arguments.memoryImage), console=console, tracer=tracer)
+
+	if arguments.engine == 'block':
+		engine = BlockEngine(cpu)
+	else:
+		engine = cpu
+
+	result = engine.run(arguments.maxSteps)
+	console.close()
+
+	logger.info("Simulation ended (%s after %d instructions at 0x%08x)", result.reason, result.steps, result.address)
 
-	while cpu.doSimulationStep():
-		pass
+	if profiler is not None:
+		symbols = None
+		if arguments.mapFile is not None:
+			symbols = SymbolMap.createFromFile(arguments.mapFile)
+		sys.stderr.write(profiler.report(symbols) + "\n")
 
-	logger.info("Simulation ended")
+	if arguments.statistics:
+		statistics = cpu.state.getSegmentCacheStatistics()
+		logger.info("Segment cache: %d accesses, %d reloads (%.4f per access), %d flushes (%.4f per access)",
+			statistics['accesses'], statistics['reloads'], statistics['reloadRate'], statistics['flushes'], statistics['flushRate'])
+		logger.info("Segment cache reloads by cause: %s",
+			", ".join("%s %d" % (cause, count) for (cause, count) in sorted(statistics['causes'].iteritems())))
 
 if __name__ == '__main__':
 	main(len(sys.argv), sys.argv)
@@ -0,0 +1,108 @@
+import json
+import multiprocessing
+import traceback
+from collections import namedtuple
+
+from .CPU import CPU
+from .Memory import Memory
+from .BlockEngine import BlockEngine
+from .Console import MemoryConsole
+from .Exceptions import CPUSegmentViolationException
+
+#a variant of the image to simulate: patches is a list of (address, words) written to memory,
+#registers maps register numbers to their initial values, maxSteps limits the run (None: no limit)
+BatchJob = namedtuple("BatchJob", ["name", "patches", "registers", "maxSteps"])
+
+#outcome of a BatchJob: stop reason, executed instructions and IP as in RunResult, the console
+#output, the final registers (None if the register segment is invalid) and the traceback of
+#an exception ending the job
+BatchResult = namedtuple("BatchResult", ["name", "reason", "steps", "address", "output", "registers", "error"])
+
+#the CPU of a worker process, booted once and restored before every job
+_worker = None
+
+class BatchWorker(object):
+	""" Runs BatchJobs on a CPU booted from an image file.
+
+		The image is mapped read-only, so all workers of a batch share it. After booting
+		for bootSteps instructions the CPU is snapshotted, every job starts from there and
+		only pays for the memory pages the previous job wrote.
+	"""
+
+	def __init__(self, imagePath, engine='interpreter', bootSteps=0):
+		with open(imagePath, 'rb') as imageFile:
+			memory = Memory.createFromFile(imageFile)
+
+		self.console = MemoryConsole(flushInterval=float('inf'))
+		self.cpu = CPU(memory=memory, console=self.console)
+
+		if engine == 'block':
+			self.engine = BlockEngine(self.cpu)
+		else:
+			self.engine = self.cpu
+
+		if bootSteps > 0:
+			self.engine.run(bootSteps)
+
+		self.snapshot = self.cpu.snapshot()
+
+	def runJob(self, job):
+		try:
+			self.cpu.restore(self.snapshot)
+			self.console.clear()
+
+			for (address, words) in job.patches:
+				self.cpu.memory.writeBlob(address, words)
+
+			for (register, value) in job.registers.iteritems():
+				self.cpu.state.setRegister(register, value)
+
+			result = self.engine.run(job.maxSteps)
+			return BatchResult(job.name, result.reason, result.steps, result.address, self.console.getOutput(), self._getRegisters(), None)
+		except Exception:
+			return BatchResult(job.name, None, None, None, self.console.getOutput(), None, traceback.format_exc())
+
+	def _getRegisters(self):
+		try:
+			return [self.cpu.state.getRegister(register) for register in range(31)]
+		except CPUSegmentViolationException:
+			return None
+
+def _initializeWorker(imagePath, engine, bootSteps):
+	global _worker
+	_worker = BatchWorker(imagePath, engine, bootSteps)
+
+def _runJob(job):
+	return _worker.runJob(job)
+
+def loadJobs(jobsFile, maxSteps=None):
+	""" Reads BatchJobs from a JSON list of objects with the optional keys name, patches
+		(list of [address, [words]]), registers (object of register number -> value) and
+		maxSteps (defaults to maxSteps).
+	"""
+	jobs = []
+	for (index, description) in enumerate(json.load(jobsFile)):
+		jobs.append(BatchJob(
+			description.get('name', str(index)),
+			[(address, words) for (address, words) in description.get('patches', [])],
+			dict((int(register), value) for (register, value) in description.get('registers', {}).iteritems()),
+			description.get('maxSteps', maxSteps),
+		))
+
+	return jobs
+
+def runBatch(imagePath, jobs, processes=None, engine='interpreter', bootSteps=0):
+	""" Runs the jobs on the image at imagePath in a pool of processes (one per CPU core
+		by default) and returns their BatchResults in the order of jobs. With a single
+		process the jobs run in the calling process.
+	"""
+	if processes == 1:
+		worker = BatchWorker(imagePath, engine, bootSteps)
+		return [worker.runJob(job) for job in jobs]
+
+	pool = multiprocessing.Pool(processes, _initializeWorker, (imagePath, engine, bootSteps))
+	try:
+		return pool.map(_runJob, jobs)
+	finally:
+		pool.close()
+		pool.join()
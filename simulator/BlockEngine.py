@@ -0,0 +1,531 @@
+import logging
+import time
+
+from common import Opcodes
+
+from .Memory import MemoryException
+from .Exceptions import CPUSegmentViolationException
+from .RunControl import RunResult, STOP_HALTED, STOP_STEP_LIMIT, STOP_TIME_LIMIT, STOP_INTERRUPTED, TIME_CHECK_INTERVAL
+
+#instructions a block can't continue after
+_BLOCK_TERMINATORS = (
+	Opcodes.OP_JMP, Opcodes.OP_JZ, Opcodes.OP_JNZ, Opcodes.OP_JGT, Opcodes.OP_JGE,
+	Opcodes.OP_CALL, Opcodes.OP_RET, Opcodes.OP_RETN, Opcodes.OP_INT, Opcodes.OP_RETI,
+	Opcodes.OP_VMRESUME, Opcodes.OP_HALT,
+)
+
+#instructions writing a result back to their first operand
+_WRITEBACK_INSTRUCTIONS = (
+	Opcodes.OP_ADD, Opcodes.OP_SUB, Opcodes.OP_MUL, Opcodes.OP_DIV, Opcodes.OP_MOD,
+	Opcodes.OP_OR, Opcodes.OP_XOR, Opcodes.OP_AND, Opcodes.OP_NOT, Opcodes.OP_SHL, Opcodes.OP_SHR,
+	Opcodes.OP_MOV, Opcodes.OP_POP, Opcodes.OP_GETARGUMENT,
+)
+
+#python expressions for the arithmetic and binary instructions
+_ALU_EXPRESSIONS = {
+	Opcodes.OP_ADD: "(v1 + v2) & 0xFFFFFFFF",
+	Opcodes.OP_SUB: "(v1 - v2) & 0xFFFFFFFF",
+	Opcodes.OP_MUL: "(v1 * v2) & 0xFFFFFFFF",
+	Opcodes.OP_DIV: "(v1 / v2) & 0xFFFFFFFF",
+	Opcodes.OP_MOD: "(v1 % v2) & 0xFFFFFFFF",
+	Opcodes.OP_OR: "v1 | v2",
+	Opcodes.OP_XOR: "v1 ^ v2",
+	Opcodes.OP_AND: "v1 & v2",
+	Opcodes.OP_NOT: "v1 ^ v2",
+	Opcodes.OP_SHL: "(v1 << v2) & 0xFFFFFFFF",
+	Opcodes.OP_SHR: "(v1 >> v2) & 0xFFFFFFFF",
+}
+
+#conditions of the conditional branches on the local flags variable
+_BRANCH_CONDITIONS = {
+	Opcodes.OP_JZ: "fl & 1",
+	Opcodes.OP_JNZ: "not fl & 1",
+	Opcodes.OP_JGT: "fl & 2 and not fl & 1",
+	Opcodes.OP_JGE: "fl & 2",
+}
+
+class TranslatedBlock(object):
+	def __init__(self, entry, addresses, end, minPrivLvl, function, alive):
+		self.entry = entry
+		self.addresses = addresses		#address of each instruction in the block
+		self.end = end					#first word after the block
+		self.length = len(addresses)
+		self.minPrivLvl = minPrivLvl
+		self.function = function
+		self.alive = alive				#[False] once the block's code got overwritten
+
+class BlockEngine(object):
+	""" Execution engine translating basic blocks of guest code into python functions.
+
+		A block starts at a given address and ends at a branch, an instruction the
+		engine can't translate (anything touching special registers, interrupts, VM
+		switches or the console) or after MAX_BLOCK_LENGTH instructions. Registers
+		are kept in local variables of the generated function and only written back to
+		the register segment when the block exits or faults and before memory accesses
+		aliasing the register segment, memory writes aliasing it reload them.
+
+		A block only runs if the timer won't fire and no enabled interrupt is pending while
+		it executes, and if the code and register segments are valid for all of it.
+		Otherwise, and for all instructions which aren't translated, the engine falls
+		back to CPU.doSimulationStep, so the observable behaviour is the one of the
+		interpreter.
+	"""
+
+	MAX_BLOCK_LENGTH = 64
+
+	def __init__(self, cpu, maxBlockLength=MAX_BLOCK_LENGTH):
+		self.cpu = cpu
+		self.state = cpu.state
+		self.memory = cpu.memory
+		self.maxBlockLength = maxBlockLength
+		self.logger = logging.getLogger('BlockEngine')
+
+		#entry address -> TranslatedBlock or None if nothing could be translated there
+		self.blocks = {}
+		self.covering = {}
+
+		self.instructionCount = 0
+
+		#trace events are emitted per instruction, so a traced CPU is only interpreted
+		if cpu.tracer is not None:
+			self.doSimulationStep = self._tracedSimulationStep
+
+	def run(self, maxSteps=None, until=None):
+		""" Like CPU.run, but executes whole blocks. A block never runs past maxSteps.
+			Breakpoints and address ranges have to be checked at every instruction, so
+			runs with them are left to the interpreter.
+		"""
+		if until is not None and until.hasAddressConditions():
+			result = self.cpu.run(maxSteps, until)
+			self.instructionCount += result.steps
+			return result
+
+		state = self.state
+		step = self.doSimulationStep
+
+		deadline = None
+		if until is not None and until.timeLimit is not None:
+			deadline = time.time() + until.timeLimit
+
+		start = self.instructionCount
+		try:
+			while True:
+				#the clock is checked every TIME_CHECK_INTERVAL steps
+				for i in xrange(TIME_CHECK_INTERVAL):
+					remaining = None
+					if maxSteps is not None:
+						remaining = maxSteps - (self.instructionCount - start)
+						if remaining <= 0:
+							return RunResult(STOP_STEP_LIMIT, self.instructionCount - start, state.IP)
+
+					if not step(remaining):
+						return RunResult(STOP_HALTED, self.instructionCount - start, state.IP)
+
+				self.cpu.console.flushIfDue()
+
+				if deadline is not None and time.time() >= deadline:
+					return RunResult(STOP_TIME_LIMIT, self.instructionCount - start, state.IP)
+		except KeyboardInterrupt:
+			return RunResult(STOP_INTERRUPTED, self.instructionCount - start, state.IP)
+		finally:
+			self.cpu.console.flush()
+
+	def doSimulationStep(self, maxInstructions=None):
+		""" Executes a whole block or a single instruction. Returns False if the simulation ended.
+			Blocks longer than maxInstructions aren't run.
+		"""
+		state = self.state
+		entry = state.IP
+
+		if entry in self.blocks:
+			block = self.blocks[entry]
+		else:
+			block = self._translate(entry)
+
+		registerBase = None
+		if block is not None and (maxInstructions is None or block.length <= maxInstructions):
+			registerBase = self._getRegisterBase(block)
+
+		if registerBase is None:
+			self.instructionCount += 1
+			return self.cpu.doSimulationStep()
+
+		(executed, nextIp, exception) = block.function(registerBase)
+
+		#the first instruction needs the interpreter, e.g. for division by zero
+		if executed == 0 and exception is None:
+			self.instructionCount += 1
+			return self.cpu.doSimulationStep()
+
+		#every executed instruction and the faulting one ticked the timer
+		ticks = executed
+		if exception is not None:
+			ticks += 1
+
+		state.ticks += ticks
+		self.instructionCount += ticks
+
+		if exception is not None:
+			state.IP = block.addresses[executed]
+			self.cpu.raiseInterrupt(Opcodes.INTR_SEG_VIOL, state.IP, [exception.segment, exception.offset])
+		else:
+			state.IP = nextIp
+
+		return True
+
+	def _tracedSimulationStep(self, maxInstructions=None):
+		self.instructionCount += 1
+		return self.cpu.doSimulationStep()
+
+	def invalidate(self, address):
+		if address in self.covering:
+			for entry in self.covering[address]:
+				block = self.blocks.pop(entry, None)
+				if block is not None:
+					block.alive[0] = False
+			self.covering[address].clear()
+
+	def flush(self):
+		for word in self.covering:
+			self.memory.removeWriteWatch(word, self.invalidate)
+		for block in self.blocks.itervalues():
+			if block is not None:
+				block.alive[0] = False
+		self.blocks = {}
+		self.covering = {}
+
+	def _getRegisterBase(self, block):
+		""" Checks if block may run in the current state, returns the start of the register segment if so """
+		state = self.state
+
+		#the timer must not fire inside of the block, a pending interrupt which is enabled
+		#pulls nextTimerEvent in to the current tick
+		if state.ticks + block.length > state.nextTimerEvent:
+			return None
+
+		if block.minPrivLvl < state.privLvl:
+			return None
+
+		#the register file cache of the state tracks the register segment
+		registerBase = state.registerBase
+		if registerBase is None:
+			return None
+
+		segments = state.segments
+		if len(segments) > 0:
+			if state.CS >= len(segments):
+				return None
+
+			code = segments[state.CS]
+			if code.type != Opcodes.SEGMENT_CODE or block.entry < code.start or block.addresses[-1] > code.limit:
+				return None
+
+		#register writes are not checked for self modifying code
+		if registerBase + 30 >= block.entry and registerBase < block.end:
+			return None
+
+		return registerBase
+
+	def _translate(self, entry):
+		addresses = []
+		instructions = []
+		address = entry
+
+		try:
+			while len(instructions) < self.maxBlockLength:
+				decoded = self.cpu.instructionCache.fetch(address)
+				if decoded is None or not self._isTranslatable(decoded):
+					break
+
+				addresses.append(address)
+				instructions.append(decoded)
+				address += decoded[9]
+
+				if decoded[0] in _BLOCK_TERMINATORS:
+					break
+		except MemoryException:
+			#the interpreter reports this once it gets there
+			pass
+
+		if len(instructions) == 0:
+			self.blocks[entry] = None
+			self._watch(entry, entry + 1)
+			return None
+
+		alive = [True]
+		function = self._compile(entry, addresses, instructions, address, alive)
+		block = TranslatedBlock(entry, addresses, address, min(decoded[1] for decoded in instructions), function, alive)
+
+		self.blocks[entry] = block
+		self._watch(entry, address)
+
+		self.logger.debug("Translated block at 0x%x with %d instructions", entry, len(instructions))
+		return block
+
+	def _watch(self, start, end):
+		for word in range(start, end):
+			if not word in self.covering:
+				self.covering[word] = set()
+				self.memory.addWriteWatch(word, self.invalidate)
+			self.covering[word].add(start)
+
+	def _isTranslatable(self, decoded):
+		(opcode, privlvl, argumentCount, operandType1, registerOperand1, operandWord1,
+			operandType2, registerOperand2, operandWord2, length) = decoded
+
+		if not opcode in _ALU_EXPRESSIONS and not opcode in _BRANCH_CONDITIONS and not opcode in (
+				Opcodes.OP_MOV, Opcodes.OP_NOP, Opcodes.OP_CMP, Opcodes.OP_JMP, Opcodes.OP_CALL,
+				Opcodes.OP_RET, Opcodes.OP_RETN, Opcodes.OP_RETI, Opcodes.OP_PUSH, Opcodes.OP_POP,
+				Opcodes.OP_ENTER, Opcodes.OP_LEAVE, Opcodes.OP_GETARGUMENT, Opcodes.OP_CLI, Opcodes.OP_STI):
+			return False
+
+		#special registers may cause VM exits or reload the segment table
+		if argumentCount > 0 and operandType1 == Opcodes.PARAM_SPECIAL_REGISTER:
+			return False
+		if argumentCount > 1 and operandType2 == Opcodes.PARAM_SPECIAL_REGISTER:
+			return False
+
+		#writeback to an immediate is an internal simulator error, leave that to the interpreter
+		if opcode in _WRITEBACK_INSTRUCTIONS and operandType1 == Opcodes.PARAM_IMMEDIATE:
+			return False
+
+		return True
+
+	def _compile(self, entry, addresses, instructions, end, alive):
+		registers = set()
+		usesFlags = False
+		for decoded in instructions:
+			(opcode, privlvl, argumentCount, operandType1, registerOperand1, operandWord1,
+				operandType2, registerOperand2, operandWord2, length) = decoded
+
+			if argumentCount > 0 and operandType1 != Opcodes.PARAM_IMMEDIATE and registerOperand1 != 31:
+				registers.add(registerOperand1)
+			if argumentCount > 1 and operandType2 != Opcodes.PARAM_IMMEDIATE and registerOperand2 != 31:
+				registers.add(registerOperand2)
+			if opcode in (Opcodes.OP_CALL, Opcodes.OP_RET, Opcodes.OP_RETN, Opcodes.OP_RETI, Opcodes.OP_PUSH, Opcodes.OP_POP):
+				registers.add(30)
+			if opcode in (Opcodes.OP_ENTER, Opcodes.OP_LEAVE, Opcodes.OP_GETARGUMENT):
+				registers.update((29, 30))
+			if opcode == Opcodes.OP_CMP or opcode in _BRANCH_CONDITIONS:
+				usesFlags = True
+
+		registers = sorted(registers)
+		reload = "; ".join("r%d = rd(rb + %d)" % (reg, reg) for reg in registers) or "pass"
+
+		#registers written in local variables since the last write back and in the whole block
+		dirty = set()
+		written = set()
+
+		lines = []
+		def emit(indent, line):
+			lines.append("\t" * indent + line)
+
+		def writeRegister(reg, value):
+			emit(2, "r%d = %s" % (reg, value))
+			dirty.add(reg)
+			written.add(reg)
+
+		def writeBack(indent, regs):
+			for reg in sorted(regs):
+				emit(indent, "sr(%d, r%d)" % (reg, reg))
+
+		def leave(indent, result):
+			writeBack(indent, dirty)
+			emit(indent, "return %s" % result)
+
+		def beforeAccess(variable):
+			#memory accesses to the register segment have to see the local registers
+			if len(dirty) > 0:
+				emit(2, "if rb <= %s <= rbe:" % variable)
+				writeBack(3, dirty)
+
+		def read(variable, address):
+			emit(2, "%s = %s" % (variable, address))
+			beforeAccess(variable)
+			emit(2, "%s = rd(%s)" % (variable, variable))
+
+		def memoryWritten(variable):
+			#keep local registers coherent with the register segment
+			emit(2, "if rb <= %s <= rbe: %s" % (variable, reload))
+
+		emit(0, "def block(rb, st=st, rd=rd, wr=wr, sr=sr, dsa=dsa, esa=esa, alive=alive):")
+		emit(1, "rbe = rb + 30")
+		for reg in registers:
+			emit(1, "r%d = rd(rb + %d)" % (reg, reg))
+		if usesFlags:
+			emit(1, "fl = st.Flags")
+		emit(1, "n = 0")
+		emit(1, "try:")
+
+		for (index, decoded) in enumerate(instructions):
+			(opcode, privlvl, argumentCount, operandType1, registerOperand1, operandWord1,
+				operandType2, registerOperand2, operandWord2, length) = decoded
+
+			address = addresses[index]
+			nextAddress = address + length
+			done = "(%d, 0x%x, None)" % (index + 1, nextAddress)
+
+			def stopIfOverwritten():
+				#the instruction is complete, but the rest of the block may have been overwritten
+				emit(2, "if not alive[0]:")
+				leave(3, done)
+
+			def writeMemory(variable, value):
+				beforeAccess(variable)
+				emit(2, "wr(%s, %s)" % (variable, value))
+				memoryWritten(variable)
+
+			def stackAddress():
+				#checked like CPUState.getResultingStackAddress, but on the local stack pointer
+				emit(2, "if not st.stackStart <= r30 <= st.stackLimit: raise CPUSegmentViolationException(%d, r30)" % Opcodes.SEGMENT_STACK)
+				emit(2, "sa = r30")
+
+			def push(value):
+				writeRegister(30, "(r30 - 1) & 0xFFFFFFFF")
+				stackAddress()
+				writeMemory("sa", value)
+
+			def pop(variable):
+				stackAddress()
+				beforeAccess("sa")
+				emit(2, "%s = rd(sa)" % variable)
+				writeRegister(30, "(r30 + 1) & 0xFFFFFFFF")
+
+			def writeback(value):
+				if operandType1 == Opcodes.PARAM_REGISTER:
+					writeRegister(registerOperand1, value)
+				else:
+					writeMemory("a1", value)
+					stopIfOverwritten()
+
+			emit(2, "#0x%x" % address)
+			emit(2, "n = %d" % index)
+
+			#fetch operands in the same order as the interpreter
+			if argumentCount > 0:
+				address1 = self._operandAddress(operandType1, registerOperand1, operandWord1, read)
+				if address1 is not None:
+					emit(2, "a1 = %s" % address1)
+					if opcode not in (Opcodes.OP_MOV, Opcodes.OP_POP, Opcodes.OP_GETARGUMENT):
+						beforeAccess("a1")
+						emit(2, "v1 = rd(a1)")
+				elif operandType1 == Opcodes.PARAM_REGISTER:
+					emit(2, "v1 = r%d" % registerOperand1)
+				else:
+					emit(2, "v1 = 0x%x" % operandWord1)
+
+			if argumentCount > 1:
+				address2 = self._operandAddress(operandType2, registerOperand2, operandWord2, read)
+				if address2 is not None:
+					read("v2", address2)
+				elif operandType2 == Opcodes.PARAM_REGISTER:
+					emit(2, "v2 = r%d" % registerOperand2)
+				else:
+					emit(2, "v2 = 0x%x" % operandWord2)
+
+			if opcode in _ALU_EXPRESSIONS:
+				if opcode in (Opcodes.OP_DIV, Opcodes.OP_MOD):
+					emit(2, "if v2 == 0:")
+					leave(3, "(%d, 0x%x, None)" % (index, address))
+				writeback(_ALU_EXPRESSIONS[opcode])
+
+			elif opcode == Opcodes.OP_MOV:
+				writeback("v2")
+
+			elif opcode == Opcodes.OP_NOP:
+				emit(2, "pass")
+
+			elif opcode == Opcodes.OP_CMP:
+				emit(2, "fl = (fl & ~3) | (2 if v1 >= v2 else 0) | (1 if v1 == v2 else 0)")
+				emit(2, "st.Flags = fl")
+
+			elif opcode == Opcodes.OP_JMP:
+				leave(2, "(%d, v1, None)" % (index + 1))
+
+			elif opcode in _BRANCH_CONDITIONS:
+				emit(2, "if %s:" % _BRANCH_CONDITIONS[opcode])
+				leave(3, "(%d, v1, None)" % (index + 1))
+
+			elif opcode == Opcodes.OP_CALL:
+				push("0x%x" % nextAddress)
+				leave(2, "(%d, v1, None)" % (index + 1))
+
+			elif opcode in (Opcodes.OP_RET, Opcodes.OP_RETI):
+				pop("t")
+				leave(2, "(%d, t, None)" % (index + 1))
+
+			elif opcode == Opcodes.OP_RETN:
+				pop("t")
+				writeRegister(30, "(r30 + v1) & 0xFFFFFFFF")
+				leave(2, "(%d, t, None)" % (index + 1))
+
+			elif opcode == Opcodes.OP_PUSH:
+				push("v1")
+				stopIfOverwritten()
+
+			elif opcode == Opcodes.OP_POP:
+				pop("t")
+				writeback("t")
+
+			elif opcode == Opcodes.OP_ENTER:
+				push("r29")
+				writeRegister(29, "r30")
+				stopIfOverwritten()
+
+			elif opcode == Opcodes.OP_LEAVE:
+				pop("t")
+				writeRegister(29, "t")
+
+			elif opcode == Opcodes.OP_GETARGUMENT:
+				read("t", "r29 + 2 + v2")
+				writeback("t")
+
+			elif opcode == Opcodes.OP_CLI:
+				emit(2, "st.Int &= ~1")
+
+			elif opcode == Opcodes.OP_STI:
+				emit(2, "st.Int |= 1")
+
+		#registers which weren't written still hold the contents of the register segment
+		emit(1, "except CPUSegmentViolationException, e:")
+		writeBack(2, written)
+		emit(2, "return (n, None, e)")
+		leave(1, "(%d, 0x%x, None)" % (len(instructions), end))
+
+		source = "\n".join(lines) + "\n"
+
+		namespace = {
+			'CPUSegmentViolationException': CPUSegmentViolationException,
+			'st': self.state,
+			'rd': self.memory.readWord,
+			'wr': self.memory.writeWord,
+			'sr': self.state.setRegister,
+			'dsa': self.state.getResultingDataAddress,
+			'esa': self.state.getResultingExtraAddress,
+			'alive': alive,
+		}
+		exec compile(source, "<block 0x%x>" % entry, "exec") in namespace
+
+		return namespace['block']
+
+	def _operandAddress(self, operandType, register, word, read):
+		""" Returns a python expression for the physical address of a memory operand or None,
+			the pointer of double indirect operands is read into p with read(variable, address)
+		"""
+		if operandType in (Opcodes.PARAM_MEMORY_SINGLE_DS, Opcodes.PARAM_MEMORY_DOUBLE_DS):
+			resolve = "dsa"
+		elif operandType in (Opcodes.PARAM_MEMORY_SINGLE_ES, Opcodes.PARAM_MEMORY_DOUBLE_ES):
+			resolve = "esa"
+		else:
+			return None
+
+		if operandType in (Opcodes.PARAM_MEMORY_SINGLE_DS, Opcodes.PARAM_MEMORY_SINGLE_ES):
+			offset = "0x%x" % word
+		else:
+			read("p", "%s(0x%x)" % (resolve, word))
+			offset = "p"
+
+		if register != 31:
+			offset += " + r%d" % register
+
+		return "%s(%s)" % (resolve, offset)
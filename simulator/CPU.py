@@ -4,472 +4,529 @@ from .Exceptions import SimulatorError, CPUSegmentViolationException, CPUStateSe
 
 from common import Opcodes
 
-import struct
 import logging
-import sys
+import time
 
-from .Instructions import doesInstructionExist, getArgumentCount, areParametersValid
+from .InstructionCache import InstructionCache
+from .Console import Console
+from .Snapshot import Snapshot
+from .Trace import LoggingTracer, TRACE_INTERRUPT, TRACE_TIMER_INTERRUPT, TRACE_VM_EXIT
+from . import Instructions
+from .RunControl import RunResult, STOP_HALTED, STOP_STEP_LIMIT, STOP_TIME_LIMIT, STOP_INTERRUPTED, TIME_CHECK_INTERVAL
+
+#Instruction handlers are called as handler(cpu, operand1, operand2, ipadd) and return
+#either a value to be written back to the first operand, None if there is nothing to
+#write back, or one of the following results which end the simulation step right away
+STEP_DONE = object()	#the handler has set the next IP itself (branch, interrupt, VM exit)
+STEP_HALT = object()	#the simulation ends
 
 class CPU(object):
-	def __init__(self, memoryString):
+	#opcode -> handler, see registerInstruction
+	instructionHandlers = {}
+
+	def __init__(self, memoryString=None, memory=None, console=None, tracer=None):
+		""" Creates a CPU either from a binary memory image string or from a Memory instance.
+			PRINT writes to console, a Console on stdout by default. Trace events go to
+			tracer, by default a LoggingTracer if debug messages of the CPU are enabled.
+		"""
+		if memory is None:
+			memory = Memory.createFromBinaryString(memoryString)
+
+		if console is None:
+			console = Console()
+
 		self.state = CPUState()
-		self.memory = Memory.createFromBinaryString(memoryString)
+		self.memory = memory
+		self.console = console
+		self.instructionCache = InstructionCache(self.memory)
 		self.logger = logging.getLogger('CPU')
+
+		#the step is only instrumented if there is a tracer
+		if tracer is None and self.logger.isEnabledFor(logging.DEBUG):
+			tracer = LoggingTracer(self.logger)
+
+		self.tracer = tracer
+		self.state.tracer = tracer
+		if tracer is not None:
+			self.doSimulationStep = tracer.instrumentStep(self, CPU.doSimulationStep.__get__(self, CPU))
+
+		#dispatch tables indexed by opcode and by operand type
+		self.dispatchTable = [None] * 256
+		for (opcode, handler) in self.instructionHandlers.iteritems():
+			self.dispatchTable[opcode] = handler.__get__(self, CPU)
+
+		self.operandFetchers = [None] * 8
+		self.operandFetchers[Opcodes.PARAM_IMMEDIATE] = self._fetchImmediate
+		self.operandFetchers[Opcodes.PARAM_REGISTER] = self._fetchRegister
+		self.operandFetchers[Opcodes.PARAM_MEMORY_SINGLE_DS] = self._fetchMemorySingleDS
+		self.operandFetchers[Opcodes.PARAM_MEMORY_SINGLE_ES] = self._fetchMemorySingleES
+		self.operandFetchers[Opcodes.PARAM_MEMORY_DOUBLE_DS] = self._fetchMemoryDoubleDS
+		self.operandFetchers[Opcodes.PARAM_MEMORY_DOUBLE_ES] = self._fetchMemoryDoubleES
+		self.operandFetchers[Opcodes.PARAM_SPECIAL_REGISTER] = self._fetchSpecialRegister
+
+		#the first operand is resolved to a location (an immediate value, a register index,
+		#a physical address or a special register index depending on the operand type)
+		#which is loaded and, after the instruction, stored to
+		self.locationResolvers = [None] * 8
+		self.locationResolvers[Opcodes.PARAM_IMMEDIATE] = self._resolveImmediate
+		self.locationResolvers[Opcodes.PARAM_REGISTER] = self._resolveRegister
+		self.locationResolvers[Opcodes.PARAM_MEMORY_SINGLE_DS] = self._resolveMemorySingleDS
+		self.locationResolvers[Opcodes.PARAM_MEMORY_SINGLE_ES] = self._resolveMemorySingleES
+		self.locationResolvers[Opcodes.PARAM_MEMORY_DOUBLE_DS] = self._resolveMemoryDoubleDS
+		self.locationResolvers[Opcodes.PARAM_MEMORY_DOUBLE_ES] = self._resolveMemoryDoubleES
+		self.locationResolvers[Opcodes.PARAM_SPECIAL_REGISTER] = self._resolveRegister
+
+		self.locationLoaders = [None] * 8
+		self.locationLoaders[Opcodes.PARAM_IMMEDIATE] = self._loadImmediate
+		self.locationLoaders[Opcodes.PARAM_REGISTER] = self.state.getRegister
+		self.locationLoaders[Opcodes.PARAM_SPECIAL_REGISTER] = self.getSpecialRegister
+
+		#immediates can't be written to
+		self.locationStores = [None] * 8
+		self.locationStores[Opcodes.PARAM_REGISTER] = self.state.setRegister
+		self.locationStores[Opcodes.PARAM_SPECIAL_REGISTER] = self.setSpecialRegister
+
+		for operandType in (Opcodes.PARAM_MEMORY_SINGLE_DS, Opcodes.PARAM_MEMORY_SINGLE_ES, Opcodes.PARAM_MEMORY_DOUBLE_DS, Opcodes.PARAM_MEMORY_DOUBLE_ES):
+			self.locationLoaders[operandType] = self.memory.readWord
+			self.locationStores[operandType] = self.memory.writeWord
+
 		self.reset()
 
+	@classmethod
+	def registerInstruction(cls, opcode, name, nargs, paramtypes, handler):
+		""" Adds an instruction to the simulator. handler is called as
+			handler(cpu, operand1, operand2, ipadd), see STEP_DONE and STEP_HALT
+			for its possible results. Only CPUs created afterwards know the instruction.
+		"""
+		Instructions.addInstruction(opcode, name, nargs, paramtypes)
+		cls.instructionHandlers[opcode] = handler
+
+	@classmethod
+	def unregisterInstruction(cls, opcode):
+		""" Removes an instruction added by registerInstruction, CPUs created before
+			still execute it
+		"""
+		Instructions.removeInstruction(opcode)
+		del cls.instructionHandlers[opcode]
+
+	@classmethod
+	def createFromSnapshot(cls, snapshot, console=None, tracer=None):
+		""" Creates a CPU continuing from a snapshot, e.g. one loaded from disk """
+		cpu = cls(memory=Memory.createFromSnapshot(snapshot.memory), console=console, tracer=tracer)
+		cpu.state.restore(snapshot.state)
+		return cpu
+
 	def reset(self):
 		self.state.reset(self.memory)
 
+	def snapshot(self):
+		""" Captures state and memory of the CPU. Memory pages are shared copy-on-write
+			with the snapshot, so restoring the latest snapshot only costs the pages
+			written since.
+		"""
+		return Snapshot(self.state.snapshot(), self.memory.snapshot())
+
+	def restore(self, snapshot):
+		self.memory.restore(snapshot.memory)
+		self.state.restore(snapshot.state)
+
+	def run(self, maxSteps=None, until=None):
+		""" Executes instructions until the simulation ends, maxSteps instructions were
+			executed or a condition of until (a StopCondition) is met. A KeyboardInterrupt
+			ends the run as well. Returns a RunResult.
+		"""
+		state = self.state
+		step = self.doSimulationStep
+
+		checkAddresses = until is not None and until.hasAddressConditions()
+		if checkAddresses:
+			breakpoints = until.breakpoints
+			(rangeStart, rangeEnd) = until.addressRange or (0, 0)
+
+		deadline = None
+		if until is not None and until.timeLimit is not None:
+			deadline = time.time() + until.timeLimit
+
+		steps = 0
+		i = 0
+		try:
+			while True:
+				#run in chunks, the step limit and the clock are checked in between
+				chunk = TIME_CHECK_INTERVAL
+				if maxSteps is not None:
+					chunk = min(chunk, maxSteps - steps)
+					if chunk <= 0:
+						return RunResult(STOP_STEP_LIMIT, steps, state.IP)
+
+				if not checkAddresses:
+					for i in xrange(chunk):
+						if not step():
+							return RunResult(STOP_HALTED, steps + i + 1, state.IP)
+				else:
+					for i in xrange(chunk):
+						ip = state.IP
+						if ip in breakpoints or rangeStart <= ip < rangeEnd:
+							return RunResult(until.getAddressStopReason(ip), steps + i, ip)
+						if not step():
+							return RunResult(STOP_HALTED, steps + i + 1, state.IP)
+
+				steps += chunk
+				i = 0
+
+				self.console.flushIfDue()
+
+				if deadline is not None and time.time() >= deadline:
+					return RunResult(STOP_TIME_LIMIT, steps, state.IP)
+		except KeyboardInterrupt:
+			return RunResult(STOP_INTERRUPTED, steps + i, state.IP)
+		finally:
+			self.console.flush()
+
 	def doSimulationStep(self):
-		#check timer for expiration
-		if self.state.isInterruptPending() and self.state.isInterruptEnabled():
+		#the timer only needs attention when its next event is due
+		if self.state.ticks < self.state.nextTimerEvent:
+			self.state.ticks += 1
+		elif self.state.isInterruptPending() and self.state.isInterruptEnabled():
 			self.state.resetInterruptPending()
 			self.raiseTimerInterrupt()
 		else:
 			self.state.handleHardwareTimerTick()
 
-		self.logger.debug("Fetching instruction from %x", self.state.IP)
-
 		try:
-			curWord = self.memory.readBinary(self.state.getResultingInstructionAddress())
-			(opcode, privlvl, operandType1, operandType2) = struct.unpack("<BBBB", curWord)
+			decoded = self.instructionCache.fetch(self.state.getResultingInstructionAddress())
 		except CPUSegmentViolationException, e:
 			self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
 			return True
 
-		registerOperand1 = operandType1 & 0x1F
-		operandType1 = operandType1 >> 5
-
-		registerOperand2 = operandType2 & 0x1F
-		operandType2 = operandType2 >> 5
-
-		#check wether instruction itself exists and raise exception if not
-		if not doesInstructionExist(opcode):
-			self.logger.debug("Unknown instruction at physical 0x%x", self.state.IP)
+		#instruction doesn't exist or has invalid operands
+		if decoded is None:
 			self.raiseInterrupt(Opcodes.INTR_INVALID_INSTR, self.state.IP)
 			return True
 
-		#check wether the operand types encoded in the instruction word are valid for the given opcode and raise exception if not
-		if not areParametersValid(opcode, operandType1, operandType2):
-			self.logger.debug("Invalid parameter type for instruction 0x%x at physical 0x%x", opcode, self.state.IP)
-			self.raiseInterrupt(Opcodes.INTR_INVALID_INSTR, self.state.IP)
-			return True
+		(opcode, privlvl, argumentCount,
+			operandType1, registerOperand1, operandWord1,
+			operandType2, registerOperand2, operandWord2,
+			ipadd) = decoded
 
 		if privlvl < self.state.privLvl:
 			#TODO raise cpu exception
 			print "!!!PrivLvl violation!!!"
 			return False
 
-		argumentCount = getArgumentCount(opcode)
-
-		ipadd = 1
 		operand1 = 0
 		operand2 = 0
+		location = None
 
-		writebackValue = None
-		writebackFunction = None
+		#fetch operands, the first one through its location for the writeback
+		try:
+			if argumentCount > 0:
+				location = self.locationResolvers[operandType1](registerOperand1, operandWord1)
+				operand1 = self.locationLoaders[operandType1](location)
 
-		#decode first operand type, fetch it and prepare a writeback closure
-		if argumentCount > 0:
-			try:
-				if operandType1 == Opcodes.PARAM_IMMEDIATE:
-					operand1 = self.memory.readWord(self.state.getResultingInstructionAddress() + ipadd)
-					ipadd += 1
-
-				elif operandType1 == Opcodes.PARAM_REGISTER:
-					if registerOperand1 > 30:
-						self.logger.debug("Invalid register access for instruction 0x%x at physical 0x%x", opcode, self.state.IP)
-						self.raiseInterrupt(Opcodes.INTR_INVALID_INSTR, self.state.IP)
-						return True
-
-					operand1 = self.state.getRegister(registerOperand1)
-					writebackFunction = lambda val: self.state.setRegister(registerOperand1, val)
-
-				elif operandType1 == Opcodes.PARAM_MEMORY_SINGLE_DS:
-					operand1addr = self.memory.readWord(self.state.getResultingInstructionAddress() + ipadd)
-					if registerOperand1 != 31: operand1addr += self.state.getRegister(registerOperand1);
-					operand1addr = self.state.getResultingDataAddress(operand1addr)
-					operand1 = self.memory.readWord(operand1addr)
-					writebackFunction = lambda val: self.memory.writeWord(operand1addr, val)
-					ipadd += 1
-
-				elif operandType1 == Opcodes.PARAM_MEMORY_SINGLE_ES:
-					operand1addr = self.memory.readWord(self.state.getResultingInstructionAddress() + ipadd)
-					if registerOperand1 != 31: operand1addr += self.state.getRegister(registerOperand1)
-					operand1addr = self.state.getResultingExtraAddress(operand1addr)
-					operand1 = self.memory.readWord(operand1addr)
-					writebackFunction = lambda val: self.memory.writeWord(operand1addr, val)
-					ipadd += 1
-
-				elif operandType1 == Opcodes.PARAM_MEMORY_DOUBLE_DS:
-					operand1addr = self.memory.readWord(self.state.getResultingInstructionAddress() + ipadd)
-					operand1addr = self.memory.readWord(self.state.getResultingDataAddress(operand1addr))
-					if registerOperand1 != 31: operand1addr += self.state.getRegister(registerOperand1)
-					operand1addr = self.state.getResultingDataAddress(operand1addr);
-					operand1 = self.memory.readWord(operand1addr)
-					writebackFunction = lambda val: self.memory.writeWord(operand1addr, val)
-					ipadd += 1
-
-				elif operandType1 == Opcodes.PARAM_MEMORY_DOUBLE_ES:
-					operand1addr = self.memory.readWord(self.state.getResultingInstructionAddress() + ipadd)
-					operand1addr = self.memory.readWord(self.state.getResultingExtraAddress(operand1addr))
-					if registerOperand1 != 31: operand1addr += self.state.getRegister(registerOperand1)
-					operand1addr = self.state.getResultingExtraAddress(operand1addr)
-					operand1 = self.memory.readWord(operand1addr)
-					writebackFunction = lambda val: self.memory.writeWord(operand1addr, val)
-					ipadd += 1
-
-				elif operandType1 == Opcodes.PARAM_SPECIAL_REGISTER:
-					operand1 = self.getSpecialRegister(registerOperand1)
-					writebackFunction = lambda val: self.setSpecialRegister(registerOperand1, val)
+			if argumentCount > 1:
+				operand2 = self.operandFetchers[operandType2](registerOperand2, operandWord2)
+		except CPUSegmentViolationException, e:
+			self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+			return True
 
-				else:
-					self.logger.error("Unknown operand type for operand 1: %x", operandType1)
-					return False
+		handler = self.dispatchTable[opcode]
+		if handler is None:
+			self.logger.error("Internal simulator error: Don't know how to simulate instruction %x. I'm so sorry! :(", opcode)
+			return False
 
-			except CPUSegmentViolationException, e:
-				self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
-				return True
-		
-		#decode second operand type and fetch it
-		if argumentCount > 1:
-			try:
-				if operandType2 == Opcodes.PARAM_IMMEDIATE:
-					operand2 = self.memory.readWord(self.state.getResultingInstructionAddress() + ipadd)
-					ipadd += 1
-
-				elif operandType2 == Opcodes.PARAM_REGISTER:
-					if registerOperand1 > 30:
-						self.logger.debug("Invalid register access for instruction 0x%x at physical 0x%x", opcode, self.state.IP)
-						self.raiseInterrupt(Opcodes.INTR_INVALID_INSTR, self.state.IP)
-						return True
-
-					operand2 = self.state.getRegister(registerOperand2)
-
-				elif operandType2 == Opcodes.PARAM_MEMORY_SINGLE_DS:
-					operand2addr = self.memory.readWord(self.state.getResultingInstructionAddress() + ipadd)
-					if registerOperand2 != 31: operand2addr += self.state.getRegister(registerOperand2)
-					operand2 = self.memory.readWord(self.state.getResultingDataAddress(operand2addr))
-					ipadd += 1
-
-				elif operandType2 == Opcodes.PARAM_MEMORY_SINGLE_ES:
-					operand2addr = self.memory.readWord(self.state.getResultingInstructionAddress() + ipadd)
-					if registerOperand2 != 31: operand2addr += self.state.getRegister(registerOperand2)
-					operand2 = self.memory.readWord(self.state.getResultingExtraAddress(operand2addr))
-					ipadd += 1
-
-				elif operandType2 == Opcodes.PARAM_MEMORY_DOUBLE_DS:
-					operand2addr = self.memory.readWord(self.state.getResultingInstructionAddress() + ipadd)
-					operand2addr = self.memory.readWord(self.state.getResultingDataAddress(operand2addr))
-					if registerOperand2 != 31: operand2addr += self.state.getRegister(registerOperand2)
-					operand2addr = self.state.getResultingDataAddress(operand2addr);
-					operand2 = self.memory.readWord(operand2addr)
-					ipadd += 1
-
-				elif operandType2 == Opcodes.PARAM_MEMORY_DOUBLE_ES:
-					operand2addr = self.memory.readWord(self.state.getResultingInstructionAddress() + ipadd)
-					operand2addr = self.memory.readWord(self.state.getResultingExtraAddress(operand2addr))
-					if registerOperand2 != 31: operand2addr += self.state.getRegister(registerOperand2)
-					operand2addr = self.state.getResultingExtraAddress(operand2addr);
-					operand2 = self.memory.readWord(operand2addr)
-					ipadd += 1
-
-				elif operandType2 == Opcodes.PARAM_SPECIAL_REGISTER:
-					operand2 = self.getSpecialRegister(registerOperand2)
+		writebackValue = handler(operand1, operand2, ipadd)
 
-				else:
-					self.logger.error("Unknown operand type for operand 2: %x", operandType2)
-					return False
-			except CPUSegmentViolationException, e:
-				self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
-				return True
+		if writebackValue is STEP_DONE:
+			return True
 
-		#handle opcode
-
-		#ADD
-		if opcode == Opcodes.OP_ADD:
-			#print "OP_ADD"
-			writebackValue = (operand1 + operand2) & 0xFFFFFFFF
-
-		#SUB
-		elif opcode == Opcodes.OP_SUB:
-			#print "OP_SUB"
-			#TODO 2er komplement foo?
-			writebackValue = (operand1 - operand2) & 0xFFFFFFFF
-
-		#MUL
-		elif opcode == Opcodes.OP_MUL:
-			#print "Opcodes.OP_MUL"
-			writebackValue = (operand1 * operand2) & 0xFFFFFFFF
-
-		#DIV
-		elif opcode == Opcodes.OP_DIV:
-			#print "Opcodes.OP_DIV"
-			if operand2 == 0:
-				self.logger.debug("Division by zero occured at physical 0x%x", self.state.IP)
-				self.raiseInterrupt(Opcodes.INTR_DIV_BY_ZERO, self.state.IP)
-				return True
+		if writebackValue is STEP_HALT:
+			self.console.flush()
+			return False
 
-			writebackValue = (operand1 / operand2) & 0xFFFFFFFF
-
-		#MOD
-		elif opcode == Opcodes.OP_MOD:
-			#print "OP_MOD"
-			writebackValue = (operand1 % operand2) & 0xFFFFFFFF
-
-		#OR
-		elif opcode == Opcodes.OP_OR:
-			#print "OP_OR"
-			writebackValue = operand1 | operand2
-
-		#XOR
-		elif opcode == Opcodes.OP_XOR:
-			#print "OP_XOR"
-			writebackValue = operand1 ^ operand2
-
-		#AND
-		elif opcode == Opcodes.OP_AND:
-			#print "OP_AND"
-			writebackValue = operand1 & operand2
-
-		#NOT
-		elif opcode == Opcodes.OP_NOT:
-			#print "OP_NOT"
-			writebackValue = operand1 ^ operand2
-
-		#SHL
-		elif opcode == Opcodes.OP_SHL:
-			#print "OP_SHL"
-			writebackValue = (operand1 << operand2) & 0xFFFFFFFF
-
-		#SHR
-		elif opcode == Opcodes.OP_SHR:
-			#print "OP_SHR"
-			writebackValue = (operand1 >> operand2) & 0xFFFFFFFF
-
-		#MOV
-		elif opcode == Opcodes.OP_MOV:
-			#print "OP_MOV"
-			writebackValue = operand2
-
-		#NOP
-		elif opcode == Opcodes.OP_NOP:
-			pass
-
-		#HALT
-		elif opcode == Opcodes.OP_HALT:
-			#print "Opcodes.OP_HALT"
-			if not self.state.InVM:
+		#perform writeback if necessary
+		if writebackValue != None:
+			if argumentCount == 0:
+				self.logger.error("Internal simulator error: Can't do writeback on 0-operand instructions")
+				return False
+
+			store = self.locationStores[operandType1]
+			if store == None:
+				self.logger.error("Internal simulator error: Instruction wants to perform writeback, but the operand isn't writable")
 				return False
-			else:
-				self.state.IP += ipadd
-				self.raiseVMExitEvent(Opcodes.HVTRAP_HALT, [operand1 & 0xFF])
-				return True
 
-		#PRINT
-		elif opcode == Opcodes.OP_PRINT:
-			#print "Opcodes.OP_PRINT"
-			if not self.state.InVM:
-				sys.stdout.write(chr(operand1 & 0xFF))
-				sys.stdout.flush()
-			else:
-				self.state.IP += ipadd
-				self.raiseVMExitEvent(Opcodes.HVTRAP_HARDWARE_ACCESS, [operand1 & 0xFF])
+			try:
+				store(location, writebackValue)
+			except CPUStateSegTblFaultyError:	#if we try to load a malformed segmentation table, this exception is thrown
+				self.raiseInterrupt(Opcodes.INTR_INVALID_INSTR, self.state.IP)
 				return True
 
-		#CMP
-		elif opcode == Opcodes.OP_CMP:
-			#print "Opcodes.OP_CMP"
-			if operand1 >= operand2:
-				self.state.setGreaterEqualFlag()
-			else:
-				self.state.clearGreaterEqualFlag()
-
-			if operand1 == operand2:
-				self.state.setZeroFlag()
-			else:
-				self.state.clearZeroFlag()
-
-		#JMP
-		elif opcode == Opcodes.OP_JMP:
-			#print "Opcodes.OP_JMP to 0x%x" % operand1
-			self.state.IP = operand1
-			return True
+		#advance instruction pointer
+		self.state.IP += ipadd
 
-		#JZ
-		elif opcode == Opcodes.OP_JZ:
-			#print "Opcodes.OP_JZ"
-			if self.state.getZeroFlag():
-				self.state.IP = operand1
-				return True
+		return True
 
-		#JNZ
-		elif opcode == Opcodes.OP_JNZ:
-			#print "Opcodes.OP_JNZ"
-			if not self.state.getZeroFlag():
-				self.state.IP = operand1
-				return True
+	def _trace(self, kind, *data):
+		if self.tracer is not None:
+			self.tracer.event(kind, self.state.ticks, self.state.IP, data)
 
-		#JGT
-		elif opcode == Opcodes.OP_JGT:
-			#print "Opcodes.OP_JGT"
-			if self.state.getGreaterEqualFlag() and (not self.state.getZeroFlag()):
-				self.state.IP = operand1
-				return True
+	#Operand fetchers and resolvers, called with the register number and the word following
+	#the instruction word as decoded by the instruction cache
 
-		#JGE
-		elif opcode == Opcodes.OP_JGE:
-			#print "Opcodes.OP_JGE"
-			if self.state.getGreaterEqualFlag():
-				self.state.IP = operand1
-				return True
+	def _resolveMemorySingleDS(self, register, word):
+		if register != 31: word += self.state.getRegister(register)
+		return self.state.getResultingDataAddress(word)
 
-		#CALL
-		elif opcode == Opcodes.OP_CALL:
-			#push return address
-			try:
-				self.pushToStack(self.state.IP + ipadd)
+	def _resolveMemorySingleES(self, register, word):
+		if register != 31: word += self.state.getRegister(register)
+		return self.state.getResultingExtraAddress(word)
 
-				#set new IP
-				self.state.IP = operand1
-			except CPUSegmentViolationException, e:
-				self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+	def _resolveMemoryDoubleDS(self, register, word):
+		address = self.memory.readWord(self.state.getResultingDataAddress(word))
+		if register != 31: address += self.state.getRegister(register)
+		return self.state.getResultingDataAddress(address)
 
-			return True
+	def _resolveMemoryDoubleES(self, register, word):
+		address = self.memory.readWord(self.state.getResultingExtraAddress(word))
+		if register != 31: address += self.state.getRegister(register)
+		return self.state.getResultingExtraAddress(address)
 
-		#RET
-		elif opcode == Opcodes.OP_RET:
-			#get new IP from stack
-			try:
-				self.state.IP = self.popFromStack()
-			except CPUSegmentViolationException, e:
-				self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+	def _fetchImmediate(self, register, word):
+		return word
 
-			return True
+	def _fetchRegister(self, register, word):
+		return self.state.getRegister(register)
 
-		#RETN
-		elif opcode == Opcodes.OP_RETN:
-			#get new IP from stack
-			try:
-				self.state.IP = self.popFromStack()
-				for i in range(operand1): self.state.incrementStackPointer()
-			except CPUSegmentViolationException, e:
-				self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+	def _fetchMemorySingleDS(self, register, word):
+		return self.memory.readWord(self._resolveMemorySingleDS(register, word))
 
-			return True
-		
-		#PUSH
-		elif opcode == Opcodes.OP_PUSH:
-			try:
-				self.pushToStack(operand1)
-			except CPUSegmentViolationException, e:
-				self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
-				return True
+	def _fetchMemorySingleES(self, register, word):
+		return self.memory.readWord(self._resolveMemorySingleES(register, word))
 
-		#POP
-		elif opcode == Opcodes.OP_POP:
-			try:
-				writebackValue = self.popFromStack()
-			except CPUSegmentViolationException, e:
-				self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
-				return True
+	def _fetchMemoryDoubleDS(self, register, word):
+		return self.memory.readWord(self._resolveMemoryDoubleDS(register, word))
 
-		#ENTER
-		elif opcode == Opcodes.OP_ENTER:
-			try:
-				self.pushToStack(self.state.getRegister(29))			#push basepointer
-				self.state.setRegister(29, self.state.getRegister(30))	#set new basepointer
-			except CPUSegmentViolationException, e:
-				self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
-				return True
+	def _fetchMemoryDoubleES(self, register, word):
+		return self.memory.readWord(self._resolveMemoryDoubleES(register, word))
 
-		#LEAVE
-		elif opcode == Opcodes.OP_LEAVE:
-			try:
-				self.state.setRegister(29, self.popFromStack())
-			except CPUSegmentViolationException, e:
-				self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
-				return True
+	def _fetchSpecialRegister(self, register, word):
+		return self.getSpecialRegister(register)
 
-		#GETARGUMENT
-		elif opcode == Opcodes.OP_GETARGUMENT:
-			try:
-				writebackValue = self.memory.readWord(self.state.getRegister(29) + 2 + operand2)
-			except CPUSegmentViolationException, e:
-				self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
-				return True
+	#Location resolvers and loaders of the first operand
 
-		#INT
-		elif opcode == Opcodes.OP_INT:
-			try:
-				if operand1 > 26:	#we only have interrupts between 0 and 26, so raise an exception if we are out of bounds
-					self.raiseInterrupt(Opcodes.INTR_INVALID_INSTR, self.state.IP)
-					return True
-				self.raiseInterrupt((operand1 + Opcodes.INTR_SOFTWARE), self.state.IP + ipadd)
-			except CPUSegmentViolationException, e:
-				self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+	def _resolveImmediate(self, register, word):
+		return word
 
-			return True
+	def _resolveRegister(self, register, word):
+		return register
 
-		#RETI
-		elif opcode == Opcodes.OP_RETI:
-			try:
-				self.state.IP = self.popFromStack()
-			except CPUSegmentViolationException, e:
-				self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+	def _loadImmediate(self, location):
+		return location
 
-			return True
+	#Instruction handlers
 
-		#VMRESUME
-		elif opcode == Opcodes.OP_VMRESUME:
-			if not self.state.InVM:
-				#check if vm context for switch actually exists
-				if operand1 >= len(self.state.vms):
-					self.raiseInterrupt(Opcodes.INTR_INVALID_INSTR, self.state.IP)
-					return True
+	def _opAdd(self, operand1, operand2, ipadd):
+		return (operand1 + operand2) & 0xFFFFFFFF
 
-				self.state.IP += ipadd
-				self.state.saveHypervisorContext()
-				self.state.setVmContext(operand1)
-			else:
-				self.raiseHypervisorTrap(Opcodes.HVTRAP_VMRESUME, [operand1])
+	def _opSub(self, operand1, operand2, ipadd):
+		#TODO 2er komplement foo?
+		return (operand1 - operand2) & 0xFFFFFFFF
 
-			return True
+	def _opMul(self, operand1, operand2, ipadd):
+		return (operand1 * operand2) & 0xFFFFFFFF
+
+	def _opDiv(self, operand1, operand2, ipadd):
+		if operand2 == 0:
+			self.logger.debug("Division by zero occured at physical 0x%x", self.state.IP)
+			self.raiseInterrupt(Opcodes.INTR_DIV_BY_ZERO, self.state.IP)
+			return STEP_DONE
+
+		return (operand1 / operand2) & 0xFFFFFFFF
+
+	def _opMod(self, operand1, operand2, ipadd):
+		return (operand1 % operand2) & 0xFFFFFFFF
+
+	def _opOr(self, operand1, operand2, ipadd):
+		return operand1 | operand2
 
-		#CLI
-		elif opcode == Opcodes.OP_CLI:
-			self.state.disableInterrupts()
+	def _opXor(self, operand1, operand2, ipadd):
+		return operand1 ^ operand2
 
-		#STI
-		elif opcode == Opcodes.OP_STI:
-			self.state.enableInterrupts()
+	def _opAnd(self, operand1, operand2, ipadd):
+		return operand1 & operand2
 
-		#Unknown - internal error
+	def _opNot(self, operand1, operand2, ipadd):
+		return operand1 ^ operand2
+
+	def _opShl(self, operand1, operand2, ipadd):
+		return (operand1 << operand2) & 0xFFFFFFFF
+
+	def _opShr(self, operand1, operand2, ipadd):
+		return (operand1 >> operand2) & 0xFFFFFFFF
+
+	def _opMov(self, operand1, operand2, ipadd):
+		return operand2
+
+	def _opNop(self, operand1, operand2, ipadd):
+		return None
+
+	def _opHalt(self, operand1, operand2, ipadd):
+		if not self.state.InVM:
+			return STEP_HALT
 		else:
-			self.logger.error("Internal simulator error: Don't know how to simulate instruction %x. I'm so sorry! :(", opcode)
-			return False
+			self.state.IP += ipadd
+			self.raiseVMExitEvent(Opcodes.HVTRAP_HALT, [operand1 & 0xFF])
+			return STEP_DONE
 
+	def _opPrint(self, operand1, operand2, ipadd):
+		if not self.state.InVM:
+			self.console.write(chr(operand1 & 0xFF))
+			return None
+		else:
+			self.state.IP += ipadd
+			self.raiseVMExitEvent(Opcodes.HVTRAP_HARDWARE_ACCESS, [operand1 & 0xFF])
+			return STEP_DONE
 
-		#perform writeback if necessary
-		if writebackValue != None:
-			if argumentCount == 0:
-				self.logger.error("Internal simulator error: Can't do writeback on 0-operand instructions")
-				return False
+	def _opCmp(self, operand1, operand2, ipadd):
+		if operand1 >= operand2:
+			self.state.setGreaterEqualFlag()
+		else:
+			self.state.clearGreaterEqualFlag()
 
-			if writebackFunction == None:
-				self.logger.error("Internal simulator error: Instruction wants to perform writeback, but callback is None")
-				return False
+		if operand1 == operand2:
+			self.state.setZeroFlag()
+		else:
+			self.state.clearZeroFlag()
 
-			try:
-				writebackFunction(writebackValue)
-			except CPUStateSegTblFaultyError:	#if we try to load a malformed segmentation table, this exception is thrown
+	def _opJmp(self, operand1, operand2, ipadd):
+		self.state.IP = operand1
+		return STEP_DONE
+
+	def _opJz(self, operand1, operand2, ipadd):
+		if self.state.getZeroFlag():
+			self.state.IP = operand1
+			return STEP_DONE
+
+	def _opJnz(self, operand1, operand2, ipadd):
+		if not self.state.getZeroFlag():
+			self.state.IP = operand1
+			return STEP_DONE
+
+	def _opJgt(self, operand1, operand2, ipadd):
+		if self.state.getGreaterEqualFlag() and (not self.state.getZeroFlag()):
+			self.state.IP = operand1
+			return STEP_DONE
+
+	def _opJge(self, operand1, operand2, ipadd):
+		if self.state.getGreaterEqualFlag():
+			self.state.IP = operand1
+			return STEP_DONE
+
+	def _opCall(self, operand1, operand2, ipadd):
+		#push return address
+		try:
+			self.pushToStack(self.state.IP + ipadd)
+
+			#set new IP
+			self.state.IP = operand1
+		except CPUSegmentViolationException, e:
+			self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+
+		return STEP_DONE
+
+	def _opRet(self, operand1, operand2, ipadd):
+		#get new IP from stack
+		try:
+			self.state.IP = self.popFromStack()
+		except CPUSegmentViolationException, e:
+			self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+
+		return STEP_DONE
+
+	def _opRetn(self, operand1, operand2, ipadd):
+		#get new IP from stack
+		try:
+			self.state.IP = self.popFromStack()
+			for i in range(operand1): self.state.incrementStackPointer()
+		except CPUSegmentViolationException, e:
+			self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+
+		return STEP_DONE
+
+	def _opPush(self, operand1, operand2, ipadd):
+		try:
+			self.pushToStack(operand1)
+		except CPUSegmentViolationException, e:
+			self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+			return STEP_DONE
+
+	def _opPop(self, operand1, operand2, ipadd):
+		try:
+			return self.popFromStack()
+		except CPUSegmentViolationException, e:
+			self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+			return STEP_DONE
+
+	def _opEnter(self, operand1, operand2, ipadd):
+		try:
+			self.pushToStack(self.state.getRegister(29))			#push basepointer
+			self.state.setRegister(29, self.state.getRegister(30))	#set new basepointer
+		except CPUSegmentViolationException, e:
+			self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+			return STEP_DONE
+
+	def _opLeave(self, operand1, operand2, ipadd):
+		try:
+			self.state.setRegister(29, self.popFromStack())
+		except CPUSegmentViolationException, e:
+			self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+			return STEP_DONE
+
+	def _opGetArgument(self, operand1, operand2, ipadd):
+		try:
+			return self.memory.readWord(self.state.getRegister(29) + 2 + operand2)
+		except CPUSegmentViolationException, e:
+			self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+			return STEP_DONE
+
+	def _opInt(self, operand1, operand2, ipadd):
+		try:
+			if operand1 > 26:	#we only have interrupts between 0 and 26, so raise an exception if we are out of bounds
 				self.raiseInterrupt(Opcodes.INTR_INVALID_INSTR, self.state.IP)
-				return True
+				return STEP_DONE
+			self.raiseInterrupt((operand1 + Opcodes.INTR_SOFTWARE), self.state.IP + ipadd)
+		except CPUSegmentViolationException, e:
+			self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
 
-		#advance instruction pointer
-		self.state.IP += ipadd
+		return STEP_DONE
 
-		return True
+	def _opReti(self, operand1, operand2, ipadd):
+		try:
+			self.state.IP = self.popFromStack()
+		except CPUSegmentViolationException, e:
+			self.raiseInterrupt(Opcodes.INTR_SEG_VIOL, self.state.IP, [e.segment, e.offset])
+
+		return STEP_DONE
+
+	def _opVmResume(self, operand1, operand2, ipadd):
+		if not self.state.InVM:
+			#check if vm context for switch actually exists
+			if operand1 >= len(self.state.vms):
+				self.raiseInterrupt(Opcodes.INTR_INVALID_INSTR, self.state.IP)
+				return STEP_DONE
+
+			self.state.IP += ipadd
+			self.state.saveHypervisorContext()
+			self.state.setVmContext(operand1)
+		else:
+			self.raiseHypervisorTrap(Opcodes.HVTRAP_VMRESUME, [operand1])
+
+		return STEP_DONE
+
+	def _opCli(self, operand1, operand2, ipadd):
+		self.state.disableInterrupts()
+
+	def _opSti(self, operand1, operand2, ipadd):
+		self.state.enableInterrupts()
 
 	def pushToStack(self, value):
 		self.state.decrementStackPointer()
@@ -484,6 +541,8 @@ class CPU(object):
 		if interruptNumber > 32:
 			raise SimulatorError("Interrupt number is out of bounds")
 
+		self._trace(TRACE_INTERRUPT, interruptNumber, returnIp)
+
 		if not self.state.InVM:
 			try:
 				map(lambda x: self.pushToStack(x), additionalStackValues)
@@ -506,11 +565,15 @@ class CPU(object):
 			self.raiseVMExitEvent(hvTrapNumber, additionalStackValues)
 
 	def raiseTimerInterrupt(self):
+		self._trace(TRACE_TIMER_INTERRUPT)
+
 		if not self.state.InVM:
 			self.pushToStack(self.state.IP)
 			self.state.IP = self.state.getResultingInterruptAddress() + Opcodes.INTR_TIMER * 2
 		else:
 			currentvm = self.state.VmID
+			self._trace(TRACE_VM_EXIT, Opcodes.HVTRAP_TIMER, currentvm)
+
 			self.state.saveVmContext(currentvm)	#save current vm state
 			self.state.setVmContext(0)	#switch to hypervisor state
 			self.state.InVM = False		#we are no longer inside of a VM
@@ -525,6 +588,8 @@ class CPU(object):
 
 	def raiseVMExitEvent(self, trapNumber, additionalStackValues=[]):
 		currentvm = self.state.VmID
+		self._trace(TRACE_VM_EXIT, trapNumber, currentvm)
+
 		self.state.saveVmContext(currentvm)	#save current vm state
 		self.state.setVmContext(0)	#switch to hypervisor state
 		self.state.InVM = False		#we are no longer inside of a VM
@@ -548,3 +613,46 @@ class CPU(object):
 			return self.state.getSpecialRegister(specialRegister)
 		else:
 			self.raiseVMExitEvent(Opcodes.HVTRAP_SPECIAL_REG_READ, [specialRegister])
+
+CPU.instructionHandlers.update({
+	Opcodes.OP_ADD: CPU._opAdd,
+	Opcodes.OP_SUB: CPU._opSub,
+	Opcodes.OP_MUL: CPU._opMul,
+	Opcodes.OP_DIV: CPU._opDiv,
+	Opcodes.OP_MOD: CPU._opMod,
+
+	Opcodes.OP_OR: CPU._opOr,
+	Opcodes.OP_XOR: CPU._opXor,
+	Opcodes.OP_AND: CPU._opAnd,
+	Opcodes.OP_NOT: CPU._opNot,
+	Opcodes.OP_SHL: CPU._opShl,
+	Opcodes.OP_SHR: CPU._opShr,
+
+	Opcodes.OP_MOV: CPU._opMov,
+	Opcodes.OP_NOP: CPU._opNop,
+	Opcodes.OP_HALT: CPU._opHalt,
+	Opcodes.OP_PRINT: CPU._opPrint,
+
+	Opcodes.OP_CMP: CPU._opCmp,
+
+	Opcodes.OP_JMP: CPU._opJmp,
+	Opcodes.OP_JZ: CPU._opJz,
+	Opcodes.OP_JNZ: CPU._opJnz,
+	Opcodes.OP_JGT: CPU._opJgt,
+	Opcodes.OP_JGE: CPU._opJge,
+	Opcodes.OP_CALL: CPU._opCall,
+	Opcodes.OP_RET: CPU._opRet,
+	Opcodes.OP_RETN: CPU._opRetn,
+
+	Opcodes.OP_PUSH: CPU._opPush,
+	Opcodes.OP_POP: CPU._opPop,
+	Opcodes.OP_ENTER: CPU._opEnter,
+	Opcodes.OP_LEAVE: CPU._opLeave,
+	Opcodes.OP_GETARGUMENT: CPU._opGetArgument,
+
+	Opcodes.OP_INT: CPU._opInt,
+	Opcodes.OP_RETI: CPU._opReti,
+	Opcodes.OP_VMRESUME: CPU._opVmResume,
+	Opcodes.OP_CLI: CPU._opCli,
+	Opcodes.OP_STI: CPU._opSti,
+})
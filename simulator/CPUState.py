@@ -1,16 +1,47 @@
 from common.Opcodes import *
 from Exceptions import CPUStateError, CPUStateSegTblFaultyError, CPUSegmentViolationException
+from Memory import MEMORY_SIZE
+from Trace import TRACE_VM_ENTER, TRACE_SEGTBL_LOAD, TRACE_VMTBL_LOAD
 
+import sys
 from collections import namedtuple
 
 SegmentEntry = namedtuple("SegmentEntry", ["start", "limit", "type", "privLvl"])
 VmEntry = namedtuple("VmEntry", ["CS", "DS", "ES", "SS", "RS", "IP", "Flags", "privLvl"])
 
+#cached segment bounds while no segment table is loaded and for invalid selectors
+_UNSEGMENTED_BOUNDS = (-sys.maxint - 1, sys.maxint)
+_INVALID_BOUNDS = (1, 0)
+
+#value of nextTimerEvent while no timer event is scheduled
+NO_TIMER_EVENT = sys.maxint
+
+#causes of segment cache reloads, all but a selector change replace every cached bound
+SEGMENT_CACHE_RESET = 'reset'
+SEGMENT_CACHE_TABLE = 'table'
+SEGMENT_CACHE_SELECTOR = 'selector'
+SEGMENT_CACHE_VM = 'vm'
+SEGMENT_CACHE_RESTORE = 'restore'
+_SEGMENT_CACHE_FLUSHES = (SEGMENT_CACHE_TABLE, SEGMENT_CACHE_VM, SEGMENT_CACHE_RESTORE)
+
+#attributes captured by CPUState.snapshot(), everything else is derived from them
+_SNAPSHOT_FIELDS = (
+	"CS", "DS", "ES", "SS", "RS", "IP", "Flags", "VmTbl", "SegTbl", "InVM", "VmID", "privLvl",
+	"ticks", "counterBase", "counterTicks", "_compare", "_int", "_interruptPending",
+	"vmTableValid", "vmTableRange",
+)
+
 class CPUState(object):
 	def __init__(self):
+		self.memory = None
+		self.tracer = None
+		self.registerWords = {}
+		self.vmTableRange = None
 		self.reset(None)
 
 	def reset(self, memory):
+		self._detachRegisterFile()
+		self._detachVmTable()
 		self.memory = memory
 
 		#Segments
@@ -33,54 +64,65 @@ class CPUState(object):
 		self.InVM = False
 		self.VmID = 0
 
-		self.Counter = 0
-		self.Compare = 0
-		self.Int = 0
-
-		self.interruptPending = False
+		#the timer counts ticks (one per executed instruction), Counter is derived from them
+		self.ticks = 0
+		self.counterBase = 0
+		self.counterTicks = 0
+		self._compare = 0
+		self._int = 0
+		self._interruptPending = False
+		self.nextTimerEvent = NO_TIMER_EVENT
 
 		self.privLvl = 0
 
 		self.segments = []
-		self.vms = []
+		self._vms = []
+		self.vmTableValid = True
 
-	def getResultingInstructionAddress(self):
-		#TODO: check if privLvl is not violated
+		self.segmentCacheReloads = dict.fromkeys((SEGMENT_CACHE_RESET, SEGMENT_CACHE_SELECTOR) + _SEGMENT_CACHE_FLUSHES, 0)
+		self._reloadSegmentCache(SEGMENT_CACHE_RESET)
 
-		if len(self.segments) == 0:
-			return self.IP
-		else:
-			#check if segment descriptor exists
-			if len(self.segments) < self.CS:
-				raise CPUSegmentViolationException(SEGMENT_CODE, self.IP)
+		self._reloadRegisterFile()
 
-			#check type of segment
-			if self.segments[self.CS].type != SEGMENT_CODE:
-				raise CPUSegmentViolationException(SEGMENT_CODE, self.IP)
+	def snapshot(self):
+		""" Returns the state as a dictionary, see restore() """
+		snapshot = dict((field, getattr(self, field)) for field in _SNAPSHOT_FIELDS)
+		snapshot['segments'] = list(self.segments)
+		snapshot['vms'] = list(self._vms)
+		return snapshot
 
-			#check boundaries of segment
-			if self.IP < self.segments[self.CS].start or self.IP > self.segments[self.CS].limit:
-				raise CPUSegmentViolationException(SEGMENT_CODE, self.IP)
+	def restore(self, snapshot):
+		""" Restores a snapshot() of this or another state. The memory has to be restored
+			to the contents at the time of the snapshot before.
+		"""
+		self._detachVmTable()
 
-			return self.IP
+		for field in _SNAPSHOT_FIELDS:
+			setattr(self, field, snapshot[field])
+		self.segments = list(snapshot['segments'])
+		self._vms = list(snapshot['vms'])
 
-	def getResultingCodeAddress(self, offset):
-		if len(self.segments) == 0:
-			return offset
-		else:
-			#check if segment descriptor exists
-			if len(self.segments) < self.CS:
-				raise CPUSegmentViolationException(SEGMENT_CODE, offset)
+		if self.vmTableRange is not None:
+			for word in range(*self.vmTableRange):
+				self.memory.addWriteWatch(word, self._vmTableWritten)
 
-			#check type of segment
-			if self.segments[self.CS].type != SEGMENT_CODE:
-				raise CPUSegmentViolationException(SEGMENT_CODE, offset)
+		self._reloadSegmentCache(SEGMENT_CACHE_RESTORE)
+		self._reloadRegisterFile()
+		self._scheduleTimerEvent()
+
+	def getResultingInstructionAddress(self):
+		#TODO: check if privLvl is not violated
 
-			#check boundaries of segment
-			if offset < self.segments[self.CS].start or offset > self.segments[self.CS].limit:
-				raise CPUSegmentViolationException(SEGMENT_CODE, offset)
+		if not self.codeStart <= self.IP <= self.codeLimit:
+			raise CPUSegmentViolationException(SEGMENT_CODE, self.IP)
 
-			return offset
+		return self.IP
+
+	def getResultingCodeAddress(self, offset):
+		if not self.codeStart <= offset <= self.codeLimit:
+			raise CPUSegmentViolationException(SEGMENT_CODE, offset)
+
+		return offset
 
 	def getResultingInterruptAddress(self):
 		if len(self.segments) == 0:
@@ -89,65 +131,76 @@ class CPUState(object):
 			return self.segments[self.CS].start
 
 	def getResultingDataAddress(self, offset):
-		if len(self.segments) == 0:
-			return offset
-		else:
-			#check if segment descriptor exists
-			if len(self.segments) < self.DS:
-				raise CPUSegmentViolationException(SEGMENT_DATA, offset)
-
-			#check type of segment
-			if self.segments[self.DS].type != SEGMENT_DATA:
-				raise CPUSegmentViolationException(SEGMENT_DATA, offset)
+		if not self.dataStart <= offset <= self.dataLimit:
+			raise CPUSegmentViolationException(SEGMENT_DATA, offset)
 
-			#check boundaries of segment
-			if offset < self.segments[self.DS].start or offset > self.segments[self.DS].limit:
-				raise CPUSegmentViolationException(SEGMENT_DATA, offset)
-
-			return offset
+		return offset
 
 	def getResultingExtraAddress(self, offset):
-		if len(self.segments) == 0:
-			return offset
-		else:
-			#check if segment descriptor exists
-			if len(self.segments) < self.ES:
-				raise CPUSegmentViolationException(SEGMENT_DATA, offset)
+		if not self.extraStart <= offset <= self.extraLimit:
+			raise CPUSegmentViolationException(SEGMENT_DATA, offset)
 
-			#check type of segment
-			if self.segments[self.ES].type != SEGMENT_DATA:
-				raise CPUSegmentViolationException(SEGMENT_DATA, offset)
+		return offset
 
-			#check boundaries of segment
-			if offset < self.segments[self.ES].start or offset > self.segments[self.ES].limit:
-				raise CPUSegmentViolationException(SEGMENT_DATA, offset)
+	def getResultingStackAddress(self):
+		sp = self.getRegister(30)
 
-			return offset
+		if not self.stackStart <= sp <= self.stackLimit:
+			raise CPUSegmentViolationException(SEGMENT_STACK, sp)
 
-	def getResultingStackAddress(self):
-		if len(self.segments) == 0:
-			return self.getRegister(30)
-		else:
-			sp = self.getRegister(30)
-			
-			#check if segment descriptor exists
-			if len(self.segments) < self.SS:
-				raise CPUSegmentViolationException(SEGMENT_STACK, sp)
+		return sp
 
-			#check type of segment
-			if self.segments[self.SS].type != SEGMENT_STACK:
-				raise CPUSegmentViolationException(SEGMENT_STACK, sp)
+	def _reloadSegmentCache(self, cause):
+		""" Caches the bounds of the segments selected by CS, DS, ES and SS.
 
-			#check boundaries of segment
-			if sp < self.segments[self.SS].start or sp > self.segments[self.SS].limit:
-				raise CPUSegmentViolationException(SEGMENT_STACK, sp)
+			Has to be called whenever a selector or the segment table changes. A selector
+			which doesn't point to a segment of the right type gets empty bounds, so every
+			access through it is a segment violation. The register segment selected by RS
+			is cached by the register file. The reloads are counted per cause.
+		"""
+		self.segmentCacheReloads[cause] += 1
 
-			return sp
+		(self.codeStart, self.codeLimit) = self._segmentBounds(self.CS, SEGMENT_CODE)
+		(self.dataStart, self.dataLimit) = self._segmentBounds(self.DS, SEGMENT_DATA)
+		(self.extraStart, self.extraLimit) = self._segmentBounds(self.ES, SEGMENT_DATA)
+		(self.stackStart, self.stackLimit) = self._segmentBounds(self.SS, SEGMENT_STACK)
+
+	def _segmentBounds(self, selector, type):
+		if len(self.segments) == 0:
+			return _UNSEGMENTED_BOUNDS
+
+		#check if segment descriptor exists and has the right type
+		if selector >= len(self.segments) or self.segments[selector].type != type:
+			return _INVALID_BOUNDS
+
+		return (self.segments[selector].start, self.segments[selector].limit)
+
+	def getSegmentCacheStatistics(self):
+		""" Returns the reloads of the cached bounds per cause and in total, the flushes
+			(reloads by a table load, VM switch or restore) and their rates per access.
+			Accesses aren't counted to keep them cheap, every executed instruction checks
+			at least its fetch against the cached bounds, so the ticks are used instead.
+		"""
+		reloads = sum(self.segmentCacheReloads.itervalues())
+		flushes = sum(self.segmentCacheReloads[cause] for cause in _SEGMENT_CACHE_FLUSHES)
+		accesses = self.ticks
+
+		return {
+			'accesses': accesses,
+			'reloads': reloads,
+			'flushes': flushes,
+			'causes': dict(self.segmentCacheReloads),
+			'reloadRate': float(reloads) / accesses if accesses > 0 else 0.0,
+			'flushRate': float(flushes) / accesses if accesses > 0 else 0.0,
+		}
 
 	def getRegister(self, reg):
 		if reg < 0 or reg > 30:
 			raise CPUStateError("Can't access register smaller than 0 or bigger than 30")
 
+		if self.registerBase is not None:
+			return self.registers[reg]
+
 		if len(self.segments) == 0:
 			return self.memory.readWord(0x2000 + reg)
 		else:
@@ -166,6 +219,14 @@ class CPUState(object):
 		if reg < 0 or reg > 30:
 			raise CPUStateError("Can't access register smaller than 0 or bigger than 30")
 
+		if self.registerBase is not None:
+			#the cached register files are updated here instead of through their watch
+			address = self.registerBase + reg
+			self.memory.writeWord(address, value, self._registerMemoryWritten)
+			for (registers, index) in self.registerWords[address]:
+				registers[index] = value
+			return
+
 		if len(self.segments) == 0:
 			self.memory.writeWord(0x2000 + reg, value)
 		else:
@@ -180,6 +241,61 @@ class CPUState(object):
 			#write register to memory
 			self.memory.writeWord(self.segments[self.RS].start + reg, value)
 
+	def _reloadRegisterFile(self):
+		""" Points the register file cache to the active register segment.
+
+			While the register segment is valid, registers are read from self.registers
+			and written through to memory. Without a valid register segment getRegister
+			and setRegister take the checked path and raise the proper faults.
+
+			A cached copy is kept for every register segment seen since the last reset,
+			so switching between VMs doesn't reload the registers. Memory writes into
+			cached register segments are watched to keep the copies coherent.
+		"""
+		if self.memory is None:
+			return
+
+		if len(self.segments) == 0:
+			base = 0x2000
+		elif self.RS < len(self.segments) and self.segments[self.RS].type == SEGMENT_REGISTER:
+			base = self.segments[self.RS].start
+		else:
+			base = None
+
+		if base is not None and (base < 0 or base + 30 >= MEMORY_SIZE):
+			base = None
+
+		self.registerBase = base
+		if base is None:
+			return
+
+		if not base in self.registerFiles:
+			registers = self.memory.readRange(base, 31)
+			for reg in range(31):
+				self.memory.addWriteWatch(base + reg, self._registerMemoryWritten)
+				self.registerWords.setdefault(base + reg, []).append((registers, reg))
+			self.registerFiles[base] = registers
+
+		self.registers = self.registerFiles[base]
+
+	def _detachRegisterFile(self):
+		for address in self.registerWords:
+			self.memory.removeWriteWatch(address, self._registerMemoryWritten)
+
+		self.registerFiles = {}
+		self.registerWords = {}
+		self.registers = None
+		self.registerBase = None
+
+	def _registerMemoryWritten(self, address):
+		value = self.memory.readWord(address)
+		for (registers, reg) in self.registerWords[address]:
+			registers[reg] = value
+
+	def _trace(self, kind, *data):
+		if self.tracer is not None:
+			self.tracer.event(kind, self.ticks, self.IP, data)
+
 	def getFlags(self):
 		return self.Flags
 
@@ -256,20 +372,29 @@ class CPUState(object):
 
 		if index == SPECIALREG_SEGTBL:
 			self.SegTbl = value
-			self._parseNewSegTbl()
+			try:
+				self._parseNewSegTbl()
+			finally:
+				self._reloadSegmentCache(SEGMENT_CACHE_TABLE)
+				self._reloadRegisterFile()
 		elif index == SPECIALREG_VMTBL:
 			self.VmTbl = value
 			self._parseNewVmTbl()
 		elif index == SPECIALREG_CS:
 			self.CS = value
+			self._reloadSegmentCache(SEGMENT_CACHE_SELECTOR)
 		elif index == SPECIALREG_DS:
 			self.DS = value
+			self._reloadSegmentCache(SEGMENT_CACHE_SELECTOR)
 		elif index == SPECIALREG_ES:
 			self.ES = value
+			self._reloadSegmentCache(SEGMENT_CACHE_SELECTOR)
 		elif index == SPECIALREG_RS:
 			self.RS = value
+			self._reloadRegisterFile()
 		elif index == SPECIALREG_SS:
 			self.SS = value
+			self._reloadSegmentCache(SEGMENT_CACHE_SELECTOR)
 		elif index == SPECIALREG_COUNTER:
 			self.Counter = value
 		elif index == SPECIALREG_COMPARE:
@@ -280,13 +405,74 @@ class CPUState(object):
 			raise CPUStateError("Don't know how to handle special register index - this is a bug!")
 
 	def handleHardwareTimerTick(self):
-		if self.isTimerEnabled():
-			if self.Counter == self.Compare:
-				self.deactivateTimer()
-				self.Counter = 0
-				self.interruptPending = True
-			else:
-				self.Counter += 1
+		""" Slow path of a timer tick, only needed once ticks reached nextTimerEvent.
+			Until then a tick is just an increment of ticks.
+		"""
+		if self.isTimerEnabled() and self.Counter == self.Compare:
+			self.deactivateTimer()
+			self.Counter = 0
+			self.interruptPending = True
+
+		self.ticks += 1
+		self._scheduleTimerEvent()
+
+	def _scheduleTimerEvent(self):
+		""" Computes the tick at which the timer needs the slow path again.
+			Has to be called whenever Counter, Compare, Int or interruptPending change.
+		"""
+		if self._interruptPending and self._int & 1 != 0:
+			self.nextTimerEvent = self.ticks
+		elif self._int & 2 != 0 and self._compare >= self.Counter:
+			self.nextTimerEvent = self.ticks + self._compare - self.Counter
+		else:
+			self.nextTimerEvent = NO_TIMER_EVENT
+
+	def getTicksUntilTimerEvent(self):
+		""" Returns the number of ticks which can pass without timer activity """
+		return max(self.nextTimerEvent - self.ticks, 0)
+
+	def _getCounter(self):
+		if self._int & 2 != 0:
+			return self.counterBase + self.ticks - self.counterTicks
+		else:
+			return self.counterBase
+
+	def _setCounter(self, value):
+		self.counterBase = value
+		self.counterTicks = self.ticks
+		self._scheduleTimerEvent()
+
+	Counter = property(_getCounter, _setCounter)
+
+	def _getCompare(self):
+		return self._compare
+
+	def _setCompare(self, value):
+		self._compare = value
+		self._scheduleTimerEvent()
+
+	Compare = property(_getCompare, _setCompare)
+
+	def _getInt(self):
+		return self._int
+
+	def _setInt(self, value):
+		#freeze the counter, it only advances while the timer is enabled
+		self.counterBase = self.Counter
+		self.counterTicks = self.ticks
+		self._int = value
+		self._scheduleTimerEvent()
+
+	Int = property(_getInt, _setInt)
+
+	def _getInterruptPending(self):
+		return self._interruptPending
+
+	def _setInterruptPending(self, value):
+		self._interruptPending = value
+		self._scheduleTimerEvent()
+
+	interruptPending = property(_getInterruptPending, _setInterruptPending)
 
 	def isTimerEnabled(self):
 		return self.Int & 2 != 0
@@ -340,8 +526,22 @@ class CPUState(object):
 
 			self.segments.append(SegmentEntry(start, limit, type, privLvl))
 
+		self._trace(TRACE_SEGTBL_LOAD, self.SegTbl, len(self.segments))
+
+	def _getVms(self):
+		if not self.vmTableValid:
+			self._parseNewVmTbl()
+		return self._vms
+
+	vms = property(_getVms)
+
 	def _parseNewVmTbl(self):
-		self.vms = []
+		""" Parses the VM table and watches its memory (including the terminating entry).
+			Writes into a VM entry update it in place, writes which could change the
+			length of the table make the next access to vms parse it again.
+		"""
+		self._detachVmTable()
+		self._vms = []
 
 		address = self.VmTbl
 		while True:
@@ -366,7 +566,37 @@ class CPUState(object):
 				break
 
 			#FIXME: check if segment selectors are not out of bounds
-			self.vms.append(VmEntry(cs, ds, es, ss, rs, ip, flags, privLvl))
+			self._vms.append(VmEntry(cs, ds, es, ss, rs, ip, flags, privLvl))
+
+		self._trace(TRACE_VMTBL_LOAD, self.VmTbl, len(self._vms))
+
+		self.vmTableRange = (self.VmTbl, address)
+		for word in range(self.VmTbl, address):
+			self.memory.addWriteWatch(word, self._vmTableWritten)
+		self.vmTableValid = True
+
+	def _detachVmTable(self):
+		if self.vmTableRange is not None:
+			for word in range(*self.vmTableRange):
+				self.memory.removeWriteWatch(word, self._vmTableWritten)
+			self.vmTableRange = None
+
+	def _vmTableWritten(self, address):
+		if not self.vmTableValid:
+			return
+
+		(index, field) = divmod(address - self.VmTbl, 8)
+		if index < len(self._vms):
+			entry = list(self._vms[index])
+			entry[field] = self.memory.readWord(address)
+			if entry == [0xFFFFFFFF] * 8:
+				#the entry became the end of the table
+				self.vmTableValid = False
+			else:
+				self._vms[index] = VmEntry(*entry)
+		else:
+			#the terminating entry was overwritten, the table might have grown
+			self.vmTableValid = False
 
 	def saveHypervisorContext(self):
 		#overwrite first entry (always hypervisor) with current state
@@ -392,20 +622,26 @@ class CPUState(object):
 		address += 1
 		self.memory.writeWord(address, self.privLvl)
 
-		self._parseNewVmTbl()
+		#the parsed table follows writes into its memory, until then it hasn't been read at all
+		if self.vmTableRange is None:
+			self.vmTableValid = False
 
 
 	def setVmContext(self, vmid):
 		#TODO: check index bounds of vmid
-		self._parseNewVmTbl()
+		vm = self.vms[vmid]
+		self._trace(TRACE_VM_ENTER, vmid)
 
 		self.InVM = True
 		self.VmID = vmid
-		self.CS = self.vms[vmid].CS
-		self.DS = self.vms[vmid].DS
-		self.ES = self.vms[vmid].ES
-		self.RS = self.vms[vmid].RS
-		self.SS = self.vms[vmid].SS
-		self.IP = self.vms[vmid].IP
-		self.Flags = self.vms[vmid].Flags
-		self.privLvl = self.vms[vmid].privLvl
+		self.CS = vm.CS
+		self.DS = vm.DS
+		self.ES = vm.ES
+		self.RS = vm.RS
+		self.SS = vm.SS
+		self.IP = vm.IP
+		self.Flags = vm.Flags
+		self.privLvl = vm.privLvl
+
+		self._reloadSegmentCache(SEGMENT_CACHE_VM)
+		self._reloadRegisterFile()
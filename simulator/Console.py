@@ -0,0 +1,70 @@
+import sys
+import time
+import StringIO
+
+#characters buffered before the console writes them out
+DEFAULT_BUFFER_SIZE = 4096
+
+#seconds after which buffered characters are written out by flushIfDue
+DEFAULT_FLUSH_INTERVAL = 0.1
+
+class Console(object):
+	""" Output device of the PRINT instruction.
+
+		Characters are buffered and written to the stream when a newline is printed,
+		the buffer is full or flush() is called (the CPU does so when a run ends).
+		CPU.run calls flushIfDue() every TIME_CHECK_INTERVAL instructions, which writes
+		them if flushInterval seconds passed since the last flush, so the clock isn't
+		read for every character. The stream is any file-like object, sys.stdout at
+		the time of the flush if it is None.
+	"""
+
+	def __init__(self, stream=None, bufferSize=DEFAULT_BUFFER_SIZE, flushInterval=DEFAULT_FLUSH_INTERVAL):
+		self.stream = stream
+		self.bufferSize = bufferSize
+		self.flushInterval = flushInterval
+		self.buffer = []
+		self.lastFlush = time.time()
+
+	@classmethod
+	def createFromFile(cls, path, bufferSize=DEFAULT_BUFFER_SIZE, flushInterval=DEFAULT_FLUSH_INTERVAL):
+		""" Creates a console writing to a file or named pipe """
+		return cls(open(path, 'wb'), bufferSize, flushInterval)
+
+	def write(self, char):
+		self.buffer.append(char)
+
+		if char == '\n' or len(self.buffer) >= self.bufferSize:
+			self.flush()
+
+	def flushIfDue(self):
+		if len(self.buffer) > 0 and time.time() - self.lastFlush >= self.flushInterval:
+			self.flush()
+
+	def flush(self):
+		if len(self.buffer) > 0:
+			stream = self.stream or sys.stdout
+			stream.write("".join(self.buffer))
+			stream.flush()
+			self.buffer = []
+
+		self.lastFlush = time.time()
+
+	def close(self):
+		self.flush()
+		if self.stream is not None:
+			self.stream.close()
+
+class MemoryConsole(Console):
+	""" Console capturing the output in memory, e.g. for tests """
+
+	def __init__(self, bufferSize=DEFAULT_BUFFER_SIZE, flushInterval=DEFAULT_FLUSH_INTERVAL):
+		Console.__init__(self, StringIO.StringIO(), bufferSize, flushInterval)
+
+	def getOutput(self):
+		self.flush()
+		return self.stream.getvalue()
+
+	def clear(self):
+		self.buffer = []
+		self.stream = StringIO.StringIO()
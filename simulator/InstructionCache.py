@@ -0,0 +1,123 @@
+import logging
+
+from common import Opcodes
+
+from .Instructions import doesInstructionExist, getArgumentCount, areParametersValid
+
+#operand types which are followed by an additional word in the instruction stream
+_OPERAND_TYPES_WITH_WORD = (
+	Opcodes.PARAM_IMMEDIATE,
+	Opcodes.PARAM_MEMORY_SINGLE_DS,
+	Opcodes.PARAM_MEMORY_SINGLE_ES,
+	Opcodes.PARAM_MEMORY_DOUBLE_DS,
+	Opcodes.PARAM_MEMORY_DOUBLE_ES,
+)
+
+class InstructionCache(object):
+	""" Cache of decoded instructions, keyed by the physical address of the instruction word.
+
+		A decoded instruction is a tuple
+			(opcode, privlvl, argumentCount,
+			 operandType1, registerOperand1, operandWord1,
+			 operandType2, registerOperand2, operandWord2,
+			 length)
+		where operandWordN is the immediate or memory address word following the
+		instruction word (or None if the operand type doesn't have one) and length
+		is the number of words the instruction occupies.
+
+		Every word covered by a cached instruction is watched in memory, a write to
+		it drops all decoded instructions overlapping that word.
+	"""
+
+	def __init__(self, memory):
+		self.memory = memory
+		self.logger = logging.getLogger('InstructionCache')
+		self.entries = {}
+		self.covering = {}
+
+	def fetch(self, address):
+		""" Returns the decoded instruction at address or None if the instruction is invalid """
+		if address in self.entries:
+			return self.entries[address]
+
+		decoded = self._decode(address)
+		if decoded is not None:
+			self.entries[address] = decoded
+			for word in range(address, address + decoded[9]):
+				if not word in self.covering:
+					self.covering[word] = set()
+					self.memory.addWriteWatch(word, self.invalidate)
+				self.covering[word].add(address)
+
+		return decoded
+
+	def invalidate(self, address):
+		for start in list(self.covering.get(address, ())):
+			decoded = self.entries.pop(start)
+
+			#the dropped instruction no longer covers any of its words
+			for word in range(start, start + decoded[9]):
+				covering = self.covering[word]
+				covering.discard(start)
+				if len(covering) == 0:
+					del self.covering[word]
+					self.memory.removeWriteWatch(word, self.invalidate)
+
+	def flush(self):
+		for word in self.covering:
+			self.memory.removeWriteWatch(word, self.invalidate)
+		self.entries = {}
+		self.covering = {}
+
+	def _decode(self, address):
+		instructionWord = self.memory.readWord(address)
+
+		opcode = instructionWord & 0xFF
+		privlvl = (instructionWord >> 8) & 0xFF
+		operandType1 = (instructionWord >> 16) & 0xFF
+		operandType2 = (instructionWord >> 24) & 0xFF
+
+		registerOperand1 = operandType1 & 0x1F
+		operandType1 = operandType1 >> 5
+
+		registerOperand2 = operandType2 & 0x1F
+		operandType2 = operandType2 >> 5
+
+		#check wether instruction itself exists
+		if not doesInstructionExist(opcode):
+			self.logger.debug("Unknown instruction at physical 0x%x", address)
+			return None
+
+		#check wether the operand types encoded in the instruction word are valid for the given opcode
+		if not areParametersValid(opcode, operandType1, operandType2):
+			self.logger.debug("Invalid parameter type for instruction 0x%x at physical 0x%x", opcode, address)
+			return None
+
+		argumentCount = getArgumentCount(opcode)
+
+		length = 1
+		operandWord1 = None
+		operandWord2 = None
+
+		if argumentCount > 0:
+			if operandType1 == Opcodes.PARAM_REGISTER and registerOperand1 > 30:
+				self.logger.debug("Invalid register access for instruction 0x%x at physical 0x%x", opcode, address)
+				return None
+
+			if operandType1 in _OPERAND_TYPES_WITH_WORD:
+				operandWord1 = self.memory.readWord(address + length)
+				length += 1
+
+		if argumentCount > 1:
+			if operandType2 == Opcodes.PARAM_REGISTER and registerOperand2 > 30:
+				self.logger.debug("Invalid register access for instruction 0x%x at physical 0x%x", opcode, address)
+				return None
+
+			if operandType2 in _OPERAND_TYPES_WITH_WORD:
+				operandWord2 = self.memory.readWord(address + length)
+				length += 1
+
+		return (opcode, privlvl, argumentCount,
+			operandType1, registerOperand1, operandWord1,
+			operandType2, registerOperand2, operandWord2,
+			length)
@@ -275,3 +275,19 @@ def areParametersValid(opcode, operandType1, operandType2):
 		return False
 
 	return True
+
+def addInstruction(opcode, name, nargs, paramtypes):
+	if opcode in _INSTR:
+		raise ValueError("Opcode 0x%x is already used by %s" % (opcode, _INSTR[opcode]['name']))
+
+	_INSTR[opcode] = {
+		'nargs': nargs,
+		'name': name,
+		'paramtypes': paramtypes
+	}
+
+def removeInstruction(opcode):
+	if not opcode in _INSTR:
+		raise ValueError("Opcode 0x%x is not used" % opcode)
+
+	del _INSTR[opcode]
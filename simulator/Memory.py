@@ -1,54 +1,245 @@
 import struct
 import logging
+import mmap
+import sys
+from array import array
 
 #total memory size
 MEMORY_SIZE = 1*1024*1024*1024
 
+#memory is allocated in pages of PAGE_SIZE words
+PAGE_BITS = 10
+PAGE_SIZE = 1 << PAGE_BITS
+PAGE_MASK = PAGE_SIZE - 1
+
+#value of words which have never been written
+UNMAPPED_WORD = 0xFFFFFFFF
+
+#pages are arrays of signed 32 bit words, python 2 returns longs for elements of
+#unsigned arrays. Words are converted when stored and masked when loaded.
+PAGE_TYPECODE = 'i'
+assert array(PAGE_TYPECODE).itemsize == 4, "array type '%s' needs to hold 32 bit words" % PAGE_TYPECODE
+
 class MemoryException(Exception): pass
 class MemoryAddressOutOfBoundsException(MemoryException): pass
 class MemoryDataOutOfBoundsException(MemoryException): pass
 
+class MemorySnapshot(object):
+	""" Contents of a Memory: its initial image and the pages written to it, which must not be modified """
+
+	def __init__(self, image, pages):
+		self.image = image
+		self.pages = pages
+
+	def __getstate__(self):
+		#the image may be an mmap
+		image = self.image[:] if self.image is not None else None
+		return {'image': image, 'pages': dict((n, page.tostring()) for (n, page) in self.pages.iteritems())}
+
+	def __setstate__(self, contents):
+		self.image = contents['image']
+		self.pages = {}
+		for (pageNumber, data) in contents['pages'].iteritems():
+			page = array(PAGE_TYPECODE)
+			page.fromstring(data)
+			self.pages[pageNumber] = page
+
 class Memory(object):
-	def __init__(self):
-		self.memory = {}
+	""" Word addressed memory, allocated lazily in pages of 32 bit arrays.
+
+		The initial memory image is kept as a little endian byte buffer (a string or a
+		read-only mmap of the image file) and is never copied as a whole, words are read
+		from it directly until their page is written for the first time. Only then the
+		page gets copied into an array (copy-on-write).
+
+		Pages are shared with snapshots the same way: after snapshot() all pages are
+		read-only and copied before their next write, restore() only has to replace the
+		pages written since.
+	"""
+
+	def __init__(self, words=None):
+		self.pages = {}
+		self.writablePages = {}
+		self.baseSnapshot = None
+		self.image = None
+		self.imageWords = 0
+		self.writeWatches = {}
+		self.watchedPages = {}
 		self.logger = logging.getLogger('Memory')
 		self.logger.debug("Creating Memory with size %d KiB", MEMORY_SIZE/1024)
 
+		if words is not None:
+			self.writeBlob(0, words)
+
 	@classmethod
 	def createFromBinaryString(cls, memstr):
-		if len(memstr) % 4 != 0:
-			logger.error("The length of the memory image has to be a multiple of 4 Bytes")
+		instance = Memory()
+		instance._setImage(memstr)
+		return instance
 
+	@classmethod
+	def createFromFile(cls, imageFile):
+		""" Maps the memory image from an open file instead of reading it """
 		instance = Memory()
-		for i in range(len(memstr) / 4):
-			instance.memory[i] = struct.unpack("<I", memstr[i*4:(i*4)+4])[0]
+
+		imageFile.seek(0, 2)
+		if imageFile.tell() > 0:
+			instance._setImage(mmap.mmap(imageFile.fileno(), 0, access=mmap.ACCESS_READ))
 
 		return instance
 
+	def _setImage(self, image):
+		if image is None:
+			self.image = None
+			self.imageWords = 0
+			return
+
+		if len(image) % 4 != 0:
+			self.logger.error("The length of the memory image has to be a multiple of 4 Bytes")
+
+		self.image = image
+		self.imageWords = len(image) / 4
+
+	@classmethod
+	def createFromSnapshot(cls, snapshot):
+		instance = Memory()
+		instance.restore(snapshot)
+		return instance
+
+	def _getWritablePage(self, pageNumber):
+		""" Returns the page for a write, allocating it or copying it if it is shared with a snapshot """
+		page = self.pages.get(pageNumber)
+		if page is None:
+			page = self._allocatePage(pageNumber)
+		else:
+			page = page[:]
+
+		self.pages[pageNumber] = page
+		self.writablePages[pageNumber] = page
+		return page
+
+	def _allocatePage(self, pageNumber):
+		page = array(PAGE_TYPECODE, [-1]) * PAGE_SIZE
+
+		#copy the part of the initial image covered by this page
+		start = pageNumber << PAGE_BITS
+		if start < self.imageWords:
+			end = min(start + PAGE_SIZE, self.imageWords)
+			imageWords = array(PAGE_TYPECODE)
+			imageWords.fromstring(self.image[start*4:end*4])
+			if sys.byteorder == 'big':
+				imageWords.byteswap()
+			page[0:end-start] = imageWords
+
+		return page
+
 	def writeBlob(self, address, blob):
 		for word in blob:
-			self.memory[address] = word
+			page = self.writablePages.get(address >> PAGE_BITS)
+			if page is None:
+				page = self._getWritablePage(address >> PAGE_BITS)
+			page[address & PAGE_MASK] = word if word < 0x80000000 else word - 0x100000000
+
+			if address in self.writeWatches:
+				self._notifyWriteWatches(address)
 			address += 1
 
-	def writeWord(self, address, word):
+	def writeWord(self, address, word, source=None):
+		""" Writes word to address, the write watch callback source (the writer keeping
+			its copy of the word up to date itself) isn't notified
+		"""
 		#self.logger.debug("Writing value 0x%x to address 0x%x", word, address)
 		if address >= MEMORY_SIZE or address < 0:
 			raise MemoryAddressOutOfBoundsException("Address {0} for write operation out of bounds".format(address))
-		
+
 		if(word > 0xFFFFFFFF or word < 0):
 			raise MemoryDataOutOfBoundsException("Data {0} for write operation at address {1} out of bounds".format(word, address))
 
-		self.memory[address] = word
+		page = self.writablePages.get(address >> PAGE_BITS)
+		if page is None:
+			page = self._getWritablePage(address >> PAGE_BITS)
+		page[address & PAGE_MASK] = word if word < 0x80000000 else word - 0x100000000
+
+		if address in self.writeWatches:
+			self._notifyWriteWatches(address, source)
+
+	def snapshot(self):
+		""" Returns a MemorySnapshot sharing all pages with this memory """
+		snapshot = MemorySnapshot(self.image, dict(self.pages))
+		self.writablePages = {}
+		self.baseSnapshot = snapshot
+		return snapshot
+
+	def restore(self, snapshot):
+		""" Restores the contents of snapshot. Write watches of all words which might have
+			changed are notified, so caches of memory contents stay coherent.
+		"""
+		if snapshot.image is not self.image:
+			#all contents might have changed
+			changedPages = None
+			self._setImage(snapshot.image)
+			self.pages = dict(snapshot.pages)
+		elif snapshot is self.baseSnapshot:
+			#only pages written since the snapshot differ
+			changedPages = self.writablePages
+			for pageNumber in changedPages:
+				if pageNumber in snapshot.pages:
+					self.pages[pageNumber] = snapshot.pages[pageNumber]
+				else:
+					del self.pages[pageNumber]
+		else:
+			pageNumbers = set(self.pages) | set(snapshot.pages)
+			changedPages = set(n for n in pageNumbers if self.pages.get(n) is not snapshot.pages.get(n))
+			self.pages = dict(snapshot.pages)
+
+		self.writablePages = {}
+		self.baseSnapshot = snapshot
+
+		#only the watched words of changed pages are notified
+		if changedPages is None:
+			changedPages = self.watchedPages.keys()
+		for pageNumber in [n for n in changedPages if n in self.watchedPages]:
+			for address in list(self.watchedPages.get(pageNumber, ())):
+				if address in self.writeWatches:
+					self._notifyWriteWatches(address)
+
+	def addWriteWatch(self, address, callback):
+		""" Registers callback(address) to be invoked after every write to address.
+			Used by caches holding data derived from memory contents (e.g. decoded instructions)
+		"""
+		self.writeWatches.setdefault(address, []).append(callback)
+		self.watchedPages.setdefault(address >> PAGE_BITS, set()).add(address)
+
+	def removeWriteWatch(self, address, callback):
+		callbacks = self.writeWatches.get(address, [])
+		if callback in callbacks:
+			callbacks.remove(callback)
+		if len(callbacks) == 0 and address in self.writeWatches:
+			del self.writeWatches[address]
+
+			watched = self.watchedPages[address >> PAGE_BITS]
+			watched.discard(address)
+			if len(watched) == 0:
+				del self.watchedPages[address >> PAGE_BITS]
+
+	def _notifyWriteWatches(self, address, source=None):
+		#copy the list, callbacks may unregister themselves
+		for callback in list(self.writeWatches[address]):
+			if callback != source:
+				callback(address)
 
 	def readWord(self, address):
 		#self.logger.debug("Reading from address 0x%x", address)
 		if address >= MEMORY_SIZE or address < 0:
 			raise MemoryAddressOutOfBoundsException("Address {0} for read operation out of bounds".format(address))
-		
-		if address in self.memory:
-			return self.memory[address]
+
+		page = self.pages.get(address >> PAGE_BITS)
+		if page is not None:
+			return page[address & PAGE_MASK] & 0xFFFFFFFF
+		elif address < self.imageWords:
+			return struct.unpack_from("<I", self.image, address * 4)[0]
 		else:
-			return 0xFFFFFFFF
+			return UNMAPPED_WORD
 
 	def readRange(self, address, length):
 		values = []
@@ -0,0 +1,141 @@
+import time
+from array import array
+
+from common import Opcodes
+
+from .Trace import Tracer, TRACE_INTERRUPT, TRACE_TIMER_INTERRUPT, TRACE_VM_EXIT
+from .Instructions import doesInstructionExist, getInstructionName
+from .Memory import MemoryException, PAGE_BITS, PAGE_SIZE, PAGE_MASK
+
+#names of the hypervisor trap reasons by number
+HVTRAP_NAMES = dict((value, name) for (name, value) in vars(Opcodes).iteritems() if name.startswith("HVTRAP_") and isinstance(value, int))
+
+#only every this many steps is timed, timing every step would mostly measure the clock
+TIME_SAMPLE_INTERVAL = 64
+
+class Profiler(Tracer):
+	""" Tracer counting executed instructions per physical address and per opcode, steps
+		spent in the hypervisor and in each VM and interrupts and VM exits by reason. The
+		counters are arrays indexed by opcode, VM id or reason, address counters are
+		allocated per memory page on first execution. The time per opcode is sampled
+		every timeSampleInterval steps.
+	"""
+
+	def __init__(self, timeSampleInterval=TIME_SAMPLE_INTERVAL):
+		self.addressCounts = {}
+		self.opcodeCounts = array('L', [0]) * 256
+		self.opcodeTimes = array('d', [0.0]) * 256
+		self.opcodeSamples = array('L', [0]) * 256
+		self.timeSampleInterval = timeSampleInterval
+		self.hypervisorSteps = 0
+		self.vmSteps = array('L')
+		self.interruptCounts = array('L', [0]) * 33
+		self.timerInterrupts = 0
+		self.hvTrapCounts = array('L', [0]) * (max(HVTRAP_NAMES) + 1)
+
+	def instrumentStep(self, cpu, step):
+		state = cpu.state
+		readWord = cpu.memory.readWord
+		addressCounts = self.addressCounts
+		opcodeCounts = self.opcodeCounts
+		opcodeTimes = self.opcodeTimes
+		opcodeSamples = self.opcodeSamples
+		interval = self.timeSampleInterval
+		vmSteps = self.vmSteps
+		clock = time.time
+		#steps until the next timed one, in a list to be writable from the closure
+		untilSample = [interval]
+
+		def profiledStep():
+			ip = state.IP
+			page = addressCounts.get(ip >> PAGE_BITS)
+			if page is None:
+				page = addressCounts[ip >> PAGE_BITS] = array('L', [0]) * PAGE_SIZE
+			page[ip & PAGE_MASK] += 1
+
+			if state.InVM:
+				if state.VmID >= len(vmSteps):
+					vmSteps.extend(array('L', [0]) * (state.VmID + 1 - len(vmSteps)))
+				vmSteps[state.VmID] += 1
+			else:
+				self.hypervisorSteps += 1
+
+			try:
+				opcode = readWord(ip) & 0xFF
+			except MemoryException:
+				opcode = 0
+
+			opcodeCounts[opcode] += 1
+
+			untilSample[0] -= 1
+			if untilSample[0] > 0:
+				return step()
+
+			untilSample[0] = interval
+			start = clock()
+			result = step()
+			opcodeTimes[opcode] += clock() - start
+			opcodeSamples[opcode] += 1
+			return result
+
+		return profiledStep
+
+	def event(self, kind, ticks, ip, data=()):
+		if kind == TRACE_INTERRUPT:
+			self.interruptCounts[data[0]] += 1
+		elif kind == TRACE_TIMER_INTERRUPT:
+			self.timerInterrupts += 1
+		elif kind == TRACE_VM_EXIT:
+			self.hvTrapCounts[data[0]] += 1
+
+	def getSteps(self):
+		return self.hypervisorSteps + sum(self.vmSteps)
+
+	def getHotAddresses(self, count):
+		""" Returns the count most executed addresses as (address, executions) """
+		executed = []
+		for (pageNumber, page) in self.addressCounts.iteritems():
+			start = pageNumber << PAGE_BITS
+			executed.extend((executions, start + offset) for (offset, executions) in enumerate(page) if executions > 0)
+		executed.sort(reverse=True)
+		return [(address, executions) for (executions, address) in executed[:count]]
+
+	def report(self, symbols=None, count=20):
+		""" Returns a text report, addresses are symbolized with a SymbolMap if given """
+		steps = self.getSteps()
+		lines = []
+
+		lines.append("Steps: %d (hypervisor: %d)" % (steps, self.hypervisorSteps))
+		for (vmid, vmSteps) in enumerate(self.vmSteps):
+			if vmSteps > 0:
+				lines.append("  VM %d: %d" % (vmid, vmSteps))
+
+		lines.append("")
+		lines.append("Hot addresses:")
+		for (address, executions) in self.getHotAddresses(count):
+			name = symbols.symbolize(address) if symbols is not None else ""
+			lines.append("  0x%08x %10d %6.2f%%  %s" % (address, executions, 100.0 * executions / steps, name))
+
+		lines.append("")
+		lines.append("Opcodes:")
+		for opcode in sorted(range(256), key=lambda opcode: -self.opcodeCounts[opcode]):
+			executions = self.opcodeCounts[opcode]
+			if executions == 0:
+				break
+			name = getInstructionName(opcode) if doesInstructionExist(opcode) else "0x%02x" % opcode
+			samples = self.opcodeSamples[opcode]
+			if samples > 0:
+				lines.append("  %-12s %10d %8.2f us/step" % (name, executions, 1000000.0 * self.opcodeTimes[opcode] / samples))
+			else:
+				lines.append("  %-12s %10d" % (name, executions))
+
+		lines.append("")
+		lines.append("Timer interrupts: %d" % self.timerInterrupts)
+		for (number, interrupts) in enumerate(self.interruptCounts):
+			if interrupts > 0:
+				lines.append("Interrupt %d: %d" % (number, interrupts))
+		for (number, exits) in enumerate(self.hvTrapCounts):
+			if exits > 0:
+				lines.append("VM exits %s: %d" % (HVTRAP_NAMES[number], exits))
+
+		return "\n".join(lines)
@@ -0,0 +1,42 @@
+from collections import namedtuple
+
+#reasons for CPU.run() and BlockEngine.run() to return
+STOP_HALTED = 'halted'
+STOP_STEP_LIMIT = 'step limit'
+STOP_BREAKPOINT = 'breakpoint'
+STOP_ADDRESS_RANGE = 'address range'
+STOP_TIME_LIMIT = 'time limit'
+STOP_INTERRUPTED = 'interrupted'
+
+#reason, number of executed instructions and the IP at which the run stopped
+RunResult = namedtuple("RunResult", ["reason", "steps", "address"])
+
+#instructions executed between two checks of the wall clock
+TIME_CHECK_INTERVAL = 4096
+
+class StopCondition(object):
+	""" Conditions ending a run besides halting and the step limit.
+
+		breakpoints is a collection of addresses, the run stops before executing an
+		instruction at one of them. addressRange is a (start, end) tuple, the run stops
+		before executing an instruction with start <= IP < end. timeLimit is a wall
+		clock budget in seconds, checked every TIME_CHECK_INTERVAL instructions.
+	"""
+
+	def __init__(self, breakpoints=(), addressRange=None, timeLimit=None):
+		self.breakpoints = frozenset(breakpoints)
+		self.addressRange = addressRange
+		self.timeLimit = timeLimit
+
+	def hasAddressConditions(self):
+		return len(self.breakpoints) > 0 or self.addressRange is not None
+
+	def getAddressStopReason(self, address):
+		""" Returns the reason to stop before executing the instruction at address or None """
+		if address in self.breakpoints:
+			return STOP_BREAKPOINT
+
+		if self.addressRange is not None and self.addressRange[0] <= address < self.addressRange[1]:
+			return STOP_ADDRESS_RANGE
+
+		return None
@@ -0,0 +1,15 @@
+import cPickle
+
+class Snapshot(object):
+	""" State and memory of a CPU as returned by CPU.snapshot() """
+
+	def __init__(self, state, memory):
+		self.state = state		#dictionary, see CPUState.snapshot()
+		self.memory = memory	#MemorySnapshot
+
+	def save(self, snapshotFile):
+		cPickle.dump(self, snapshotFile, cPickle.HIGHEST_PROTOCOL)
+
+	@classmethod
+	def load(cls, snapshotFile):
+		return cPickle.load(snapshotFile)
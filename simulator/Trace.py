@@ -0,0 +1,75 @@
+import logging
+from collections import namedtuple, deque
+
+#kinds of trace events and the contents of their data tuple
+TRACE_STEP = 'step'						#()
+TRACE_INTERRUPT = 'interrupt'			#(interrupt number, return IP)
+TRACE_TIMER_INTERRUPT = 'timer'			#()
+TRACE_VM_EXIT = 'vmexit'				#(hypervisor trap number, VM id)
+TRACE_VM_ENTER = 'vmenter'				#(VM id,)
+TRACE_SEGTBL_LOAD = 'segtbl'			#(segment table address, number of segments)
+TRACE_VMTBL_LOAD = 'vmtbl'				#(VM table address, number of VMs)
+
+#ticks and IP at the time of the event
+TraceEvent = namedtuple("TraceEvent", ["kind", "ticks", "ip", "data"])
+
+class Tracer(object):
+	""" Receives the trace events of a CPU and its state.
+
+		A CPU with a tracer executes the step returned by instrumentStep, by default it
+		emits a TRACE_STEP event before every instruction. Without a tracer the step
+		isn't instrumented at all. Subclasses override event and/or instrumentStep, the
+		default event ignores all events.
+	"""
+
+	def event(self, kind, ticks, ip, data=()):
+		pass
+
+	def instrumentStep(self, cpu, step):
+		""" Returns the step function for cpu, step is the uninstrumented one """
+		state = cpu.state
+		event = self.event
+
+		def tracedStep():
+			event(TRACE_STEP, state.ticks, state.IP)
+			return step()
+
+		return tracedStep
+
+class LoggingTracer(Tracer):
+	""" Writes the trace events as debug messages, used by the frontends with -d """
+
+	def __init__(self, logger=None):
+		self.logger = logger or logging.getLogger('CPU')
+
+	def event(self, kind, ticks, ip, data=()):
+		if kind == TRACE_STEP:
+			self.logger.debug("Fetching instruction from %x", ip)
+		else:
+			self.logger.debug("%s at 0x%x (tick %d): %s", kind, ip, ticks, ", ".join("0x%x" % value for value in data))
+
+class RecordingTracer(Tracer):
+	""" Keeps the last maxEvents trace events (all of them if maxEvents is None) """
+
+	def __init__(self, maxEvents=None, kinds=None):
+		self.events = deque(maxlen=maxEvents)
+		self.kinds = kinds
+
+	def event(self, kind, ticks, ip, data=()):
+		if self.kinds is None or kind in self.kinds:
+			self.events.append(TraceEvent(kind, ticks, ip, data))
+
+class TracerChain(Tracer):
+	""" Passes the trace events to several tracers, each of them instruments the step """
+
+	def __init__(self, tracers):
+		self.tracers = list(tracers)
+
+	def event(self, kind, ticks, ip, data=()):
+		for tracer in self.tracers:
+			tracer.event(kind, ticks, ip, data)
+
+	def instrumentStep(self, cpu, step):
+		for tracer in self.tracers:
+			step = tracer.instrumentStep(cpu, step)
+		return step
@@ -0,0 +1,93 @@
+import unittest, sys, os, shutil, tempfile
+sys.path.insert(0, '.')
+
+from assembler import Batch, TableCache
+from assembler.AssembleCache import AssembleCache, getDefaultDirectory
+from assembler.ObjectFile import ObjectFile
+
+class AssembleBatchTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+		self.paths = []
+		for (name, source) in [('a', ".SEGMENT code\nstart:\n\tHALT\n"), ('b', "HALT\n"), ('c', ".SEGMENT data\n\t.WORD 1\n")]:
+			inputPath = os.path.join(self.directory, name + '.vm32')
+			with open(inputPath, 'w') as inputFile:
+				inputFile.write(source)
+			self.paths.append((inputPath, Batch.getObjectPath(inputPath, self.directory)))
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def checkResults(self, results):
+		self.assertEqual([result.inputPath for result in results], [inputPath for (inputPath, outputPath) in self.paths])
+		self.assertEqual(results[0].error, None)
+		self.assertEqual(results[2].error, None)
+
+		#the file without a segment fails and no object file is written for it
+		self.assertTrue("segment" in results[1].error)
+		self.assertFalse(os.path.exists(results[1].outputPath))
+
+		with open(results[2].outputPath, 'rb') as objectFile:
+			self.assertEqual(list(ObjectFile.createFromFile(objectFile).seg_data['data']), [1])
+
+	def test_singleProcess(self):
+		self.checkResults(Batch.assembleFiles(self.paths, processes=1))
+
+	def test_pool(self):
+		self.checkResults(Batch.assembleFiles(self.paths, processes=2))
+
+	def test_objectPath(self):
+		self.assertEqual(Batch.getObjectPath('src/main.vm32'), 'src/main.obj')
+		self.assertEqual(Batch.getObjectPath('src/main.vm32', 'build'), 'build/main.obj')
+
+class AssembleCacheTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.cache = AssembleCache(os.path.join(self.directory, 'cache'))
+		self.inputPath = os.path.join(self.directory, 'a.vm32')
+		self.outputPath = os.path.join(self.directory, 'a.obj')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def assemble(self, source):
+		with open(self.inputPath, 'w') as inputFile:
+			inputFile.write(source)
+		result = Batch.assembleFile(self.inputPath, self.outputPath, self.cache)
+		self.assertEqual(result.error, None)
+
+		with open(self.outputPath, 'rb') as objectFile:
+			return (result.cached, objectFile.read())
+
+	def test_hit(self):
+		(cached, assembled) = self.assemble(".SEGMENT code\n\tHALT\n")
+		self.assertFalse(cached)
+		self.assertEqual(self.assemble(".SEGMENT code\n\tHALT\n"), (True, assembled))
+		self.assertFalse(self.assemble(".SEGMENT code\n\tNOP\n")[0])
+
+	def test_evict(self):
+		self.assemble(".SEGMENT code\n\tHALT\n")
+		self.cache.maxSize = os.path.getsize(self.outputPath)
+
+		#only the most recently stored entry fits
+		self.assemble(".SEGMENT code\n\tNOP\n")
+		self.assertEqual(len(os.listdir(self.cache.directory)), 1)
+		self.assertTrue(self.assemble(".SEGMENT code\n\tNOP\n")[0])
+
+	def test_storeCopiesObjectFile(self):
+		(cached, assembled) = self.assemble(".SEGMENT code\n\tHALT\n")
+		(name,) = os.listdir(self.cache.directory)
+		with open(os.path.join(self.cache.directory, name), 'rb') as cacheFile:
+			self.assertEqual(cacheFile.read(), assembled)
+
+	def test_defaultDirectory(self):
+		previous = os.environ.get(TableCache.CACHE_DIRECTORY_VARIABLE)
+		os.environ[TableCache.CACHE_DIRECTORY_VARIABLE] = self.directory
+		try:
+			self.assertEqual(getDefaultDirectory(), os.path.join(self.directory, 'objects'))
+		finally:
+			if previous is None:
+				del os.environ[TableCache.CACHE_DIRECTORY_VARIABLE]
+			else:
+				os.environ[TableCache.CACHE_DIRECTORY_VARIABLE] = previous
@@ -0,0 +1,36 @@
+import unittest, sys, tempfile
+sys.path.insert(0, '.')
+
+from simulator import Batch, RunControl
+from common import Opcodes
+
+from CPUTests import instruction, image
+
+class BatchTest(unittest.TestCase):
+	def setUp(self):
+		#prints r1 and the word at 0x10
+		self.imageFile = tempfile.NamedTemporaryFile()
+		self.imageFile.write(image([
+			instruction(Opcodes.OP_PRINT, Opcodes.PARAM_REGISTER << 5 | 1),
+			instruction(Opcodes.OP_PRINT, Opcodes.PARAM_MEMORY_SINGLE_DS << 5 | 31), 0x10,
+			instruction(Opcodes.OP_HALT),
+		]))
+		self.imageFile.flush()
+
+		self.jobs = [
+			Batch.BatchJob('a', [(0x10, [ord('b')])], {1: ord('a')}, None),
+			Batch.BatchJob('c', [(0x10, [ord('d')])], {1: ord('c')}, None),
+			Batch.BatchJob('limited', [], {1: ord('e')}, 1),
+		]
+
+	def checkResults(self, results):
+		self.assertEqual([result.name for result in results], ['a', 'c', 'limited'])
+		self.assertEqual([result.output for result in results], ['ab', 'cd', 'e'])
+		self.assertEqual([result.reason for result in results], [RunControl.STOP_HALTED, RunControl.STOP_HALTED, RunControl.STOP_STEP_LIMIT])
+		self.assertEqual(results[0].registers[1], ord('a'))
+
+	def test_singleProcess(self):
+		self.checkResults(Batch.runBatch(self.imageFile.name, self.jobs, processes=1))
+
+	def test_pool(self):
+		self.checkResults(Batch.runBatch(self.imageFile.name, self.jobs, processes=2, engine='block'))
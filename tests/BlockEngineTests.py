@@ -0,0 +1,112 @@
+import unittest, sys
+sys.path.insert(0, '.')
+
+from simulator.CPU import CPU
+from simulator.BlockEngine import BlockEngine
+from simulator import RunControl
+from common import Opcodes
+
+from CPUTests import instruction, image
+
+REGISTER = Opcodes.PARAM_REGISTER << 5
+IMMEDIATE = Opcodes.PARAM_IMMEDIATE << 5
+MEMORY = Opcodes.PARAM_MEMORY_SINGLE_DS << 5 | 31
+
+class BlockEngineTest(unittest.TestCase):
+	def run_image(self, words):
+		cpu = CPU(image(words))
+		engine = BlockEngine(cpu)
+		while engine.doSimulationStep():
+			pass
+		return (cpu, engine)
+
+	def test_loop(self):
+		(cpu, engine) = self.run_image([
+			instruction(Opcodes.OP_MOV, REGISTER | 1, IMMEDIATE), 0,
+			instruction(Opcodes.OP_ADD, REGISTER | 1, IMMEDIATE), 1,
+			instruction(Opcodes.OP_CMP, REGISTER | 1, IMMEDIATE), 100,
+			instruction(Opcodes.OP_JNZ, IMMEDIATE), 2,
+			instruction(Opcodes.OP_HALT),
+		])
+		self.assertEqual(cpu.state.getRegister(1), 100)
+		self.assertEqual(cpu.state.IP, 8)
+		self.assertEqual(engine.instructionCount, 302)
+
+	def test_selfModifyingCode(self):
+		(cpu, engine) = self.run_image([
+			instruction(Opcodes.OP_MOV, MEMORY, IMMEDIATE), 4, 7,
+			instruction(Opcodes.OP_MOV, REGISTER | 1, IMMEDIATE), 1,
+			instruction(Opcodes.OP_HALT),
+		])
+		self.assertEqual(cpu.state.getRegister(1), 7)
+
+	def test_registersWrittenOnExit(self):
+		cpu = CPU(image([
+			instruction(Opcodes.OP_MOV, REGISTER | 1, IMMEDIATE), 1,
+			instruction(Opcodes.OP_ADD, REGISTER | 1, IMMEDIATE), 2,
+			instruction(Opcodes.OP_ADD, REGISTER | 1, IMMEDIATE), 3,
+			instruction(Opcodes.OP_JMP, IMMEDIATE), 8,
+			instruction(Opcodes.OP_HALT),
+		]))
+		engine = BlockEngine(cpu)
+		writes = []
+		setRegister = cpu.state.setRegister
+		cpu.state.setRegister = lambda reg, value: writes.append((reg, value)) or setRegister(reg, value)
+
+		#the block keeps r1 in a local variable and writes it back once
+		engine.doSimulationStep()
+		self.assertEqual(engine.instructionCount, 4)
+		self.assertEqual(writes, [(1, 6)])
+		self.assertEqual(cpu.memory.readWord(0x2001), 6)
+
+	def test_registersWrittenBeforeAliasingAccess(self):
+		#reading the register segment as memory sees the register written in the block
+		(cpu, engine) = self.run_image([
+			instruction(Opcodes.OP_MOV, REGISTER | 1, IMMEDIATE), 5,
+			instruction(Opcodes.OP_MOV, REGISTER | 2, MEMORY), 0x2001,
+			instruction(Opcodes.OP_HALT),
+		])
+		self.assertEqual(cpu.state.getRegister(2), 5)
+
+	def test_maskedInterruptPending(self):
+		#a pending interrupt which is masked doesn't keep blocks from running
+		words = [
+			instruction(Opcodes.OP_MOV, REGISTER | 1, IMMEDIATE), 0,
+			instruction(Opcodes.OP_ADD, REGISTER | 1, IMMEDIATE), 1,
+			instruction(Opcodes.OP_CMP, REGISTER | 1, IMMEDIATE), 100,
+			instruction(Opcodes.OP_JNZ, IMMEDIATE), 2,
+			instruction(Opcodes.OP_HALT),
+		]
+
+		interpreter = CPU(image(words))
+		interpreter.state.interruptPending = True
+		while interpreter.doSimulationStep():
+			pass
+
+		cpu = CPU(image(words))
+		cpu.state.interruptPending = True
+		engine = BlockEngine(cpu)
+		interpreted = []
+		doSimulationStep = cpu.doSimulationStep
+		cpu.doSimulationStep = lambda: interpreted.append(cpu.state.IP) or doSimulationStep()
+		while engine.doSimulationStep():
+			pass
+
+		self.assertEqual(cpu.state.getRegister(1), interpreter.state.getRegister(1))
+		self.assertEqual(cpu.state.IP, interpreter.state.IP)
+		self.assertEqual(cpu.state.ticks, interpreter.state.ticks)
+		self.assertTrue(cpu.state.interruptPending)
+		self.assertTrue(len(interpreted) < engine.instructionCount)
+
+	def test_runStepLimit(self):
+		cpu = CPU(image([
+			instruction(Opcodes.OP_MOV, REGISTER | 1, IMMEDIATE), 0,
+			instruction(Opcodes.OP_ADD, REGISTER | 1, IMMEDIATE), 1,
+			instruction(Opcodes.OP_JMP, IMMEDIATE), 2,
+		]))
+		engine = BlockEngine(cpu)
+
+		result = engine.run(101)
+		self.assertEqual(result.reason, RunControl.STOP_STEP_LIMIT)
+		self.assertEqual(result.steps, 101)
+		self.assertEqual(cpu.state.getRegister(1), 50)
@@ -0,0 +1,216 @@
+import unittest, sys, struct, tempfile
+sys.path.insert(0, '.')
+
+from simulator.CPU import CPU
+from simulator import RunControl, Trace
+from simulator.Snapshot import Snapshot
+from simulator.Exceptions import CPUSegmentViolationException
+from common import Opcodes
+
+OP_DOUBLE = 0x7F
+
+def _opDouble(cpu, operand1, operand2, ipadd):
+	return (operand1 * 2) & 0xFFFFFFFF
+
+def instruction(opcode, operandType1=0, operandType2=0):
+	return opcode | operandType1 << 16 | operandType2 << 24
+
+def image(words):
+	return "".join(struct.pack("<I", word) for word in words)
+
+class CPUTest(unittest.TestCase):
+	def setUp(self):
+		CPU.registerInstruction(OP_DOUBLE, 'DOUBLE', 1, [[Opcodes.PARAM_REGISTER]], _opDouble)
+
+	def tearDown(self):
+		CPU.unregisterInstruction(OP_DOUBLE)
+
+	def run_image(self, words):
+		cpu = CPU(image(words))
+		while cpu.doSimulationStep():
+			pass
+		return cpu
+
+	def test_mov(self):
+		cpu = self.run_image([
+			instruction(Opcodes.OP_MOV, Opcodes.PARAM_REGISTER << 5 | 1, Opcodes.PARAM_IMMEDIATE << 5), 0x1234,
+			instruction(Opcodes.OP_HALT),
+		])
+		self.assertEqual(cpu.state.getRegister(1), 0x1234)
+		self.assertEqual(cpu.state.IP, 2)
+
+	def test_registeredInstruction(self):
+		cpu = self.run_image([
+			instruction(Opcodes.OP_MOV, Opcodes.PARAM_REGISTER << 5 | 1, Opcodes.PARAM_IMMEDIATE << 5), 21,
+			instruction(OP_DOUBLE, Opcodes.PARAM_REGISTER << 5 | 1),
+			instruction(Opcodes.OP_HALT),
+		])
+		self.assertEqual(cpu.state.getRegister(1), 42)
+
+	def test_unregisteredInstruction(self):
+		CPU.unregisterInstruction(OP_DOUBLE)
+		try:
+			self.assertRaises(ValueError, CPU.unregisterInstruction, OP_DOUBLE)
+			tracer = Trace.RecordingTracer()
+			cpu = CPU(image([instruction(OP_DOUBLE, Opcodes.PARAM_REGISTER << 5 | 1)]), tracer=tracer)
+			cpu.state.setRegister(30, 0x100)
+			cpu.run(1)
+			self.assertEqual(tracer.events[-1].data, (Opcodes.INTR_INVALID_INSTR, 0))
+		finally:
+			CPU.registerInstruction(OP_DOUBLE, 'DOUBLE', 1, [[Opcodes.PARAM_REGISTER]], _opDouble)
+
+	def test_registerFileFollowsMemory(self):
+		cpu = self.run_image([
+			instruction(Opcodes.OP_MOV, Opcodes.PARAM_REGISTER << 5 | 1, Opcodes.PARAM_IMMEDIATE << 5), 7,
+			instruction(Opcodes.OP_MOV, Opcodes.PARAM_MEMORY_SINGLE_DS << 5 | 31, Opcodes.PARAM_IMMEDIATE << 5), 0x2000 + 2, 9,
+			instruction(Opcodes.OP_HALT),
+		])
+		self.assertEqual(cpu.state.getRegister(1), 7)
+		self.assertEqual(cpu.memory.readWord(0x2001), 7)
+		self.assertEqual(cpu.state.getRegister(2), 9)
+
+	def test_setRegisterWritesOnce(self):
+		cpu = CPU(image([instruction(Opcodes.OP_HALT)]))
+		reads = []
+		readWord = cpu.memory.readWord
+		cpu.memory.readWord = lambda address: reads.append(address) or readWord(address)
+
+		#the register file is updated directly, not reloaded through its write watch
+		cpu.state.setRegister(3, 0x42)
+		self.assertEqual(reads, [])
+		self.assertEqual(cpu.state.getRegister(3), 0x42)
+		self.assertEqual(readWord(0x2003), 0x42)
+
+	def test_segmentCache(self):
+		words = [instruction(Opcodes.OP_HALT)] * 0x10
+		words += [
+			0x0, 0xF, Opcodes.SEGMENT_CODE, 0,
+			0x20, 0x2F, Opcodes.SEGMENT_DATA, 0,
+			0x2000, 0x201F, Opcodes.SEGMENT_REGISTER, 0,
+			0xFFFFFFFF, 0xFFFFFFFF, 0xFFFFFFFF, 0xFFFFFFFF,
+		]
+		cpu = CPU(image(words))
+		state = cpu.state
+		self.assertEqual(state.getResultingDataAddress(0x1000), 0x1000)
+
+		state.setSpecialRegister(Opcodes.SPECIALREG_RS, 2)
+		state.setSpecialRegister(Opcodes.SPECIALREG_SEGTBL, 0x10)
+		self.assertRaises(CPUSegmentViolationException, state.getResultingDataAddress, 0x20)
+
+		state.setSpecialRegister(Opcodes.SPECIALREG_DS, 1)
+		self.assertEqual(state.getResultingDataAddress(0x20), 0x20)
+		self.assertEqual(state.getResultingDataAddress(0x2F), 0x2F)
+		self.assertRaises(CPUSegmentViolationException, state.getResultingDataAddress, 0x30)
+		self.assertRaises(CPUSegmentViolationException, state.getResultingExtraAddress, 0x20)
+		self.assertEqual(state.getResultingInstructionAddress(), 0)
+
+		state.setSpecialRegister(Opcodes.SPECIALREG_DS, 7)
+		self.assertRaises(CPUSegmentViolationException, state.getResultingDataAddress, 0x20)
+
+		statistics = state.getSegmentCacheStatistics()
+		self.assertEqual(statistics['causes'], {'reset': 1, 'table': 1, 'selector': 2, 'vm': 0, 'restore': 0})
+		self.assertEqual(statistics['flushes'], 1)
+		self.assertEqual(statistics['reloads'], 4)
+		self.assertEqual(statistics['accesses'], 0)
+		self.assertEqual(statistics['reloadRate'], 0.0)
+
+		#the rates are per executed instruction
+		state.ticks = 8
+		statistics = state.getSegmentCacheStatistics()
+		self.assertEqual(statistics['accesses'], 8)
+		self.assertEqual(statistics['reloadRate'], 0.5)
+		self.assertEqual(statistics['flushRate'], 0.125)
+
+	def test_timerDeadline(self):
+		cpu = CPU(image([instruction(Opcodes.OP_NOP)] * 16))
+		state = cpu.state
+		state.setSpecialRegister(Opcodes.SPECIALREG_COMPARE, 3)
+		state.setSpecialRegister(Opcodes.SPECIALREG_INT, 2)
+
+		for i in range(2):
+			cpu.doSimulationStep()
+		self.assertEqual(state.getSpecialRegister(Opcodes.SPECIALREG_COUNTER), 2)
+		self.assertEqual(state.getTicksUntilTimerEvent(), 1)
+
+		for i in range(2):
+			cpu.doSimulationStep()
+		self.assertTrue(state.isInterruptPending())
+		self.assertFalse(state.isTimerEnabled())
+		self.assertEqual(state.getSpecialRegister(Opcodes.SPECIALREG_COUNTER), 0)
+
+		#counter stands still while the timer is disabled
+		cpu.doSimulationStep()
+		self.assertEqual(state.getSpecialRegister(Opcodes.SPECIALREG_COUNTER), 0)
+
+	def test_run(self):
+		cpu = CPU(image([
+			instruction(Opcodes.OP_NOP),
+			instruction(Opcodes.OP_NOP),
+			instruction(Opcodes.OP_NOP),
+			instruction(Opcodes.OP_HALT),
+		]))
+
+		self.assertEqual(cpu.run(1), (RunControl.STOP_STEP_LIMIT, 1, 1))
+		self.assertEqual(cpu.run(until=RunControl.StopCondition(breakpoints=[2])), (RunControl.STOP_BREAKPOINT, 1, 2))
+		self.assertEqual(cpu.run(until=RunControl.StopCondition(addressRange=(2, 4))), (RunControl.STOP_ADDRESS_RANGE, 0, 2))
+		self.assertEqual(cpu.run(), (RunControl.STOP_HALTED, 2, 3))
+
+	def test_vmTable(self):
+		words = [instruction(Opcodes.OP_HALT)] * 0x10
+		words += [0, 0, 0, 0, 0, 0x100, 0, 0]
+		words += [0xFFFFFFFF] * 8
+		cpu = CPU(image(words))
+		state = cpu.state
+		state.setSpecialRegister(Opcodes.SPECIALREG_VMTBL, 0x10)
+		self.assertEqual(len(state.vms), 1)
+
+		cpu.memory.writeWord(0x10 + 5, 0x200)
+		self.assertEqual(state.vms[0].IP, 0x200)
+
+		cpu.memory.writeBlob(0x18, [1, 1, 1, 1, 1, 0x300, 0, 0])
+		self.assertEqual(len(state.vms), 2)
+		self.assertEqual(state.vms[1].IP, 0x300)
+
+		state.IP = 0x400
+		state.saveVmContext(1)
+		self.assertEqual(state.vms[1].IP, 0x400)
+		self.assertEqual(state.vms[1].CS, 0)
+
+	def test_trace(self):
+		tracer = Trace.RecordingTracer()
+		cpu = CPU(image([
+			instruction(Opcodes.OP_NOP),
+			instruction(0xFE),
+		]), tracer=tracer)
+		cpu.state.setRegister(30, 0x100)
+		cpu.run(2)
+
+		self.assertEqual([event.kind for event in tracer.events], [Trace.TRACE_STEP, Trace.TRACE_STEP, Trace.TRACE_INTERRUPT])
+		self.assertEqual(tracer.events[2].data, (Opcodes.INTR_INVALID_INSTR, 1))
+
+	def test_snapshot(self):
+		cpu = CPU(image([
+			instruction(Opcodes.OP_MOV, Opcodes.PARAM_REGISTER << 5 | 1, Opcodes.PARAM_IMMEDIATE << 5), 0,
+			instruction(Opcodes.OP_ADD, Opcodes.PARAM_REGISTER << 5 | 1, Opcodes.PARAM_IMMEDIATE << 5), 1,
+			instruction(Opcodes.OP_MOV, Opcodes.PARAM_MEMORY_SINGLE_DS << 5 | 31, Opcodes.PARAM_REGISTER << 5 | 1), 0x100,
+			instruction(Opcodes.OP_JMP, Opcodes.PARAM_IMMEDIATE << 5), 2,
+		]))
+		cpu.run(10)
+		snapshot = cpu.snapshot()
+
+		cpu.run(30)
+		self.assertEqual(cpu.state.getRegister(1), 13)
+		self.assertEqual(cpu.memory.readWord(0x100), 13)
+
+		cpu.restore(snapshot)
+		self.assertEqual(cpu.state.getRegister(1), 3)
+		self.assertEqual(cpu.memory.readWord(0x100), 3)
+		self.assertEqual(cpu.state.IP, 2)
+
+		snapshotFile = tempfile.TemporaryFile()
+		snapshot.save(snapshotFile)
+		snapshotFile.seek(0)
+		restored = CPU.createFromSnapshot(Snapshot.load(snapshotFile))
+		restored.run(30)
+		self.assertEqual(restored.state.getRegister(1), 13)
+		self.assertEqual(restored.memory.readWord(0x100), 13)
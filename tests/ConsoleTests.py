@@ -0,0 +1,58 @@
+import unittest, sys, StringIO
+sys.path.insert(0, '.')
+
+from simulator.CPU import CPU
+from simulator.Console import Console, MemoryConsole
+from simulator import RunControl
+from common import Opcodes
+
+from CPUTests import instruction, image
+
+class ConsoleTest(unittest.TestCase):
+	def test_flushOnNewline(self):
+		stream = StringIO.StringIO()
+		console = Console(stream, flushInterval=60)
+		console.write('a')
+		self.assertEqual(stream.getvalue(), '')
+		console.write('\n')
+		self.assertEqual(stream.getvalue(), 'a\n')
+
+	def test_flushOnFullBuffer(self):
+		stream = StringIO.StringIO()
+		console = Console(stream, bufferSize=2, flushInterval=60)
+		console.write('a')
+		console.write('b')
+		console.write('c')
+		self.assertEqual(stream.getvalue(), 'ab')
+
+	def test_flushIfDue(self):
+		stream = StringIO.StringIO()
+		console = Console(stream, flushInterval=0)
+		console.write('a')
+		self.assertEqual(stream.getvalue(), '')
+		console.flushIfDue()
+		self.assertEqual(stream.getvalue(), 'a')
+
+	def test_flushWhileSpinning(self):
+		#output printed before a busy loop is written while the run continues
+		console = MemoryConsole(flushInterval=0)
+		cpu = CPU(image([
+			instruction(Opcodes.OP_PRINT, Opcodes.PARAM_IMMEDIATE << 5), ord('a'),
+			instruction(Opcodes.OP_JMP, Opcodes.PARAM_IMMEDIATE << 5), 2,
+		]), console=console)
+		flushes = []
+		console.flush = lambda: flushes.append((cpu.state.ticks, "".join(console.buffer))) or Console.flush(console)
+
+		cpu.run(RunControl.TIME_CHECK_INTERVAL + 10)
+		self.assertEqual(flushes[0], (RunControl.TIME_CHECK_INTERVAL, 'a'))
+		self.assertEqual(console.stream.getvalue(), 'a')
+
+	def test_print(self):
+		console = MemoryConsole(flushInterval=60)
+		cpu = CPU(image([
+			instruction(Opcodes.OP_PRINT, Opcodes.PARAM_IMMEDIATE << 5), ord('O'),
+			instruction(Opcodes.OP_PRINT, Opcodes.PARAM_IMMEDIATE << 5), ord('K'),
+			instruction(Opcodes.OP_HALT),
+		]), console=console)
+		cpu.run()
+		self.assertEqual(console.stream.getvalue(), 'OK')
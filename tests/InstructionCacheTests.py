@@ -0,0 +1,39 @@
+import unittest, sys
+sys.path.insert(0, '.')
+
+from simulator.Memory import Memory
+from simulator.InstructionCache import InstructionCache
+from common import Opcodes
+
+#MOV r1, 0x1234
+movInstruction = Opcodes.OP_MOV | (Opcodes.PARAM_REGISTER << 5 | 1) << 16 | (Opcodes.PARAM_IMMEDIATE << 5) << 24
+
+class InstructionCacheTest(unittest.TestCase):
+	def setUp(self):
+		self.memory = Memory()
+		self.memory.writeWord(0, movInstruction)
+		self.memory.writeWord(1, 0x1234)
+		self.cache = InstructionCache(self.memory)
+
+	def test_decode(self):
+		decoded = self.cache.fetch(0)
+		self.assertEqual(decoded, (Opcodes.OP_MOV, 0, 2, Opcodes.PARAM_REGISTER, 1, None, Opcodes.PARAM_IMMEDIATE, 0, 0x1234, 2))
+
+	def test_cached(self):
+		self.assertTrue(self.cache.fetch(0) is self.cache.fetch(0))
+
+	def test_invalidateOnWrite(self):
+		self.cache.fetch(0)
+		self.memory.writeWord(1, 0x4321)
+		self.assertEqual(self.cache.fetch(0)[8], 0x4321)
+
+	def test_invalidateDropsWatches(self):
+		self.cache.fetch(0)
+		self.memory.writeWord(0, movInstruction)
+
+		#no word of the dropped instruction stays covered or watched
+		self.assertEqual(self.cache.covering, {})
+		self.assertEqual(self.memory.writeWatches, {})
+
+	def test_invalidInstruction(self):
+		self.assertEqual(self.cache.fetch(0x1000), None)
@@ -0,0 +1,269 @@
+import unittest, sys, os, shutil, tempfile, StringIO
+from array import array
+sys.path.insert(0, '.')
+
+from assembler.Assembler import Assembler
+from linker.Linker import Linker
+from linker.MemoryImage import MemoryImage
+from linker.LinkState import LinkState, get_digest
+from linker.LinkerScript import LinkerScript
+from linker.Exceptions import LinkerError
+
+MAIN = """
+.SEGMENT vectors
+	.WORD function, value
+
+.SEGMENT data
+value:
+	.WORD 7
+"""
+
+LIBRARY = """
+.SEGMENT code
+.GLOBAL function
+function:
+	.WORD function
+"""
+
+def link(*sources, **options):
+	""" Assembles and links the sources, script is the text of a linker script and
+		the other options are passed to the Linker
+	"""
+	if 'script' in options:
+		options['script'] = LinkerScript.load(StringIO.StringIO(options['script']))
+
+	assembler = Assembler()
+	return Linker(**options).link([assembler.assemble(source) for source in sources])
+
+class LinkerTest(unittest.TestCase):
+	def test_link(self):
+		image, symboltables = link(MAIN, LIBRARY)
+
+		#vectors first, then code and data in alphabetical order
+		self.assertEqual(image.to_array(), array('I', [2, 3, 2, 7]))
+		self.assertEqual(symboltables, [{'value': 3}, {'function': 2}])
+
+	def test_undefinedImport(self):
+		self.assertRaises(LinkerError, link, MAIN)
+
+SCRIPT = """
+segment vectors at 0
+segment code align 0x10	# aligned after vectors
+reserve stack 4
+segment data at 0x20
+"""
+
+STACK_USER = """
+.SEGMENT data
+	.WORD stack
+"""
+
+#the vectors keep the empty segment from being collected
+EMPTY = """
+.SEGMENT vectors
+	.WORD first, hole, last
+
+.SEGMENT code
+first:
+	.WORD 1, 2, 3
+
+.SEGMENT empty
+hole:
+	.ALLOC 0
+
+.SEGMENT data
+last:
+	.WORD 5
+"""
+
+class LinkerScriptTest(unittest.TestCase):
+	def test_load(self):
+		script = LinkerScript.load(StringIO.StringIO(SCRIPT))
+		self.assertEqual([(entry.kind, entry.name, entry.size, entry.address, entry.alignment) for entry in script.entries], [
+			('segment', 'vectors', 0, 0, None),
+			('segment', 'code', 0, None, 0x10),
+			('reserve', 'stack', 4, None, None),
+			('segment', 'data', 0, 0x20, None),
+		])
+
+	def test_invalid(self):
+		for line in ("segment", "reserve stack", "segment code at", "segment code near 4", "align 0", "place code", "reserve stack -1"):
+			self.assertRaises(LinkerError, LinkerScript.load, StringIO.StringIO(line))
+
+	def test_layout(self):
+		image, symboltables = link(MAIN, LIBRARY, STACK_USER, script=SCRIPT)
+
+		expected = array('I', [0]) * 0x22
+		expected[0:2] = array('I', [0x10, 0x20])
+		expected[0x10] = 0x10
+		expected[0x20:0x22] = array('I', [7, 0x11])
+		self.assertEqual(image.to_array(), expected)
+		self.assertEqual(symboltables, [{'value': 0x20}, {'function': 0x10}, {}])
+
+	def test_remaining(self):
+		#segments without a statement follow the script, vectors first
+		image, symboltables = link(MAIN, LIBRARY, script="segment code at 8\nreserve stack 2")
+		self.assertEqual(image.to_array(), array('I', [0]) * 8 + array('I', [8, 0, 0, 8, 13, 7]))
+
+		#the empty script is the default layout
+		image, symboltables = link(MAIN, LIBRARY)
+		self.assertEqual(link(MAIN, LIBRARY, script="")[0].to_array(), image.to_array())
+
+	def test_overlap(self):
+		self.assertRaises(LinkerError, link, LIBRARY, script="segment code at 4\nreserve stack 4 at 2")
+		self.assertRaises(LinkerError, link, LIBRARY, script="segment code\nsegment code")
+
+	def test_unknownSegment(self):
+		self.assertRaises(LinkerError, link, MAIN, LIBRARY, script="segment txet at 0x400")
+
+	def test_emptyInside(self):
+		#an empty segment placed inside another one must not shift the written image
+		image, symboltables = link(EMPTY, script="segment vectors at 0\nsegment code at 3\nsegment empty at 4\nsegment data at 6")
+
+		with tempfile.TemporaryFile() as output:
+			image.write(output)
+			output.seek(0)
+			words = array('I')
+			words.fromstring(output.read())
+
+		self.assertEqual(words, array('I', [3, 4, 6, 1, 2, 3, 5]))
+		self.assertEqual(image.to_array(), words)
+
+	def test_reservedExport(self):
+		self.assertRaises(LinkerError, link, LIBRARY, script="reserve function 1")
+
+UNUSED = """
+.SEGMENT code
+.GLOBAL unused
+unused:
+	.WORD missing
+
+.SEGMENT data
+	.WORD unused
+"""
+
+class GarbageCollectionTest(unittest.TestCase):
+	def test_unreachable(self):
+		#the unused object's import of a missing symbol doesn't matter once it's dropped
+		image, symboltables = link(MAIN, LIBRARY, UNUSED, gc_sections=True)
+		self.assertEqual(image.to_array(), array('I', [2, 3, 2, 7]))
+		self.assertEqual(symboltables, [{'value': 3}, {'function': 2}, {}])
+
+	def test_entry(self):
+		self.assertRaises(LinkerError, link, MAIN, LIBRARY, UNUSED, gc_sections=True, entry_symbols=('unused',))
+
+		image, symboltables = link(LIBRARY, UNUSED.replace("missing", "0"), gc_sections=True, entry_symbols=('function',))
+		self.assertEqual(image.to_array(), array('I', [0]))
+		self.assertRaises(LinkerError, link, LIBRARY, gc_sections=True, entry_symbols=('nothing',))
+
+RELINKED_LIBRARY = """
+.SEGMENT code
+.GLOBAL function
+function:
+	.WORD function
+	.WORD 0
+"""
+
+LIBRARY_MOVED = """
+.SEGMENT code
+.GLOBAL function
+	.WORD 0
+function:
+	.WORD function
+"""
+
+class RelinkTest(unittest.TestCase):
+	def setUp(self):
+		self.assembler = Assembler()
+		self.directory = tempfile.mkdtemp()
+		self.imageFile = tempfile.NamedTemporaryFile()
+
+		objectFiles = [self.assembler.assemble(source) for source in (MAIN, RELINKED_LIBRARY)]
+		self.paths = [os.path.join(self.directory, name) for name in ('main.obj', 'library.obj')]
+		for (path, objectFile) in zip(self.paths, objectFiles):
+			with open(path, 'wb') as output:
+				objectFile.write(output)
+
+		linker = Linker()
+		image, symboltables = linker.link(objectFiles)
+		image.write(self.imageFile.file)
+		self.imageFile.flush()
+
+		self.state = LinkState.from_link(linker, self.paths, [get_digest(path) for path in self.paths], self.imageFile.name)
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def relink(self, source):
+		image = Linker().relink(self.state, {1: self.assembler.assemble(source)})
+		if image is not None:
+			image.patch(self.imageFile.file)
+			self.imageFile.flush()
+		return image
+
+	def readImage(self):
+		words = array('I')
+		with open(self.imageFile.name, 'rb') as imageFile:
+			words.fromstring(imageFile.read())
+		return words
+
+	def test_relink(self):
+		self.assertNotEqual(self.relink(LIBRARY_MOVED), None)
+
+		#the moved export is repatched in the unchanged object
+		image, symboltables = Linker().link([self.assembler.assemble(source) for source in (MAIN, LIBRARY_MOVED)])
+		self.assertEqual(self.readImage(), image.to_array())
+		self.assertEqual(self.state.get_symbol_tables(), symboltables)
+		self.assertEqual(self.state.get_exports(), {'function': 3})
+
+	def test_sizeChanged(self):
+		self.assertEqual(self.relink(LIBRARY_MOVED + "\t.WORD 0\n"), None)
+
+	def test_changed(self):
+		self.assertTrue(self.state.matches(self.paths, self.imageFile.name))
+		self.assertFalse(self.state.matches(self.paths[::-1], self.imageFile.name))
+		self.assertEqual(self.state.get_changed(self.state.get_digests(self.paths)), [])
+
+		with open(self.paths[1], 'wb') as output:
+			self.assembler.assemble(LIBRARY_MOVED).write(output)
+		self.assertEqual(self.state.get_changed(self.state.get_digests(self.paths)), [1])
+
+class MemoryImageTest(unittest.TestCase):
+	def test_write(self):
+		image = MemoryImage(6)
+		image.place(4, array('I', [3]), 'b')
+		image.place(0, array('I', [1, 2]), 'a')
+		image.check_overlaps()
+
+		with tempfile.TemporaryFile() as output:
+			image.write(output)
+			output.seek(0)
+			words = array('I')
+			words.fromstring(output.read())
+
+		self.assertEqual(words, array('I', [1, 2, 0, 0, 3, 0]))
+		self.assertEqual(image.to_array(), words)
+
+	def test_sparse(self):
+		image = MemoryImage(0x1800)
+		image.place(0x1000, array('I', [1]), 'a')
+		image.check_overlaps()
+
+		with tempfile.TemporaryFile() as output:
+			image.write(output)
+			output.seek(0)
+			words = array('I')
+			words.fromstring(output.read())
+
+		self.assertEqual(words, image.to_array())
+
+	def test_overlap(self):
+		image = MemoryImage(4)
+		image.place(0, array('I', [1, 2]), 'a')
+		image.place(1, array('I', [3]), 'b')
+		self.assertRaises(LinkerError, image.check_overlaps)
+
+	def test_exceedsImage(self):
+		image = MemoryImage(2)
+		image.place(1, array('I', [1, 2]), 'a')
+		self.assertRaises(LinkerError, image.check_overlaps)
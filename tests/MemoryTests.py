@@ -1,4 +1,4 @@
-import unittest, sys
+import unittest, sys, struct, tempfile
 sys.path.insert(0, '.')
 
 from simulator import Memory
@@ -29,3 +29,68 @@ class MemoryTest(unittest.TestCase):
 	def test_readInstruction(self):
 		instruction = self.memory.readInstruction(2)
 		self.assertEqual(instruction, 0x123456789ABCDEF0)
+
+class MemoryImageTest(unittest.TestCase):
+	def setUp(self):
+		self.image = struct.pack("<III", 1, 0xFFFFFFFE, 3)
+		self.memory = Memory.Memory.createFromBinaryString(self.image)
+
+	def test_readImage(self):
+		self.assertEqual(self.memory.readRange(0, 4), [1, 0xFFFFFFFE, 3, 0xFFFFFFFF])
+
+	def test_copyOnWrite(self):
+		self.memory.writeWord(1, 0x80000000)
+		self.assertEqual(self.memory.readRange(0, 4), [1, 0x80000000, 3, 0xFFFFFFFF])
+		self.assertEqual(self.image, struct.pack("<III", 1, 0xFFFFFFFE, 3))
+
+	def test_readUnmappedPage(self):
+		self.assertEqual(self.memory.readWord(Memory.PAGE_SIZE * 5), 0xFFFFFFFF)
+		self.assertEqual(len(self.memory.pages), 0)
+
+	def test_createFromFile(self):
+		imageFile = tempfile.TemporaryFile()
+		imageFile.write(self.image)
+		imageFile.flush()
+
+		memory = Memory.Memory.createFromFile(imageFile)
+		memory.writeWord(0, 0x12345678)
+		self.assertEqual(memory.readRange(0, 3), [0x12345678, 0xFFFFFFFE, 3])
+
+		imageFile.seek(0)
+		self.assertEqual(imageFile.read(), self.image)
+
+	def test_snapshot(self):
+		self.memory.writeWord(0, 5)
+		snapshot = self.memory.snapshot()
+
+		self.memory.writeWord(0, 6)
+		self.memory.writeWord(Memory.PAGE_SIZE * 3, 7)
+		self.assertEqual(snapshot.pages[0][0], 5)
+
+		older = snapshot
+		snapshot = self.memory.snapshot()
+		self.memory.writeWord(1, 8)
+
+		self.memory.restore(snapshot)
+		self.assertEqual(self.memory.readRange(0, 2), [6, 0xFFFFFFFE])
+
+		written = []
+		self.memory.addWriteWatch(Memory.PAGE_SIZE * 3, written.append)
+		self.memory.restore(older)
+		self.assertEqual(self.memory.readRange(0, 2), [5, 0xFFFFFFFE])
+		self.assertEqual(self.memory.readWord(Memory.PAGE_SIZE * 3), 0xFFFFFFFF)
+		self.assertEqual(written, [Memory.PAGE_SIZE * 3])
+
+	def test_restoreNotifiesChangedPages(self):
+		snapshot = self.memory.snapshot()
+		written = []
+		self.memory.addWriteWatch(1, written.append)
+		self.memory.addWriteWatch(Memory.PAGE_SIZE * 5, written.append)
+
+		#only the watch on the written page is notified
+		self.memory.writeWord(Memory.PAGE_SIZE * 5 + 1, 3)
+		self.memory.restore(snapshot)
+		self.assertEqual(written, [Memory.PAGE_SIZE * 5])
+
+		self.memory.removeWriteWatch(Memory.PAGE_SIZE * 5, written.append)
+		self.assertEqual(self.memory.watchedPages, {0: set([1])})
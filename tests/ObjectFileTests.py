@@ -0,0 +1,83 @@
+import unittest, sys, tempfile, pickle, struct, copy
+from array import array
+sys.path.insert(0, '.')
+
+from assembler.Assembler import Assembler
+from assembler.ObjectFile import ObjectFile
+from assembler.Exceptions import ObjectFileError
+
+SOURCE = """
+.SEGMENT code
+.GLOBAL start
+start:
+	MOV r0, value
+	CALL external
+	HALT
+
+.SEGMENT data
+value:
+	.WORD 1, start, external
+	.STRING "hi"
+	.ALLOC 2
+"""
+
+class ObjectFileTest(unittest.TestCase):
+	def setUp(self):
+		self.obj = Assembler().assemble(SOURCE)
+		self.obj.name = 'test'
+
+	def assertSameObject(self, loaded):
+		self.assertEqual(loaded.name, self.obj.name)
+		self.assertEqual(dict(loaded.seg_data), dict(self.obj.seg_data))
+		self.assertEqual(loaded.export_table, self.obj.export_table)
+		#sites are stored grouped, so the tables keep their entries but not their order
+		self.assertEqual(loaded.getImportSites(), self.obj.getImportSites())
+		self.assertEqual(loaded.getRelocationSites(), self.obj.getRelocationSites())
+		self.assertEqual(sorted(loaded.import_table), sorted(self.obj.import_table))
+		self.assertEqual(sorted(loaded.reloc_table), sorted(self.obj.reloc_table))
+		self.assertEqual(loaded.symbol_table, self.obj.symbol_table)
+
+	def test_segments(self):
+		self.assertEqual(self.obj.seg_data['data'], array('I', [1, 0, 0, ord('h'), ord('i'), 0, 0, 0]))
+
+	def test_sites(self):
+		self.assertEqual(self.obj.getImportSites(), {('external', 'code'): array('I', [3]), ('external', 'data'): array('I', [2])})
+		self.assertEqual(self.obj.getRelocationSites(), {('data', 'code'): array('I', [1]), ('code', 'data'): array('I', [1])})
+
+	def test_withSegments(self):
+		code = self.obj.withSegments(['code'])
+		self.assertEqual(code.seg_data.keys(), ['code'])
+		self.assertEqual(code.getImportSites(), {('external', 'code'): array('I', [3])})
+		self.assertEqual(code.getRelocationSites(), {('data', 'code'): array('I', [1])})
+		self.assertEqual([export.export_symbol for export in code.export_table], ['start'])
+		self.assertEqual(sorted(code.symbol_table), ['start'])
+
+	def test_roundTrip(self):
+		with tempfile.TemporaryFile() as objectFile:
+			self.obj.write(objectFile)
+			self.assertSameObject(ObjectFile.createFromFile(objectFile))
+
+	def test_empty(self):
+		self.obj = ObjectFile()
+		self.assertEqual(self.obj.withSegments([]).symbol_table, {})
+
+		with tempfile.TemporaryFile() as objectFile:
+			self.obj.write(objectFile)
+			self.assertSameObject(ObjectFile.createFromFile(objectFile))
+
+	def test_pickled(self):
+		with tempfile.TemporaryFile() as objectFile:
+			#older versions pickled segments as lists of packed words
+			pickled = copy.copy(self.obj)
+			pickled.seg_data = dict((segment, [struct.pack("<I", word) for word in words]) for (segment, words) in self.obj.seg_data.iteritems())
+			pickle.dump(pickled, objectFile)
+			self.assertSameObject(ObjectFile.createFromFile(objectFile))
+
+	def test_version(self):
+		for version in (1, 0x63):
+			with tempfile.TemporaryFile() as objectFile:
+				self.obj.write(objectFile)
+				objectFile.seek(8)
+				objectFile.write(struct.pack("<I", version))
+				objectFile.flush()
+				self.assertRaises(ObjectFileError, ObjectFile.createFromFile, objectFile)
@@ -1,7 +1,8 @@
-import unittest, sys
+import unittest, sys, os, shutil, tempfile
 sys.path.insert(0, '.')
 
 from assembler.Parser import Parser
+from assembler import TableCache
 
 test = r""".segment text
 .global main
@@ -29,3 +30,42 @@ class MemoryTest(unittest.TestCase):
 
 	def test_parse(self):
 		print(self.parser.parse(test))
+
+class TableCacheTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.previous = os.environ.get(TableCache.CACHE_DIRECTORY_VARIABLE)
+		os.environ[TableCache.CACHE_DIRECTORY_VARIABLE] = self.directory
+
+	def tearDown(self):
+		if self.previous is None:
+			del os.environ[TableCache.CACHE_DIRECTORY_VARIABLE]
+		else:
+			os.environ[TableCache.CACHE_DIRECTORY_VARIABLE] = self.previous
+		shutil.rmtree(self.directory)
+
+	def test_cachedTables(self):
+		source = "main:\n\tMOV r0, 1\n\tHALT\n"
+		parsed = Parser().parse(source)
+		self.assertEqual(len(os.listdir(self.directory)), 2)
+
+		#the second parser loads the cached tables and can parse any number of files
+		parser = Parser()
+		self.assertEqual(parser.parse(source), parsed)
+		self.assertEqual(parser.parse(source), parsed)
+		self.assertEqual(parsed[-1].lineno, 3)
+
+	def test_tableName(self):
+		#the parser tables depend on the tokens of the lexer as well
+		grammar = os.path.join(self.directory, 'grammar.py')
+		tokens = os.path.join(self.directory, 'tokens.py')
+		for (path, text) in ((grammar, "grammar"), (tokens, "tokens = ('ID',)")):
+			with open(path, 'w') as source:
+				source.write(text)
+
+		name = TableCache.getTableName('parsetab', grammar, tokens)
+		self.assertNotEqual(name, TableCache.getTableName('parsetab', grammar))
+
+		with open(tokens, 'w') as source:
+			source.write("tokens = ('ID', 'HEX')")
+		self.assertNotEqual(TableCache.getTableName('parsetab', grammar, tokens), name)
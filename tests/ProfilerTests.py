@@ -0,0 +1,77 @@
+import unittest, sys, StringIO
+sys.path.insert(0, '.')
+
+from simulator.CPU import CPU
+from simulator.Profiler import Profiler
+from simulator.Trace import RecordingTracer, TracerChain, TRACE_STEP, TRACE_INTERRUPT
+from utils.SymbolMap import SymbolMap
+from common import Opcodes
+
+from CPUTests import instruction, image
+
+class ProfilerTest(unittest.TestCase):
+	def test_counts(self):
+		profiler = Profiler()
+		cpu = CPU(image([
+			instruction(Opcodes.OP_NOP),
+			instruction(Opcodes.OP_JMP, Opcodes.PARAM_IMMEDIATE << 5), 0,
+		]), tracer=profiler)
+		cpu.run(5)
+
+		self.assertEqual(profiler.getSteps(), 5)
+		self.assertEqual(profiler.hypervisorSteps, 5)
+		self.assertEqual(profiler.getHotAddresses(2), [(0, 3), (1, 2)])
+		self.assertEqual(profiler.opcodeCounts[Opcodes.OP_NOP], 3)
+		self.assertEqual(profiler.opcodeCounts[Opcodes.OP_JMP], 2)
+
+	def test_highAddresses(self):
+		#address counters only exist for the executed pages, time is sampled every other step
+		profiler = Profiler(timeSampleInterval=2)
+		cpu = CPU(image([instruction(Opcodes.OP_JMP, Opcodes.PARAM_IMMEDIATE << 5), 0x10000000]), tracer=profiler)
+		cpu.memory.writeWord(0x10000000, instruction(Opcodes.OP_NOP))
+		cpu.memory.writeWord(0x10000001, instruction(Opcodes.OP_NOP))
+		cpu.run(3)
+
+		self.assertEqual(sorted(profiler.addressCounts), [0, 0x10000000 >> 10])
+		self.assertEqual(profiler.getHotAddresses(3), [(0x10000001, 1), (0x10000000, 1), (0, 1)])
+		self.assertEqual(sum(profiler.opcodeSamples), 1)
+		self.assertEqual(profiler.opcodeSamples[Opcodes.OP_NOP], 1)
+
+	def test_interrupts(self):
+		profiler = Profiler()
+		cpu = CPU(image([instruction(0xFE)]), tracer=profiler)
+		cpu.state.setRegister(30, 0x100)
+		cpu.run(1)
+
+		self.assertEqual(profiler.interruptCounts[Opcodes.INTR_INVALID_INSTR], 1)
+		self.assertIn("Interrupt %d: 1" % Opcodes.INTR_INVALID_INSTR, profiler.report())
+
+	def test_chained(self):
+		#a profiler chained with another tracer doesn't take its events away
+		profiler = Profiler()
+		recorder = RecordingTracer()
+		cpu = CPU(image([instruction(Opcodes.OP_NOP), instruction(0xFE)]), tracer=TracerChain([recorder, profiler]))
+		cpu.state.setRegister(30, 0x100)
+		cpu.run(2)
+
+		self.assertEqual([event.kind for event in recorder.events], [TRACE_STEP, TRACE_STEP, TRACE_INTERRUPT])
+		self.assertEqual(profiler.getSteps(), 2)
+		self.assertEqual(profiler.interruptCounts[Opcodes.INTR_INVALID_INSTR], 1)
+
+class SymbolMapTest(unittest.TestCase):
+	def test_lookup(self):
+		symbols = SymbolMap.createFromFile(StringIO.StringIO("#a.o\nstart 00000010\nloop 00000018\n\n#b.o\nprint 00000040\n"))
+
+		self.assertEqual(symbols.lookup(0x8), (None, 0x8))
+		self.assertEqual(symbols.lookup(0x10), ('start', 0))
+		self.assertEqual(symbols.lookup(0x1A), ('loop', 2))
+		self.assertEqual(symbols.symbolize(0x100), 'print+0xc0')
+		self.assertEqual(symbols.symbolize(0x4), '0x00000004')
+
+	def test_duplicateLabels(self):
+		#local labels of different objects keep their own addresses
+		symbols = SymbolMap.createFromFile(StringIO.StringIO("#a.o\nhang 00000040\nvectors 00000000\n\n#b.o\nhang 00000100\nprintstring 000000ce\n"))
+		self.assertEqual(symbols.symbolize(0x40), 'hang')
+		self.assertEqual(symbols.symbolize(0x44), 'hang+0x4')
+		self.assertEqual(symbols.symbolize(0x100), 'hang')
+		self.assertEqual(symbols.symbolize(0xd0), 'printstring+0x2')
@@ -5,6 +5,15 @@ import unittest
 import MemoryTests
 import LexerTests
 import ParserTests
+import InstructionCacheTests
+import CPUTests
+import BlockEngineTests
+import ConsoleTests
+import BatchTests
+import ProfilerTests
+import ObjectFileTests
+import LinkerTests
+import AssembleTests
 
 if __name__ == '__main__':
 	testSuite = unittest.TestSuite()
@@ -14,6 +23,15 @@ if __name__ == '__main__':
 		testLoader.loadTestsFromModule(MemoryTests),
 		testLoader.loadTestsFromModule(LexerTests),
 		testLoader.loadTestsFromModule(ParserTests),
+		testLoader.loadTestsFromModule(InstructionCacheTests),
+		testLoader.loadTestsFromModule(CPUTests),
+		testLoader.loadTestsFromModule(BlockEngineTests),
+		testLoader.loadTestsFromModule(ConsoleTests),
+		testLoader.loadTestsFromModule(BatchTests),
+		testLoader.loadTestsFromModule(ProfilerTests),
+		testLoader.loadTestsFromModule(ObjectFileTests),
+		testLoader.loadTestsFromModule(LinkerTests),
+		testLoader.loadTestsFromModule(AssembleTests),
 	])
 
 	unittest.TextTestRunner().run(testSuite)
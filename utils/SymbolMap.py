@@ -0,0 +1,47 @@
+import bisect
+
+class SymbolMap(object):
+	""" Maps addresses to the nearest preceding symbol of a map file written by link.py -m.
+		Symbols are kept as (address, name) pairs, local labels of different objects
+		may have the same name.
+	"""
+
+	def __init__(self, symbols=None):
+		self.addresses = []
+		self.names = []
+
+		if symbols is not None:
+			for (address, name) in sorted((address, name) for (name, address) in symbols):
+				self.addresses.append(address)
+				self.names.append(name)
+
+	@classmethod
+	def createFromFile(cls, mapFile):
+		""" Reads a map file, the (name, address) pairs of all object sections are merged """
+		symbols = []
+		for line in mapFile:
+			line = line.strip()
+			if len(line) == 0 or line.startswith("#"):
+				continue
+
+			(name, address) = line.split()
+			symbols.append((name, int(address, 16)))
+
+		return cls(symbols)
+
+	def lookup(self, address):
+		""" Returns (symbol name, offset) of the symbol covering address or (None, address) """
+		index = bisect.bisect_right(self.addresses, address) - 1
+		if index < 0:
+			return (None, address)
+
+		return (self.names[index], address - self.addresses[index])
+
+	def symbolize(self, address):
+		(name, offset) = self.lookup(address)
+		if name is None:
+			return "0x%08x" % address
+		elif offset == 0:
+			return name
+		else:
+			return "%s+0x%x" % (name, offset)